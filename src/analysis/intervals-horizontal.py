@@ -1,21 +1,48 @@
 from music21 import *
+import argparse
+import functools
 import os
+import sys
+from typing import Any, Dict, List
+
+import scan
+
+# the compiled model files are read by Ur
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ur'))
+import markovfile
 
 # run this script to analyze horizontal interval frequencies in "The Scared Harp" collection
+# (each score is parsed once, in a pool of worker processes, and counted for its mode)
+
+MODES = ['major', 'minor']
 
+# version of the counts of a file, to bump when they change (the stored counts are then discarded)
+COUNTS = 2
 
-def compute_interval_freqs(s: stream.base.Score, freqs_list: List[dict[str, dict[str, int]]]):
+
+def compute_interval_freqs(s: stream.base.Score, freqs_list: List[dict[str, dict[str, int]]], initial_list: List[dict[str, int]],
+                           ngrams_list: List[dict[tuple, int]], order: int):
    
     start = 0
     if len(s.parts) == 3: # we have: (alto, tenor, bass)
         start = 1   
     for (p_ind, p) in enumerate(s.parts, start):
-        for n in p.flatten().notes:
+        notes = p.flatten().notes
+        if notes:
+            first_pitch = str(notes[0].pitches[0])
+            initial_list[p_ind][first_pitch] = initial_list[p_ind].get(first_pitch, 0) + 1
+        # sequences of 1 to order pitches, for the higher-order models
+        pitches = [str(n.pitches[0]) for n in notes]
+        for k in range(1, order + 1):
+            for i in range(len(pitches) - k + 1):
+                g = tuple(pitches[i:i + k])
+                ngrams_list[p_ind][g] = ngrams_list[p_ind].get(g, 0) + 1
+        for n in notes:
             succ = n.next("Note")
             if succ == None:
                 continue
-            this_pitch = n.pitches[0]
-            next_pitch = succ.pitches[0] #if n or succ are chords (i.e., divisi [found rarely and only in octaves], just take the first)
+            this_pitch = str(n.pitches[0])
+            next_pitch = str(succ.pitches[0]) #if n or succ are chords (i.e., divisi [found rarely and only in octaves], just take the first)
             
             if this_pitch not in freqs_list[p_ind].keys():
                 freqs_list[p_ind][this_pitch] = {}
@@ -39,34 +66,67 @@ def normalize_key(s, mode, tonic):
     return s.transpose(i)
 
 
-def analyze_corpus(corpus_path: str, mode: str) -> List[dict[str, dict[str, float]]]:
-    '''analyze horizontal interval frequencies
-    conditioned on one predecessor
-    mode: restricts the pieces that contribute to frequencies ('Major' or 'Minor')
-    '''
-    freqs_list = [{}, {}, {}, {}]
+def empty_counts() -> Dict[str, Dict[str, List[dict]]]:
+    return {mode: {'transitions': [{}, {}, {}, {}], 'initial': [{}, {}, {}, {}], 'ngrams': [{}, {}, {}, {}]} for mode in MODES}
+
 
-    print(corpus_path)
-    for filename in os.listdir(corpus_path):
-        f = os.path.join(corpus_path, filename)
-        print('<==', filename)
-        if os.path.isfile(f):
-            s = converter.parse(f)
-            k = s.analyze('key')
-            if mode == k.mode:
-                normalized_s = normalize_key(s, k.mode, k.tonic)
-                compute_interval_freqs(normalized_s, freqs_list)
+def analyze_file(f: str, order: int = 1) -> Dict[str, Dict[str, List[dict]]]:
+    '''count horizontal intervals, first pitches and sequences of up to order pitches of a score,
+    for its mode (the counts of the other mode stay empty)
+    '''
+    counts = empty_counts()
+    s = converter.parse(f)
+    k = s.analyze('key')
+    if k.mode in counts:
+        normalized_s = normalize_key(s, k.mode, k.tonic)
+        c = counts[k.mode]
+        compute_interval_freqs(normalized_s, c['transitions'], c['initial'], c['ngrams'], order)
+    return counts
 
 
-    # normalize absolute frequencies to get probabilites
+def normalize(freqs_list: List[dict[str, dict[str, int]]]) -> List[dict[str, dict[str, float]]]:
+    '''normalize absolute frequencies to get probabilites
+    '''
     for freqs in freqs_list:
         for (_, p_successors) in freqs.items():
             s = sum(p_successors.values())
             for (n, f) in p_successors.items():
                 p_successors[n] = f / s
-    
     return freqs_list
 
+
+def normalize_initial(initial_list: List[dict[str, int]]) -> List[dict[str, float]]:
+    '''normalize first pitch frequencies to get probabilities
+    '''
+    return [{n: f / sum(initial.values()) for (n, f) in initial.items()} for initial in initial_list]
+
+
+def analyze_corpus(corpus_path: str, workers: int = None, order: int = 1, store: str = None) -> Dict[str, Dict[str, List[dict]]]:
+    '''analyze horizontal interval frequencies
+    conditioned on one predecessor, first pitch frequencies, and counts of sequences of up to order pitches,
+    for both modes ('major' and 'minor') in a single pass
+    (with the counts of the unchanged files taken from the count store, if any)
+    '''
+    counts = scan.scan(corpus_path, functools.partial(analyze_file, order=order), workers,
+                       store, f'horizontal {COUNTS} order {order}') or empty_counts()
+    return {mode: {'transitions': normalize(c['transitions']), 'initial': normalize_initial(c['initial']), 'ngrams': c['ngrams']}
+            for (mode, c) in counts.items()}
+
+def model_tables(freqs: dict[str, dict[str, float]], initial: dict[str, float], ngrams: dict[tuple, int]) -> Dict[str, Any]:
+    '''the tables of a compiled Markov model (see markovfile.py): all successors, first pitches as weighted initial states,
+    and the sequences of more than one pitch for higher orders
+    '''
+    states = list(freqs)
+    tables = {
+        'STATES': states,
+        'INITIAL': initial,
+        'FINAL': states,
+        'TRANSITIONS': {n: dict(sorted(succ.items())) for (n, succ) in freqs.items()},
+    }
+    if any(len(g) > 1 for g in ngrams):
+        tables['NGRAMS'] = ngrams
+    return tables
+
 def pretty(class_name, freqs, nb=15):
     freqs_sorted = [(n, sorted(list(succ.items()), key=lambda f:str(f[0]))) for (n, succ) in freqs.items()]
 
@@ -93,8 +153,25 @@ def pretty(class_name, freqs, nb=15):
 
 voice_names = ["S", "A", "T", "B"]
 
-dir_path = os.path.join(os.getcwd(), 'data/1991-denson')
-for mode in ["Major", "Minor"]:
-    freqs_list = analyze_corpus(dir_path, mode.lower())
-    for (i, freqs) in enumerate(freqs_list):
-        print(pretty(f"Melody{mode}{voice_names[i]}", freqs))
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Horizontal interval frequencies of a corpus, by mode and voice')
+    parser.add_argument('corpus', nargs='?', default=os.path.join(os.getcwd(), 'data/1991-denson'), help='corpus directory (default: data/1991-denson)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: %(default)s)')
+    parser.add_argument('--model', help='also write the tables as a compiled Markov model file (e.g. data/models/melody.urm)')
+    parser.add_argument('--order', type=int, default=3, help='count the sequences of up to this many pitches, written with --model for Markov producers of this order (default: %(default)s)')
+    parser.add_argument('--store', help='count store of the analyzed files (default: <corpus>.horizontal.store)')
+    parser.add_argument('--no-store', action='store_true', help='analyze all files, without count store')
+    args = parser.parse_args()
+
+    store = None if args.no_store else args.store or scan.store_path(args.corpus, 'horizontal')
+    freqs_by_mode = analyze_corpus(args.corpus, args.workers, args.order, store)
+    models = {}
+    for mode in ["Major", "Minor"]:
+        analysis = freqs_by_mode[mode.lower()]
+        for (i, freqs) in enumerate(analysis['transitions']):
+            print(pretty(f"Melody{mode}{voice_names[i]}", freqs))
+            models[f"Melody{mode}{voice_names[i]}"] = model_tables(freqs, analysis['initial'][i], analysis['ngrams'][i])
+
+    if args.model:
+        markovfile.write(args.model, models, os.path.basename(os.path.normpath(args.corpus)))
+        print('==>', args.model)
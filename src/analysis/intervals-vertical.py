@@ -1,63 +1,167 @@
 from music21 import *
+import argparse
+import functools
 import os
+import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import scan
+
+# MIDI files are read by Ur's reader
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ur'))
+import midi
+import music
 
 # run this script to analyze vertical interval frequencies in "The Scared Harp" collection
+# (each score is parsed in a pool of worker processes, and converted to a piano roll of all its sonorities)
+
+# parts sung an octave lower/higher too, by number of voices
+# (treble part is also sung by men, tenor part is also sung by women)
+DOUBLINGS = {
+    4: [(0, -1), (2, 1)],
+    3: [(1, 1)],
+}
+
+# version of the counts of a file, to bump when they change (the stored counts are then discarded)
+COUNTS = 2
+
+# grid of the onsets and durations read from MIDI files, in quarters (sixteenths and eighth triplets, as music21)
+QUANTIZATION = (4, 3)
+
+# the notes of a part, as (start, end, pitch name)
+Notes = List[Tuple[float, float, str]]
+
+
+def parts_from_score(s: stream.base.Score) -> List[Notes]:
+    '''the notes of each part of a music21 score
+    '''
+    return [[(float(n.offset), float(n.offset + n.quarterLength), n.pitches[0].nameWithOctave)
+             for n in p.flatten().notes if n.quarterLength > 0] for p in s.parts]
 
-def compute_interval_freqs(s: stream.base.Score, interval_freqs: dict[list[str], int]):
-    '''takes score s as input and make it contribute to a dictionary of absolute 
-    interval frequencies, interval_freqs
+
+def quantize(t: float) -> float:
+    '''nearest position on the grid (the coarser grid on ties)
     '''
-    parts = [p.flatten() for p in s.parts]
+    return min((round(t * d) / d for d in QUANTIZATION), key=lambda q: (abs(q - t), q))
 
-    d = s.highestTime # get piece duration
 
-    for b in range(int(d)):
-        pitch_list = []
-        num_voices = len(parts)
-        
-        for i in range(num_voices):
-            n = parts[i].getElementAtOrBefore(b)
-            if not n.isNote:
+def parts_from_midi(f: str) -> List[Notes]:
+    '''the notes of each track of a MIDI file (without music21), quantized;
+    as with music21, notes starting and ending together (within the quantization tolerance) are a chord,
+    of which the first pitch is kept
+    '''
+    tolerance = 1 / max(QUANTIZATION)
+    parts = []
+    for track in midi.read(f):
+        if not len(track):
+            continue
+        notes = []
+        gathered = [False] * len(track)
+        events = list(zip(track.onsets, track.durations, track.pitches))
+        for (i, (onset, duration, pitch)) in enumerate(events):
+            if gathered[i]:
                 continue
-            pitch_list.append(n.pitch)
-            if num_voices == 4 and i == 0:
-                pitch_list.append(n.pitch.transpose('-P8')) # treble part is also sung by men
-            elif num_voices == 4 and i == 2:
-                pitch_list.append(n.pitch.transpose('P8')) # tenor part is also sung by women
-            elif num_voices == 3 and i == 1:
-                pitch_list.append(n.pitch.transpose('P8')) # tenor part is also sung by women
-        if pitch_list == []:
+            for j in range(i + 1, len(events)):
+                if abs(events[j][0] - onset) >= tolerance:
+                    break
+                if abs(events[j][0] + events[j][1] - onset - duration) <= tolerance:
+                    gathered[j] = True
+            start, length = quantize(onset), quantize(duration)
+            if length > 0:
+                notes.append((start, start + length, music.midi_name(pitch)))
+        parts.append(sorted(notes, key=lambda n: n[0]))
+    return parts
+
+
+def piano_roll(parts: List[Notes]) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    '''onset-aligned piano roll of the notes of the parts of a score:
+    the time axis is split at every note start and end of any part
+
+    returns: the slice boundaries (offsets, one more than the slices),
+    the pitches (voices x slices, as indexes in the pitch names, -1 when a voice is silent), and the pitch names
+    (doubled parts come as additional voices)
+    '''
+    times = np.unique([t for notes in parts for (start, end, _) in notes for t in (start, end)])
+    names: List[str] = []
+    codes: Dict[str, int] = {}
+
+    def code(name: str) -> int:
+        if name not in codes:
+            codes[name] = len(names)
+            names.append(name)
+        return codes[name]
+
+    roll = np.full((len(parts), max(len(times) - 1, 0)), -1, dtype=np.int32)
+    for (i, notes) in enumerate(parts):
+        if not notes:
             continue
-        # find simplest enharmonic variant of the pitches
-        # (otherwise, wrong intervals might be obtained, i.e., consider the chord D#, G#, C 
-        # in an E flat major piece)
-        pitch_list = analysis.enharmonics.EnharmonicSimplifier(pitch_list).bestPitches()
-        c = chord.Chord(pitch_list)
-        # identify and remove the lowest note
-        bass = c.bass()
-        c.remove(bass)
-        # compute all intervals to bass, reduced to range P1-M7
-        intervals = { interval.Interval(bass, n).simpleName for n in c.notes }
-        intervals_immtbl = frozenset(intervals)
-        if intervals_immtbl not in interval_freqs.keys():
-            interval_freqs[intervals_immtbl] = 1
-        else:
-            interval_freqs[intervals_immtbl] = interval_freqs[intervals_immtbl] + 1
-
-
-def analyze_corpus(corpus_path: str) -> dict[list[str], float]:
-    '''compute dictionary of interval combinations and associated relative  
-    frequencies for a corpus stored in corpus_path
+        starts = np.searchsorted(times, [start for (start, _, _) in notes])
+        lengths = np.searchsorted(times, [end for (_, end, _) in notes]) - starts
+        # all slices covered by each note
+        slices = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        roll[i, slices] = np.repeat([code(name) for (_, _, name) in notes], lengths)
+
+    doubled = []
+    for (i, octaves) in DOUBLINGS.get(len(parts), []):
+        shifted = np.array([code(name.rstrip('0123456789') + str(int(name[len(name.rstrip('0123456789')):]) + octaves))
+                            for name in list(names)] + [-1], dtype=np.int32)
+        doubled.append(shifted[roll[i]])
+    return (times, np.vstack([roll] + doubled), names)
+
+
+@functools.lru_cache(maxsize=None)
+def interval_set(pitches: Tuple[str, ...]) -> frozenset:
+    '''intervals to the bass of a sonority, reduced to range P1-M7 (memoized by pitch set)
+    '''
+    # find simplest enharmonic variant of the pitches
+    # (otherwise, wrong intervals might be obtained, i.e., consider the chord D#, G#, C 
+    # in an E flat major piece)
+    pitch_list = analysis.enharmonics.EnharmonicSimplifier([pitch.Pitch(p) for p in pitches]).bestPitches()
+    c = chord.Chord(pitch_list)
+    # identify and remove the lowest note
+    bass = c.bass()
+    c.remove(bass)
+    return frozenset(interval.Interval(bass, n).simpleName for n in c.notes)
+
+
+def compute_interval_freqs(parts: List[Notes], interval_freqs: dict[list[str], float]):
+    '''takes the notes of the parts of a score as input and make them contribute to a dictionary of interval frequencies,
+    interval_freqs, weighting each sonority by its duration (in quarters)
+    '''
+    times, roll, names = piano_roll(parts)
+    if roll.size == 0:
+        return
+
+    # the distinct sonorities (sorted pitch indexes of each slice, silent voices first) and their total durations
+    sonorities, inverse = np.unique(np.sort(roll.T, axis=1), axis=0, return_inverse=True)
+    durations = np.bincount(inverse.ravel(), weights=np.diff(times), minlength=len(sonorities))
+
+    for (sonority, d) in zip(sonorities, durations):
+        pitches = tuple(sorted(names[i] for i in sonority if i >= 0))
+        if not pitches:
+            continue
+        intervals_immtbl = interval_set(pitches)
+        interval_freqs[intervals_immtbl] = interval_freqs.get(intervals_immtbl, 0.0) + float(d)
+
+
+def analyze_file(f: str) -> dict[list[str], float]:
+    '''count the interval combinations of a score
+    (MIDI files are read directly, other formats are parsed with music21)
     '''
     interval_freqs = {}
+    parts = parts_from_midi(f) if f.lower().endswith(('.mid', '.midi')) else parts_from_score(converter.parse(f))
+    compute_interval_freqs(parts, interval_freqs)
+    return interval_freqs
 
-    print(corpus_path)
-    for filename in os.listdir(corpus_path):
-        f = os.path.join(corpus_path, filename)
-        print('<==', filename)
-        if os.path.isfile(f):
-            s = converter.parse(f)
-            compute_interval_freqs(s, interval_freqs)
+
+def analyze_corpus(corpus_path: str, workers: int = None, store: str = None) -> dict[list[str], float]:
+    '''compute dictionary of interval combinations and associated relative  
+    frequencies for a corpus stored in corpus_path
+    (with the counts of the unchanged files taken from the count store, if any)
+    '''
+    interval_freqs = scan.scan(corpus_path, analyze_file, workers, store, f'vertical {COUNTS}') or {}
 
     # normalize absolute frequencies to get probabilites
     s = sum(interval_freqs.values())
@@ -74,6 +178,14 @@ def pretty(freqs, nb=15):
 
     return s
 
-dir_path = os.path.join(os.path.dirname(__file__), 'data/the-scared-harp')
-freqs = analyze_corpus(dir_path)
-print(pretty(freqs))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vertical interval frequencies of a corpus')
+    parser.add_argument('corpus', nargs='?', default=os.path.join(os.getcwd(), 'data/the-scared-harp'), help='corpus directory (default: data/the-scared-harp)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: %(default)s)')
+    parser.add_argument('--store', help='count store of the analyzed files (default: <corpus>.vertical.store)')
+    parser.add_argument('--no-store', action='store_true', help='analyze all files, without count store')
+    args = parser.parse_args()
+
+    store = None if args.no_store else args.store or scan.store_path(args.corpus, 'vertical')
+    freqs = analyze_corpus(args.corpus, args.workers, store)
+    print(pretty(freqs))
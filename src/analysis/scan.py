@@ -0,0 +1,123 @@
+'''
+Single-pass parallel corpus scans: each score is parsed once, in a pool of worker processes,
+by a function returning its counts, and the counts of all scores are merged in the main process.
+
+The counts of each score can be kept in a count store, keyed by the hash of the file content:
+a re-run only parses the new or changed scores, and merges their counts with the stored ones.
+Counts are stored raw, and normalized after merging.
+'''
+
+import concurrent.futures
+import copy
+import hashlib
+import os
+import pickle
+from typing import Any, Callable, Dict, List, Optional
+
+# bump to invalidate all count stores
+VERSION = 1
+
+EXTENSION = '.store'
+
+
+def files(corpus_path: str) -> List[str]:
+    '''the files of a corpus directory, in a stable order
+    '''
+    return sorted(os.path.join(corpus_path, f) for f in os.listdir(corpus_path)
+                  if os.path.isfile(os.path.join(corpus_path, f)))
+
+
+def digest(path: str) -> str:
+    '''hash of the content of a file
+    '''
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def store_path(corpus_path: str, analysis: str) -> str:
+    '''default count store of an analysis of a corpus, next to the corpus directory
+    (e.g. data/1991-denson.horizontal.store)
+    '''
+    return os.path.normpath(corpus_path) + f'.{analysis}' + EXTENSION
+
+
+class CountStore:
+    '''the counts of each analyzed file, by content hash, for one analysis
+
+    key: the analysis and its parameters; a store written with another key (or VERSION) is discarded
+    '''
+
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self.counts: Dict[str, Any] = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                stored = pickle.load(f)
+            if stored.get('version') == VERSION and stored.get('key') == key:
+                self.counts = stored['counts']
+
+    def save(self, hashes: List[str]) -> None:
+        '''write the store, keeping the counts of these files only
+        '''
+        counts = {h: self.counts[h] for h in hashes if h in self.counts}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': VERSION, 'key': self.key, 'counts': counts}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+
+
+def merge(total: Any, counts: Any) -> Any:
+    '''add counts into total: numbers are added, dicts merged by key and lists element-wise
+    '''
+    if isinstance(counts, dict):
+        for (k, c) in counts.items():
+            total[k] = merge(total[k], c) if k in total else c
+        return total
+    if isinstance(counts, list):
+        for (i, c) in enumerate(counts):
+            total[i] = merge(total[i], c)
+        return total
+    return total + counts
+
+
+def scan(corpus_path: str, analyze: Callable[[str], Any], workers: Optional[int] = None,
+         store: Optional[str] = None, key: str = '') -> Any:
+    '''analyze all files of a corpus in parallel and merge their counts, in file order
+
+    analyze: a module-level function, taking the path of a score and returning its counts
+    (nested dicts and lists of numbers, all of the same shape)
+    store: the path of a count store (see CountStore): only the files whose counts are not stored are analyzed
+    key: the analysis and its parameters, identifying the counts in the store
+    '''
+    total: Any = None
+    print(corpus_path)
+    paths: List[str] = files(corpus_path)
+    count_store = CountStore(store, key) if store else None
+    hashes: List[str] = [digest(f) for f in paths] if count_store else []
+    stored: int = 0
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [None if count_store and h in count_store.counts else pool.submit(analyze, f)
+                   for (f, h) in zip(paths, hashes or [None] * len(paths))]
+        for (i, (f, future)) in enumerate(zip(paths, futures)):
+            if future is None:
+                counts = count_store.counts[hashes[i]]
+                stored += 1
+            else:
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    print('!!', os.path.basename(f), f'{type(e).__name__}: {e}')
+                    continue
+                print('<==', os.path.basename(f))
+                if count_store:
+                    count_store.counts[hashes[i]] = counts
+            # the total is modified by merging (and normalizing), and takes parts of the merged counts:
+            # never let it share them with the store
+            if count_store:
+                counts = copy.deepcopy(counts)
+            total = counts if total is None else merge(total, counts)
+    if count_store:
+        count_store.save(hashes)
+        print(f'{stored} files from {store}, {len(paths) - stored} analyzed')
+    return total
@@ -0,0 +1,233 @@
+'''
+Running many generations in a pool of worker processes, with throughput and latency statistics.
+Exports can be deferred to an `ExportQueue`, so that generation and export overlap.
+'''
+
+import atexit
+import concurrent.futures
+import itertools
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rich import print
+
+import export
+import instrument
+import log
+import memory
+import tools
+
+
+def init_worker(quiet: bool, music21: bool = True) -> None:
+    """
+    Warm up a worker: the rulesets are imported with the job modules,
+    and the first job exporting through music21 should not pay for importing it either.
+
+    :param music21: whether the worker exports through music21
+    """
+    if music21:
+        import music21.musicxml.m21ToXml
+        import music21.musicxml.xmlToM21
+    if quiet:
+        log.quiet()
+        sys.stdout = open(os.devnull, 'w')
+
+
+def reports(model: Any) -> Dict[str, Dict[str, Any]]:
+    """
+    The reports of the last generation of a model, as returned by jobs: its rule statistics (`stats`)
+    and memory profile (`memory`), when enabled (see `instrument.enable` and `memory.enable`).
+    """
+    result: Dict[str, Dict[str, Any]] = {}
+    if instrument.enabled:
+        result['stats'] = model.stats.to_dict()
+    if memory.enabled:
+        result['memory'] = model.memory.to_dict()
+    return result
+
+
+class ExportQueue:
+    """
+    Write exported pieces in the background, in a pool of threads or processes, while generation goes on.
+
+    At most `max_pending` pieces are queued or being written: `submit` blocks beyond that (backpressure),
+    so that a slow export does not accumulate snapshots without bound.
+    Pending pieces are always written before the queue is closed, be it by `close`, at the end of a `with` block,
+    or at interpreter exit.
+
+    :param workers: the number of export threads or processes
+    :param processes: whether to export in processes (CPU-bound music21 export) rather than threads (direct or MIDI export)
+    :param max_pending: the maximum number of pieces queued or being written, by default twice the number of workers
+    :param quiet: whether to silence the output of export processes
+    :param music21: whether the export processes export through music21
+    """
+
+    def __init__(self, workers: int = 1, processes: bool = True, max_pending: Optional[int] = None, quiet: bool = True, music21: bool = True):
+        self.pool: concurrent.futures.Executor
+        if processes:
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(quiet, music21))
+        else:
+            self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='export')
+        self.slots: threading.BoundedSemaphore = threading.BoundedSemaphore(max_pending or 2 * workers)
+        self.pending: Dict[concurrent.futures.Future, str] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.stages: Dict[str, List[float]] = {}
+        self.failures: List[Tuple[str, str]] = []
+        self.closed: bool = False
+        atexit.register(self.close)
+
+    def __enter__(self) -> 'ExportQueue':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def submit(self, piece: export.Piece) -> None:
+        """
+        Queue a piece for export, waiting for a free slot if `max_pending` pieces are already pending.
+        """
+        if self.closed:
+            raise RuntimeError('Export queue is closed')
+        self.slots.acquire()
+        try:
+            f: concurrent.futures.Future = self.pool.submit(export.write, piece)
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending[f] = piece.filename
+        f.add_done_callback(self.done)
+
+    def done(self, f: concurrent.futures.Future) -> None:
+        with self.lock:
+            name: str = self.pending.pop(f)
+            try:
+                for (stage, duration) in f.result().items():
+                    self.stages.setdefault(stage, []).append(duration)
+            except Exception as e:
+                self.failures.append((name, f'{type(e).__name__}: {e}'))
+                print(f'[red]!! export {name}: {type(e).__name__}: {e}')
+        self.slots.release()
+
+    def flush(self) -> None:
+        """
+        Wait until all queued pieces are written.
+        """
+        with self.lock:
+            pending: List[concurrent.futures.Future] = list(self.pending)
+        concurrent.futures.wait(pending)
+
+    def collect(self) -> Tuple[Dict[str, List[float]], List[Tuple[str, str]]]:
+        """
+        Wait for all queued pieces, and return (then forget) the durations of the export stages and the failed exports.
+        """
+        self.flush()
+        with self.lock:
+            stages, failures = self.stages, self.failures
+            self.stages, self.failures = {}, []
+        return (stages, failures)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        self.pool.shutdown(wait=True)
+        self.closed = True
+        atexit.unregister(self.close)
+
+
+def run(job: Callable[..., Any], jobs: List[Tuple[str, tuple]], workers: int, quiet: bool = True, exports: Optional[ExportQueue] = None, music21: bool = True, max_in_flight: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    Run jobs in a pool of worker processes, reporting each result as soon as it is ready.
+    Jobs are submitted as earlier ones complete, at most `max_in_flight` at a time: as the results are handled
+    (and their snapshots queued for export) before submitting more jobs, a slow export also slows down generation,
+    instead of finished pieces piling up.
+
+    :param job: the job function, returning the duration of each of its stages (in seconds), the reports of its model
+                (see `reports`), totalled over all jobs in the final report, and, when exports are deferred, the snapshot to export
+    :param jobs: the jobs, as (name, arguments of `job`)
+    :param workers: the number of worker processes
+    :param quiet: whether to silence the output of the workers
+    :param exports: the queue where the snapshots returned by the jobs are exported, flushed before returning
+    :param music21: whether the jobs export through music21
+    :param max_in_flight: the maximum number of jobs submitted and not handled yet, by default twice the number of workers
+    :returns: the failed jobs, as (name, error)
+    """
+    stages: Dict[str, List[float]] = {}
+    failures: List[Tuple[str, str]] = []
+    job_reports: Dict[str, List[Dict[str, Any]]] = {}
+    start: float = time.perf_counter()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(quiet, music21)) as pool:
+            waiting = iter(jobs)
+            futures: Dict[concurrent.futures.Future, str] = {pool.submit(job, *args): name
+                                                             for (name, args) in itertools.islice(waiting, max_in_flight or 2 * workers)}
+            done: int = 0
+            while futures:
+                finished, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in finished:
+                    name: str = futures.pop(f)
+                    done += 1
+                    try:
+                        result = f.result()
+                        if exports:
+                            result, rs, piece = result
+                            exports.submit(piece)
+                        else:
+                            result, rs = result
+                        for (stage, duration) in result.items():
+                            stages.setdefault(stage, []).append(duration)
+                        for (kind, r) in rs.items():
+                            job_reports.setdefault(kind, []).append(r)
+                        print(f'[green]==> [{done}/{len(jobs)}] {name}')
+                    except Exception as e:
+                        failures.append((name, f'{type(e).__name__}: {e}'))
+                        print(f'[red]!! [{done}/{len(jobs)}] {name}: {type(e).__name__}: {e}')
+                    for (next_name, args) in itertools.islice(waiting, 1):
+                        futures[pool.submit(job, *args)] = next_name
+    finally:
+        if exports:
+            export_stages, export_failures = exports.collect()
+            for (stage, durations) in export_stages.items():
+                stages.setdefault(stage, []).extend(durations)
+            failures += export_failures
+
+    elapsed: float = time.perf_counter() - start
+    report(stages, len(jobs) - len(failures), elapsed, failures, job_reports)
+    return failures
+
+
+def report(stages: Dict[str, List[float]], succeeded: int, elapsed: float, failures: List[Tuple[str, str]],
+           job_reports: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> None:
+    '''Print the throughput and latency of a batch, and the rule statistics and memory profiles of its jobs, combined
+    (also written to the JSON log, see `log.configure`)
+    '''
+    job_reports = job_reports or {}
+    if 'stats' in job_reports:
+        stats: Dict[str, Any] = instrument.merge(job_reports['stats'])
+        log.info('### Rule statistics of %d pieces', len(job_reports['stats']), style='yellow')
+        log.info('%s', instrument.table(stats), event='stats', stats=stats, pieces=len(job_reports['stats']))
+    if 'memory' in job_reports:
+        profile: Dict[str, Any] = memory.merge(job_reports['memory'])
+        log.info('### Memory of %d pieces (largest)', len(job_reports['memory']), style='yellow')
+        log.info('%s', memory.table(profile), event='memory', memory=profile, pieces=len(job_reports['memory']))
+    print()
+    print(f'[yellow]### {succeeded} pieces in {elapsed:.1f}s: {succeeded / elapsed:.2f} pieces/s, {len(failures)} failures')
+    for (stage, durations) in stages.items():
+        print(f'{stage:10s} ' + '  '.join([f'p{q}: {tools.percentile(durations, q):.3f}s' for q in [50, 90, 99]]) + f'  max: {max(durations):.3f}s')
+    for (name, error) in failures:
+        print(f'[red]{name}: {error}')
+
+
+def seed_range(seeds: str) -> range:
+    """
+    Parse a range of seeds given as `first:last+1` (or a single seed).
+    """
+    if ':' not in seeds:
+        return range(int(seeds), int(seeds) + 1)
+    first, last = seeds.split(':')
+    return range(int(first), int(last))
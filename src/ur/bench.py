@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Reproducible end-to-end benchmarks, with fixed seeds:
+
+- `gen`: `gen_sacred` with each structure (`struc1`-`struc4`) and each meter
+- `harm`: `harm_sacred` on a fixed set of tunes of `data/1991-denson`
+
+Each case runs in a fresh process and reports wall time, CPU time, peak RSS and pieces/s,
+together with the duration of the isolated stages: loading/setup, generation of each VP, and export.
+Results are stored as JSON, and can be compared with an earlier run.
+
+    python3 src/ur/bench.py
+    python3 src/ur/bench.py --suite gen --seeds 0:3 --compare data/bench/<earlier>.json
+'''
+
+import argparse
+import concurrent.futures
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from rich import print
+
+import batch
+import log
+import tools
+
+DIR_BENCH: str = 'data/bench'
+
+# tunes of data/1991-denson with matching lyrics, harmonized by the `harm` suite
+TUNES: List[str] = ['56bd.mxl', '100.mxl', '102d.mxl', '104.mxl']
+
+VOICES: List[str] = ['fillInS', 'fillInA', 'fillInT', 'fillInB']
+
+
+def export_stages(sh: Any, filename: str, title: str) -> Dict[str, float]:
+    """
+    Time each export path of a generated model.
+    """
+    stages: Dict[str, float] = {}
+    for (stage, direct) in [('export music21', False), ('export direct', True)]:
+        t: float = time.perf_counter()
+        sh.export(filename, title, 'lyr', VOICES, ['chords'], False, direct)
+        stages[stage] = time.perf_counter() - t
+    t = time.perf_counter()
+    sh.export_midi(filename, title, 'lyr', VOICES, ['chords'])
+    stages['export midi'] = time.perf_counter() - t
+    return stages
+
+
+def gen_piece(seed: int, struc: int, meter: str) -> Dict[str, float]:
+    import sacred
+    random.seed(seed)
+    t: float = time.perf_counter()
+    sh = sacred.gen_sacred(meter=meter, struc=copy.deepcopy(sacred.STRUCTURES[struc]))
+    total: float = time.perf_counter() - t
+
+    stages: Dict[str, float] = {'setup': total - sum(sh.timings.values())}
+    stages.update({f'generate {vp}': d for (vp, d) in sh.timings.items()})
+    stages.update(export_stages(sh, f'bench/gen-{struc + 1}-{meter.replace("/", "")}-{seed}', f'bench ({seed})'))
+    return stages
+
+
+def harm_piece(seed: int, mel_path: str, lyrics_dir: str) -> Dict[str, float]:
+    import harmonization as hz
+    random.seed(seed)
+    t: float = time.perf_counter()
+    tune = hz.load_tune(mel_path)
+    lyr_path: Optional[str] = hz.match_lyrics(mel_path, lyrics_dir)
+    if lyr_path is None:
+        raise RuntimeError(f'No lyrics for {mel_path}')
+    lyr = [s for v in hz.load_lyrics(lyr_path, hz.STRESS_WORDS) for s in v]
+    load: float = time.perf_counter() - t
+
+    t = time.perf_counter()
+    sh = hz.harm_sacred(tune, lyr, hz.structure_from_tune(tune))
+    total: float = time.perf_counter() - t
+
+    stages: Dict[str, float] = {'load': load, 'setup': total - sum(sh.timings.values())}
+    stages.update({f'generate {vp}': d for (vp, d) in sh.timings.items()})
+    stages.update(export_stages(sh, f'bench/harm-{os.path.splitext(tune.name)[0]}-{seed}', f'bench ({seed})'))
+    return stages
+
+
+def run_case(suite: str, args: tuple, seeds: List[int]) -> Dict[str, Any]:
+    """
+    Run one case for all seeds, in the current (fresh) process.
+    """
+    log.quiet()
+    piece = gen_piece if suite == 'gen' else harm_piece
+    stages: Dict[str, List[float]] = {}
+    failures: List[str] = []
+
+    wall: float = time.perf_counter()
+    cpu: float = time.process_time()
+    for seed in seeds:
+        try:
+            for (stage, d) in piece(seed, *args).items():
+                stages.setdefault(stage, []).append(d)
+        except Exception as e:
+            failures.append(f'{seed}: {type(e).__name__}: {e}')
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    pieces: int = len(seeds) - len(failures)
+    return {
+        'pieces': pieces,
+        'failures': failures,
+        'wall': wall,
+        'cpu': cpu,
+        'pieces_per_s': pieces / wall,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': {stage: {'mean': sum(ds) / len(ds), 'p50': tools.percentile(ds, 50), 'max': max(ds)}
+                   for (stage, ds) in stages.items()},
+    }
+
+
+def cases(suites: List[str], corpus_dir: str, lyrics_dir: str) -> List[Tuple[str, str, tuple]]:
+    """
+    The benchmark cases, as (name, suite, arguments of the piece function).
+    """
+    result: List[Tuple[str, str, tuple]] = []
+    if 'gen' in suites:
+        for struc in range(4):
+            for meter in ['6/4', '4/4', '6/8']:
+                result.append((f'gen struc{struc + 1} {meter}', 'gen', (struc, meter)))
+    if 'harm' in suites:
+        for tune in TUNES:
+            result.append((f'harm {tune}', 'harm', (os.path.join(corpus_dir, tune), lyrics_dir)))
+    return result
+
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit: str = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    print()
+    print(f'[yellow]{"case":24s} {"pieces":>6s} {"wall":>8s} {"cpu":>8s} {"pieces/s":>9s} {"peak RSS":>9s}' + ('  /base' if baseline else ''))
+    for (name, r) in results.items():
+        line: str = f'{name:24s} {r["pieces"]:6d} {r["wall"]:7.2f}s {r["cpu"]:7.2f}s {r["pieces_per_s"]:9.3f} {r["peak_rss_mb"]:7.0f}MB'
+        if baseline and name in baseline and r['pieces_per_s'] and baseline[name]['pieces_per_s']:
+            line += f'  x{r["pieces_per_s"] / baseline[name]["pieces_per_s"]:.2f}'
+        print(line)
+        for f in r['failures']:
+            print(f'[red]  !! {f}')
+
+    stages: Dict[str, List[float]] = {}
+    for r in results.values():
+        for (stage, s) in r['stages'].items():
+            stages.setdefault(stage, []).append(s['mean'])
+    print()
+    print(f'[yellow]{"stage (mean over cases)":32s} {"time":>9s}')
+    for (stage, ds) in stages.items():
+        print(f'{stage:32s} {sum(ds) / len(ds):8.4f}s')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Ur benchmarks')
+    parser.add_argument('--suite', choices=['gen', 'harm', 'all'], default='all', help='benchmarks to run (default: %(default)s)')
+    parser.add_argument('--seeds', default='0:3', help='seeds of each case, as first:last+1 (default: %(default)s)')
+    parser.add_argument('--corpus', default='data/1991-denson', help='corpus directory of the harm suite (default: %(default)s)')
+    parser.add_argument('--lyrics', default='data/lyrics', help='lyrics directory of the harm suite (default: %(default)s)')
+    parser.add_argument('--out', help=f'JSON results file (default: {DIR_BENCH}/<date>.json)')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    suites: List[str] = ['gen', 'harm'] if args.suite == 'all' else [args.suite]
+    seeds: List[int] = list(batch.seed_range(args.seeds))
+    meta: Dict[str, Any] = metadata()
+    results: Dict[str, Dict[str, Any]] = {}
+
+    for (name, suite, case_args) in cases(suites, args.corpus, args.lyrics):
+        print(f'[yellow]### {name}')
+        # a fresh process per case: isolated module state and peak RSS
+        with concurrent.futures.ProcessPoolExecutor(1, initializer=batch.init_worker, initargs=(True,)) as pool:
+            results[name] = pool.submit(run_case, suite, case_args, seeds).result()
+
+    baseline: Optional[Dict[str, Dict[str, Any]]] = None
+    if args.compare:
+        baseline = json.load(open(args.compare))['results']
+    report(results, baseline)
+
+    out: str = args.out or os.path.join(DIR_BENCH, meta['date'].replace(':', '') + '.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'meta': meta, 'seeds': seeds, 'results': results}, f, indent=2)
+    print(f'[green]==> {out}')
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+A metadata index of the tune corpora: for each score, its key, mode, meter, parts, length and lyrics.
+
+The index is built once from the scores (`data/catalog.json`), and queried without parsing any score,
+e.g. to pick the tunes of a batch and shard them between workers:
+
+    python3 src/ur/catalog.py --build
+    python3 src/ur/catalog.py --mode minor --meter 6/8 --voices 4 --max-beats 96
+    python3 src/ur/catalog.py --lyrics --shard 2/4 --paths
+'''
+
+import argparse
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import load
+import midi
+import music
+import musicxml
+
+VERSION: int = 2
+
+PATH: str = 'data/catalog.json'
+CORPORA: List[str] = ['data/1991-denson', 'data/the-scared-harp']
+LYRICS: str = 'data/lyrics'
+
+
+class Entry:
+    """
+    The metadata of one score.
+
+    :param path: the score file
+    :param key: the key of the score, expressed as transposition interval w.r.t. C (resp. A), see `tonality`
+                (None for a MIDI file without key signature)
+    :param mode: `major`/`minor` (None with the key)
+    :param meter: the (first) time signature
+    :param parts: the lower-case part names
+    :param quarters: the length of the score, in quarters, up to the end of its last note
+    :param lyrics: the matching lyrics file, if any
+    :param digest: the hash of the score file, when indexed
+    """
+
+    def __init__(self, path: str, key: Optional[str], mode: Optional[str], meter: str, parts: List[str], quarters: float,
+                 lyrics: Optional[str], digest: str):
+        self.path: str = path
+        self.key: Optional[str] = key
+        self.mode: Optional[str] = mode
+        self.meter: str = meter
+        self.parts: List[str] = parts
+        self.quarters: float = quarters
+        self.lyrics: Optional[str] = lyrics
+        self.digest: str = digest
+
+    @property
+    def corpus(self) -> str:
+        return os.path.dirname(self.path)
+
+    @property
+    def voices(self) -> int:
+        return len(self.parts)
+
+    @property
+    def beats(self) -> float:
+        '''The length of the score, in units of the time signature (eighths in 6/8)
+        '''
+        return self.quarters * int(self.meter.split('/')[1]) / 4
+
+    @property
+    def tonic(self) -> Optional[str]:
+        if self.key is None:
+            return None
+        return music.transpose('A4' if self.mode == 'minor' else 'C4', self.key)[:-1]
+
+    def up_to_date(self) -> bool:
+        return os.path.exists(self.path) and digest(self.path) == self.digest
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def __repr__(self) -> str:
+        return f'{self.path} ({self.tonic} {self.mode}, {self.meter}, {self.voices} parts, {self.beats:g} beats)'
+
+
+def digest(path: str) -> str:
+    '''hash of the content of a file
+    '''
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def tonality(fifths: int, mode: str, tenor: List[str]) -> Tuple[str, str]:
+    '''Key (as interval from C, resp. A, to the tonic) and mode of a score from its key signature:
+    the mode of the signature, unless the tenor starts (or else ends) on the tonic of the relative key,
+    as a Sacred Harp tenor starts and ends on the tonic
+
+    :param tenor: the pitch names of the tenor notes
+    '''
+    tonics: Dict[str, str] = {'major': music.fifths_name(fifths), 'minor': music.fifths_name(fifths + 3)}
+    for pitch in tenor[:1] + tenor[-1:]:
+        found: List[str] = [m for (m, t) in tonics.items() if music.midi(t + '4') % 12 == music.midi(pitch) % 12]
+        if found:
+            mode = found[0]
+            break
+    return (music.interval_name('A4' if mode == 'minor' else 'C4', tonics[mode] + '4'), mode)
+
+
+def describe_midi(path: str, lyrics_dir: str = LYRICS) -> Entry:
+    '''Read a MIDI file (see `midi.read`) into its catalog entry: one part per track with notes,
+    the key and mode of the first key signature and the tenor (or first) track, see `tonality`,
+    and the meter of the first time signature
+    '''
+    tracks: List[midi.Track] = midi.read(path)
+    meta: List[Tuple[int, int, bytes]] = sorted((m for t in tracks for m in t.meta), key=lambda m: m[0])
+    keys: List[bytes] = [d for (_, type, d) in meta if type == midi.META_KEY_SIGNATURE]
+    meters: List[bytes] = [d for (_, type, d) in meta if type == midi.META_TIME_SIGNATURE]
+    voiced: List[Tuple[str, midi.Track]] = [((t.name or f'track{i}').lower(), t) for (i, t) in enumerate(tracks) if len(t)]
+    key: Optional[str] = None
+    mode: Optional[str] = None
+    if keys and voiced:
+        tenor: midi.Track = dict(voiced).get('tenor', voiced[0][1])
+        fifths: int = int.from_bytes(keys[0][:1], 'big', signed=True)
+        key, mode = tonality(fifths, 'minor' if keys[0][1] else 'major', [music.midi_name(p) for p in tenor.pitches])
+    meter: str = f'{meters[0][0]}/{2 ** meters[0][1]}' if meters else '4/4'
+    parts: List[str] = [name for (name, _) in voiced]
+    quarters: float = max((o + d for t in tracks for (o, d) in zip(t.onsets, t.durations)), default=0.0)
+    return Entry(path, key, mode, meter, parts, quarters, load.match_lyrics(path, lyrics_dir), digest(path))
+
+
+def describe(path: str, lyrics_dir: str = LYRICS) -> Entry:
+    '''Read a score (see `load.read_tunes`, or `describe_midi` for MIDI files) into its catalog entry
+    '''
+    if path.lower().endswith(('.mid', '.midi')):
+        return describe_midi(path, lyrics_dir)
+    tunes = load.read_tunes(path)
+    tenor = tunes['tenor']
+    # the tunes are transposed to the relative key of their signature (see `musicxml.relative_key`): back to the score
+    key, mode = tonality(*musicxml.signature(tenor.key, tenor.mode),
+                         [music.transpose(p, tenor.key) for p in tenor.pitches()])
+    quarters: float = max((o + d for t in tunes.values() for (o, d) in zip(t.offsets, t.durations)), default=0.0)
+    return Entry(path, key, mode, tenor.meter, list(tunes), quarters,
+                 load.match_lyrics(path, lyrics_dir), digest(path))
+
+
+class Catalog:
+    """
+    The index of one or more corpora, and the scores that could not be indexed.
+
+    :param path: the index file
+    """
+
+    def __init__(self, path: str = PATH):
+        self.path: str = path
+        self.entries: List[Entry] = []
+        self.failures: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                stored: Dict[str, Any] = json.load(f)
+            if stored.get('version') == VERSION:
+                self.entries = [Entry(**e) for e in stored['entries']]
+                self.failures = stored['failures']
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def save(self) -> None:
+        tmp: str = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION, 'entries': [e.to_dict() for e in self.entries], 'failures': self.failures},
+                      f, indent=1)
+        os.replace(tmp, self.path)
+
+    def query(self, mode: Optional[str] = None, meter: Optional[str] = None, voices: Optional[int] = None,
+              min_beats: Optional[float] = None, max_beats: Optional[float] = None, tonic: Optional[str] = None,
+              corpus: Optional[str] = None, parts: Optional[List[str]] = None, lyrics: Optional[bool] = None) -> List[Entry]:
+        """
+        The entries matching all the given criteria, in file order.
+
+        :param min_beats, max_beats: inclusive bounds of the length, in units of the time signature
+        :param parts: part names the scores must have
+        :param lyrics: whether the scores must (or must not) have lyrics
+        """
+        return [e for e in self.entries
+                if (mode is None or e.mode == mode)
+                and (meter is None or e.meter == meter)
+                and (voices is None or e.voices == voices)
+                and (min_beats is None or e.beats >= min_beats)
+                and (max_beats is None or e.beats <= max_beats)
+                and (tonic is None or e.tonic == tonic)
+                and (corpus is None or os.path.normpath(e.corpus) == os.path.normpath(corpus))
+                and (parts is None or all(p in e.parts for p in parts))
+                and (lyrics is None or (e.lyrics is not None) == lyrics)]
+
+
+def shard(entries: List[Entry], index: int, count: int) -> List[Entry]:
+    '''The `index`-th of `count` shards of entries (from 0), balanced by total length
+    '''
+    shards: List[List[Entry]] = [[] for _ in range(count)]
+    lengths: List[float] = [0.0] * count
+    for e in sorted(entries, key=lambda e: -e.quarters):
+        i: int = lengths.index(min(lengths))
+        shards[i].append(e)
+        lengths[i] += e.quarters
+    return sorted(shards[index], key=lambda e: e.path)
+
+
+def build(corpora: List[str] = CORPORA, lyrics_dir: str = LYRICS, path: str = PATH) -> Catalog:
+    """
+    Index the scores of the corpora, re-reading only the new or changed ones.
+
+    :returns: the catalog, written to `path`
+    """
+    from rich import print
+
+    catalog: Catalog = Catalog(path)
+    known: Dict[str, Entry] = {e.path: e for e in catalog.entries if e.up_to_date()}
+    catalog.entries = []
+    catalog.failures = {}
+    read: int = 0
+    for corpus in corpora:
+        for name in sorted(os.listdir(corpus)):
+            f: str = os.path.join(corpus, name)
+            if not os.path.isfile(f):
+                continue
+            if f in known:
+                known[f].lyrics = load.match_lyrics(f, lyrics_dir)
+                catalog.entries.append(known[f])
+                continue
+            read += 1
+            try:
+                catalog.entries.append(describe(f, lyrics_dir))
+            except Exception as e:
+                catalog.failures[f] = f'{type(e).__name__}: {e}'
+    catalog.save()
+    print(f'[green]==> {path}[/] ({len(catalog)} scores, {read} read, {len(catalog.failures)} failures)')
+    return catalog
+
+
+def parse_shard(s: str) -> Tuple[int, int]:
+    '''Parse a shard given as `<index>/<count>`, counting from 1
+    '''
+    index, count = s.split('/')
+    return (int(index) - 1, int(count))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Corpus metadata index')
+    parser.add_argument('--build', action='store_true', help='(re-)index the corpora first')
+    parser.add_argument('--corpora', default=','.join(CORPORA), help='corpora to index (default: %(default)s)')
+    parser.add_argument('--lyrics-dir', default=LYRICS, help='lyrics directory (default: %(default)s)')
+    parser.add_argument('--index', default=PATH, help='index file (default: %(default)s)')
+    parser.add_argument('--mode', choices=['major', 'minor'])
+    parser.add_argument('--meter', help='time signature, e.g. 6/8')
+    parser.add_argument('--voices', type=int, help='number of parts')
+    parser.add_argument('--min-beats', type=float, help='minimal length, in units of the time signature')
+    parser.add_argument('--max-beats', type=float, help='maximal length, in units of the time signature')
+    parser.add_argument('--tonic', help='tonic, e.g. F#')
+    parser.add_argument('--corpus', help='only the scores of this corpus directory')
+    parser.add_argument('--lyrics', action='store_true', help='only the scores having lyrics')
+    parser.add_argument('--shard', help='only this shard of the results, as <index>/<count> (from 1)')
+    parser.add_argument('--paths', action='store_true', help='only print the paths of the scores')
+    args = parser.parse_args()
+
+    if args.build:
+        catalog: Catalog = build(args.corpora.split(','), args.lyrics_dir, args.index)
+    else:
+        catalog = Catalog(args.index)
+        if not len(catalog):
+            raise RuntimeError(f'{args.index}: no index, build it with --build')
+
+    entries: List[Entry] = catalog.query(args.mode, args.meter, args.voices, args.min_beats, args.max_beats,
+                                         args.tonic, args.corpus, lyrics=True if args.lyrics else None)
+    if args.shard:
+        entries = shard(entries, *parse_shard(args.shard))
+    for e in entries:
+        print(e.path if args.paths else e)
+    if not args.paths:
+        print(f'{len(entries)} scores')
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+A memory-mapped columnar store for melody corpora.
+
+The store is built once from a corpus directory (e.g. `data/1991-denson`) and written next to it
+(`data/1991-denson.store`). It holds, for every part of every score, the note durations, onsets,
+beat strengths and pitches (transposed to C major / A minor), together with the key, mode and meter of each score.
+Loading a tune from the store neither parses MusicXML nor copies the note columns.
+
+    python3 src/ur/corpus.py data/1991-denson
+'''
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from music import Note, Pitch, Duration
+
+MAGIC: bytes = b'URSTORE'
+VERSION: int = 1
+
+# column name -> array typecode
+COLUMNS: Dict[str, str] = {
+    'duration': 'd',
+    'offset': 'd',
+    'beat_strength': 'f',
+    'pitch': 'H',
+}
+
+EXTENSION: str = '.store'
+
+
+class Tune:
+    """
+    A melody part as plain arrays, transposed to C major (resp. A minor).
+
+    :param name: the file name of the score the part comes from
+    :param key: the key of the score, expressed as transposition interval w.r.t. C (resp. A)
+    :param mode: the mode of the score (`major`/`minor`)
+    :param meter: the time signature of the score
+    :param durations: the note durations, in quarters
+    :param offsets: the note onsets, in quarters from the start of the part
+    :param beat_strengths: the metrical weight of each note onset (as computed by music21)
+    :param pitch_ids: the note pitches, as indices into `vocabulary`
+    :param vocabulary: the pitch names
+    """
+
+    def __init__(self, name: str, key: str, mode: str, meter: str,
+                 durations: Sequence[float], offsets: Sequence[float], beat_strengths: Sequence[float],
+                 pitch_ids: Sequence[int], vocabulary: List[str]):
+        self.name: str = name
+        self.key: str = key
+        self.mode: str = mode
+        self.meter: str = meter
+        self.durations: Sequence[float] = durations
+        self.offsets: Sequence[float] = offsets
+        self.beat_strengths: Sequence[float] = beat_strengths
+        self.pitch_ids: Sequence[int] = pitch_ids
+        self.vocabulary: List[str] = vocabulary
+
+    def __len__(self) -> int:
+        return len(self.durations)
+
+    def pitches(self) -> List[str]:
+        return [self.vocabulary[i] for i in self.pitch_ids]
+
+    def notes(self) -> List[Note]:
+        return [Note(Duration(d), Pitch(self.vocabulary[i])) for d, i in zip(self.durations, self.pitch_ids)]
+
+
+class Store:
+    """
+    A read-only corpus store, memory-mapped.
+    The columns returned in Tunes are views on the mapped file.
+
+    :param path: the store file
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        with open(path, 'rb') as f:
+            self.mm: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = struct.unpack_from('<7sBQ', self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError(f"{path} is not a corpus store of version {VERSION}")
+        header_start: int = struct.calcsize('<7sBQ')
+        self.header: dict = json.loads(self.mm[header_start:header_start + header_len])
+        self.vocabulary: List[str] = self.header['pitches']
+        self.scores: Dict[str, dict] = self.header['scores']
+
+        data = memoryview(self.mm)
+        self.columns: Dict[str, memoryview] = {}
+        for name, (offset, count) in self.header['columns'].items():
+            size: int = array(COLUMNS[name]).itemsize
+            self.columns[name] = data[offset:offset + count * size].cast(COLUMNS[name])
+
+    def __contains__(self, filename: str) -> bool:
+        return os.path.basename(filename) in self.scores
+
+    def up_to_date(self, filename: str) -> bool:
+        """
+        Whether `filename` is in the store and did not change since the store was built.
+        """
+        entry: Optional[dict] = self.scores.get(os.path.basename(filename))
+        if entry is None:
+            return False
+        st = os.stat(filename)
+        return entry['size'] == st.st_size and entry['mtime'] == int(st.st_mtime)
+
+    def parts(self, filename: str) -> List[str]:
+        return list(self.scores[os.path.basename(filename)]['parts'])
+
+    def tune(self, filename: str, part: str = 'tenor') -> Tune:
+        name: str = os.path.basename(filename)
+        entry: dict = self.scores[name]
+        start, end = entry['parts'][part]
+        return Tune(name, entry['key'], entry['mode'], entry['meter'],
+                    self.columns['duration'][start:end],
+                    self.columns['offset'][start:end],
+                    self.columns['beat_strength'][start:end],
+                    self.columns['pitch'][start:end],
+                    self.vocabulary)
+
+
+_stores: Dict[str, Optional[Store]] = {}
+
+def store_for(filename: str) -> Optional[Store]:
+    """
+    Return the store of the corpus directory containing `filename`, if it has been built (opened once per process).
+    """
+    path: str = os.path.normpath(os.path.dirname(os.path.abspath(filename))) + EXTENSION
+    if path not in _stores:
+        _stores[path] = Store(path) if os.path.exists(path) else None
+    return _stores[path]
+
+
+def write_store(path: str, scores: Dict[str, Tuple[os.stat_result, Dict[str, Tune]]]) -> None:
+    """
+    Write a store from already extracted tunes.
+
+    :param path: the store file
+    :param scores: for each file name, its `os.stat` and its tunes by part name (all parts sharing key, mode and meter)
+    """
+    vocabulary: Dict[str, int] = {}
+    columns: Dict[str, array] = {name: array(code) for name, code in COLUMNS.items()}
+    entries: Dict[str, dict] = {}
+
+    for name, (st, tunes) in sorted(scores.items()):
+        parts: Dict[str, Tuple[int, int]] = {}
+        for part, t in tunes.items():
+            start: int = len(columns['duration'])
+            columns['duration'].extend(t.durations)
+            columns['offset'].extend(t.offsets)
+            columns['beat_strength'].extend(t.beat_strengths)
+            columns['pitch'].extend(vocabulary.setdefault(p, len(vocabulary)) for p in t.pitches())
+            parts[part] = (start, len(columns['duration']))
+        first: Tune = next(iter(tunes.values()))
+        entries[name] = {
+            'key': first.key, 'mode': first.mode, 'meter': first.meter,
+            'size': st.st_size, 'mtime': int(st.st_mtime),
+            'parts': parts,
+        }
+
+    # lay out columns after the header, 8-byte aligned
+    prefix_len: int = struct.calcsize('<7sBQ')
+    layout: Dict[str, Tuple[int, int]] = {}
+    header: dict = {'pitches': list(vocabulary), 'scores': entries, 'columns': layout}
+    # the header size depends on the offsets it contains: iterate until stable
+    header_bytes: bytes = b''
+    while True:
+        offset: int = prefix_len + len(header_bytes)
+        offset += -offset % 8
+        new_layout: Dict[str, Tuple[int, int]] = {}
+        for name, col in columns.items():
+            new_layout[name] = (offset, len(col))
+            offset += len(col) * col.itemsize
+            offset += -offset % 8
+        header['columns'] = new_layout
+        new_header_bytes: bytes = json.dumps(header).encode('utf-8')
+        # stable only when the header written is the one whose length the offsets were computed from
+        if new_header_bytes == header_bytes:
+            break
+        header_bytes = new_header_bytes
+    layout = header['columns']
+
+    tmp: str = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(struct.pack('<7sBQ', MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, col in columns.items():
+            f.write(b'\0' * (layout[name][0] - f.tell()))
+            col.tofile(f)
+    os.replace(tmp, path)
+    _stores.pop(path, None)
+
+
+def same_tune(a: Tune, b: Tune) -> bool:
+    return (list(a.durations) == list(b.durations) and list(a.offsets) == list(b.offsets)
+            and list(a.beat_strengths) == list(b.beat_strengths) and a.pitches() == b.pitches()
+            and (a.key, a.mode, a.meter) == (b.key, b.mode, b.meter))
+
+
+def check_store(path: str, scores: Dict[str, Tuple[os.stat_result, Dict[str, Tune]]]) -> None:
+    """
+    Check that the store gives back the tunes it was written from (raises RuntimeError otherwise).
+    """
+    store: Store = Store(path)
+    for name, (_, tunes) in scores.items():
+        for part, t in tunes.items():
+            if not same_tune(store.tune(name, part), t):
+                raise RuntimeError(f'{path}: {name} ({part}) differs from the score')
+
+
+def build_store(corpus_dir: str, path: Optional[str] = None) -> str:
+    """
+    Read all scores of a corpus directory and write them into a store.
+
+    :param corpus_dir: the corpus directory
+    :param path: the store file, by default next to the corpus directory
+    :returns: the path of the store
+    """
+    import load
+    from rich import print
+
+    path = path or os.path.normpath(corpus_dir) + EXTENSION
+    scores: Dict[str, Tuple[os.stat_result, Dict[str, Tune]]] = {}
+    failures: List[str] = []
+    for name in sorted(os.listdir(corpus_dir)):
+        f: str = os.path.join(corpus_dir, name)
+        if not os.path.isfile(f):
+            continue
+        print('<==', name)
+        try:
+            scores[name] = (os.stat(f), load.read_tunes(f))
+        except Exception as e:
+            print(f'[red]!! {name}: {e}')
+            failures.append(name)
+
+    write_store(path, scores)
+    check_store(path, scores)
+    print(f'[green]==> {path}[/] ({len(scores)} scores, {len(failures)} failures)')
+    return path
+
+
+if __name__ == '__main__':
+    for d in sys.argv[1:] or ['data/1991-denson']:
+        build_store(d)
@@ -1,20 +1,88 @@
 
 
 import os
-import music21 as m21
 import datetime
 import random
+import time
 
-from rich import print
+import log
 
-from typing import List, Tuple
+from typing import Dict, List, NamedTuple, Tuple
 from music import Note
+import musicxml
+import midi
 
 DIR_OUT = 'data/gen/'
 
 VOICES = ['S', 'A', 'T', 'B']
 
-def export(filename: str, title: str, melodies: List[Tuple[str, List[Note], List[str]]], annots: List[Tuple[str, List[str]]], key: str, meter: str, svg: bool) -> None:
+class Piece(NamedTuple):
+    '''
+    An immutable snapshot of a model state to export, independent of the model (see `Model.snapshot`)
+    '''
+    filename: str
+    title: str
+    melodies: Tuple[Tuple[str, Tuple[Note, ...], Tuple[str, ...]], ...]
+    annots: Tuple[Tuple[str, Tuple[str, ...]], ...]
+    key: str
+    mode: str
+    meter: str
+    svg: bool = False
+    direct: bool = False
+    midi: bool = False
+
+def write(piece: Piece) -> Dict[str, float]:
+    '''
+    Write the files of a snapshot (`.mxl`, and optionally `.svg` and `.mid`).
+
+    :returns: the duration of each export stage, in seconds
+    '''
+    melodies = [(name, list(mel), list(lyr)) for name, mel, lyr in piece.melodies]
+    annots = [(name, list(annot)) for name, annot in piece.annots]
+    stages: Dict[str, float] = {}
+
+    t: float = time.perf_counter()
+    export(piece.filename, piece.title, melodies, annots, piece.key, piece.meter, piece.svg, piece.direct)
+    stages['export'] = time.perf_counter() - t
+
+    if piece.midi:
+        t = time.perf_counter()
+        export_midi(piece.filename, piece.title, melodies, annots, piece.key, piece.mode, piece.meter)
+        stages['midi'] = time.perf_counter() - t
+
+    return stages
+
+def export(filename: str, title: str, melodies: List[Tuple[str, List[Note], List[str]]], annots: List[Tuple[str, List[str]]], key: str, meter: str, svg: bool, direct: bool = False) -> None:
+
+    dir = os.path.dirname(os.path.join(DIR_OUT, f'{filename}'))
+    os.makedirs(dir, exist_ok=True)
+    f: str = f'{DIR_OUT}/{filename}.mxl'
+
+    if direct:
+        musicxml.export(f, title, melodies, annots, key, meter, VOICES)
+    else:
+        export_music21(f, title, melodies, annots, key, meter)
+    log.info('==> %s', f, style='green', event='written', filename=f)
+
+    if svg:
+        ff = f.replace('.mxl', '.svg')
+        log.info('==> %s', ff, style='green', event='written', filename=ff)
+        os.system(f'verovio {f}')
+        os.system(f'firefox {ff}')
+
+
+def export_midi(filename: str, title: str, melodies: List[Tuple[str, List[Note], List[str]]], annots: List[Tuple[str, List[str]]], key: str, mode: str, meter: str) -> None:
+
+    dir = os.path.dirname(os.path.join(DIR_OUT, f'{filename}'))
+    os.makedirs(dir, exist_ok=True)
+    f: str = f'{DIR_OUT}/{filename}.mid'
+
+    midi.export(f, title, melodies, annots, key, mode, meter, VOICES)
+    log.info('==> %s', f, style='green', event='written', filename=f)
+
+def export_music21(f: str, title: str, melodies: List[Tuple[str, List[Note], List[str]]], annots: List[Tuple[str, List[str]]], key: str, meter: str) -> None:
+
+    import music21 as m21
 
     score = m21.stream.Score()
     score.insert(0, m21.metadata.Metadata())
@@ -44,43 +112,28 @@ def export(filename: str, title: str, melodies: List[Tuple[str, List[Note], List
         else:
             part.insert(0, m21.clef.TrebleClef())
 
-        for n, l in zip(mel, lyr):
+        last: bool = name == VOICES[min(len(VOICES), len(melodies)) - 1]
+        for i, (n, l) in enumerate(zip(mel, lyr)):
             note = m21.note.Rest() if n.pitch.is_undefined() else m21.note.Note(n.pitch)
             note.duration = m21.duration.Duration(n.quarter_length())
             if l and not l == '~':
                 note.lyric = ''.join(c for c in l if c not in '!>/')
+            if last:
+                # annotations go below the lowest part
+                for _, annot in annots:
+                    if annot[i] != '~':
+                        note.addLyric(annot[i])
 
             part.append(note)
 
         part.transpose(key, inPlace=True)
         part.makeMeasures(inPlace = True, innerBarline = m21.bar.Barline())
+        # split the notes across bar lines now: left to the writer, a rest following one is written before its tied end
+        part.makeTies(inPlace = True)
         part.makeBeams(inPlace = True)
         # part.show('txt')
 
         score.append(part)
 
-    bassPart = score.parts[-1]
-    for name, annot in annots:
-        # data = ''.join([f'{note:3s}' for note in lyr])
-        # print(f'🏷️ {name:5s}', data)
-
-        for note in bassPart.flatten().notesAndRests:
-            t = annot.pop(0)
-            if t != '~':
-                note.addLyric(t)
-
     # score.show('txt')
-    dir = os.path.dirname(os.path.join(DIR_OUT, f'{filename}'))
-    os.makedirs(dir, exist_ok=True)
-    f: str = f'{DIR_OUT}/{filename}.mxl'
-
-    print(f'[green]==> {f}')
     score.write('musicxml', f)
-
-    if svg:
-        ff = f.replace('.mxl', '.svg')
-        print(f'[green]==> {ff}')
-        os.system(f'verovio {f}')
-        os.system(f'firefox {ff}')
-
-    print()
\ No newline at end of file
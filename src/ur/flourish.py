@@ -1,5 +1,6 @@
 import nonchord
 import random
+import log
 
 FLOURISH = {
     'third-passing': 0.4,
@@ -97,8 +98,8 @@ def flourish(items, i, rhy_i, thresholds, ternary):
                 nonchord.note_direction(n1, n2, 2)
             ]
             
-    if new_items:
+    if new_items and log.enabled(log.DEBUG):
         new =  '  '.join([f'{n} {r}' for n, r in zip([n1] + new_items, rhy.split(' '))])
-        print(f"Flourish: {n1} {rhy_i} {n2} => {new}  {n2}")
+        log.debug('Flourish: %s %s %s => %s  %s', n1, rhy_i, n2, new, n2, event='flourish')
 
     return rhy, lyr, new_items 
\ No newline at end of file
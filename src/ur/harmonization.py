@@ -28,33 +28,39 @@
 
 import glob
 import random
+import sys
+import time
+import itertools
 import music
 from music import Note, Pitch, Duration, Chord, Syllable
-import music21 as m21
-from music21.stream import Part, Score
 from rich import print
 import argparse
-from typing import cast, Tuple, List
+from typing import cast, Any, Dict, Optional, Tuple, List
 import os
 
 import ur
+import export
+import instrument
+import memory
+import log
+import batch
 from trees import *
 from rulesets.sh import *
 
 from load import *
 
 
-def harm_sacred(mel: Part, lyr: List[str], struct: StructureNode) -> ur.Model:
-    print('[yellow]### Init')
+def harm_sacred(tune: Tune, lyr: List[str], struct: StructureNode) -> ur.Model:
+    log.info('### Init', style='yellow')
 
-    key, mode = key_from_part(mel)
-    mel.transpose(m21.interval.Interval(key).reverse(), inPlace=True)
+    # the tune is already transposed to C major (resp. A minor)
+    key, mode = tune.key, tune.mode
 
-    print(f'Key: [blue]{key}')
+    log.info('Key: %s', key, key=key)
 
     # determine time signature of melody 
-    meter = mel.timeSignature.ratioString
-    print(f'Meter: [blue]{meter}')
+    meter = tune.meter
+    log.info('Meter: %s', meter, meter=meter)
 
     sh: ur.Model = ur.Model(key, mode, meter)
 
@@ -72,11 +78,11 @@ def harm_sacred(mel: Part, lyr: List[str], struct: StructureNode) -> ur.Model:
 
     sh.setup()
     
-    rhythm, pitches = grid_from_part(mel)
-    fill_in = fill_in_from_part(mel)
+    rhythm, pitches = grid_from_tune(tune)
+    fill_in = fill_in_from_tune(tune)
 
     # content generation: fix some vps, add producers to others
-    sh.set_structure(struc)
+    sh.set_structure(struct)
     sh['rhy'].initialize_to(rhythm)
     sh['lyr'].initialize_to(lyr)
     sh['pitchGridT'].initialize_to(pitches)
@@ -101,25 +107,125 @@ def harm_sacred(mel: Part, lyr: List[str], struct: StructureNode) -> ur.Model:
     sh.add_evaluator(MelodyHarm(), 'pitchGridS', 'chords')
     sh.add_evaluator(MelodyHarm(), 'pitchGridA', 'chords')
     
-    print()
-
     # ------------------------------------------------------------
     # generation
 
-    print('[yellow]### Generating ')
+    log.info('### Generating', style='yellow')
 
     sh.generate()
 
     return sh
 
 
+def structure_from_tune(tune: Tune, sections: int = 2) -> StructureNode:
+    """
+    Build a flat structure tree of roughly equal sections for a tune,
+    cutting only where both its rhythm grid and its notes have a boundary.
+    """
+    rhythm, _ = grid_from_tune(tune)
+    grid_bounds: List[float] = list(itertools.accumulate([d.quarter_length() for d in rhythm]))
+    note_bounds = set(itertools.accumulate(tune.durations))
+    bounds: List[float] = [b for b in grid_bounds if b in note_bounds]
+    total: float = bounds[-1]
+
+    cuts: List[float] = [0.0]
+    for i in range(1, sections):
+        cut: float = min(bounds, key = lambda b: abs(b - total * i / sections))
+        if cut > cuts[-1] and cut < total:
+            cuts.append(cut)
+    cuts.append(total)
+
+    names: str = 'ABCDEFGHIJKLMNOPQRSTUVWXY'
+    return StructureNode(0.0, total, 'ALL', [
+        StructureNode(start, end, names[i]) for (i, (start, end)) in enumerate(zip(cuts, cuts[1:]))
+    ])
+
+
+def harm_job(mel_path: str, lyr_path: str, seed: int, out: str, svg: bool = False, direct: bool = False, midi: bool = False, deferred: bool = False) -> Tuple[Dict[str, float], Dict[str, Dict[str, Any]]] | Tuple[Dict[str, float], Dict[str, Dict[str, Any]], export.Piece]:
+    """
+    Harmonize one tune with one seed and export it to `data/gen/<out>/<tune>-<seed>.mxl` (and `.mid`).
+
+    :param deferred: do not export, but return the snapshot to export
+    :returns: the duration of each stage, in seconds, the reports of the model (see `batch.reports`),
+              and the snapshot to export, if deferred
+    """
+    random.seed(seed)
+    stages: Dict[str, float] = {}
+
+    t: float = time.perf_counter()
+    tune: Tune = load_tune(mel_path)
+    lyr: List[str] = [s for v in load_lyrics(lyr_path, STRESS_WORDS) for s in v] # flatten
+    stages['load'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    sh: ur.Model = harm_sacred(tune, lyr, structure_from_tune(tune))
+    stages['generate'] = time.perf_counter() - t
+
+    stem: str = os.path.splitext(tune.name)[0]
+    piece: export.Piece = sh.snapshot(f'{out}/{stem}-{seed}', f'{stem} reharmonized ({seed})', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'], svg, direct, midi)
+    if deferred:
+        return (stages, batch.reports(sh), piece)
+    stages.update(export.write(piece))
+    return (stages, batch.reports(sh))
+
+
+def harm_batch(corpus_dir: str, lyrics_dir: str, seeds: range, workers: int, out: str = 'harm', pattern: str = '*.mxl', quiet: bool = True, direct: bool = False, midi: bool = False, export_workers: int = 0) -> List[Tuple[str, str]]:
+    """
+    Harmonize all tunes of a corpus directory (having lyrics) with all given seeds, in a pool of worker processes.
+    Results are written to `data/gen/<out>/` as soon as they are ready, and statistics are reported at the end.
+
+    :param export_workers: if not 0, export in that many background workers, overlapping with generation
+    :returns: the failed jobs, as (name, error)
+    """
+    deferred: bool = export_workers > 0
+    jobs: List[Tuple[str, tuple]] = []
+    for mel_path in sorted(glob.glob(os.path.join(corpus_dir, pattern))):
+        lyr_path: Optional[str] = match_lyrics(mel_path, lyrics_dir)
+        if lyr_path is None:
+            print(f'[red]!! no lyrics for {mel_path}')
+            continue
+        jobs += [(f'{os.path.basename(mel_path)} ({seed})', (mel_path, lyr_path, seed, out, False, direct, midi, deferred)) for seed in seeds]
+
+    print(f'[yellow]### Harmonizing {len(jobs)} pieces with {workers} workers')
+    if not deferred:
+        return batch.run(harm_job, jobs, workers, quiet, music21=not direct)
+    with batch.ExportQueue(export_workers, processes=not direct, quiet=quiet, music21=not direct) as exports:
+        return batch.run(harm_job, jobs, workers, quiet, exports, music21=False)
+
+
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description='Sacred Harp re-harmonization')
+    parser.add_argument('corpus', nargs='?', help='harmonize all tunes of this corpus directory (default: only Villulia)')
+    parser.add_argument('--lyrics', default='data/lyrics', help='lyrics directory (default: %(default)s)')
+    parser.add_argument('--pattern', default='*.mxl', help='tunes to harmonize in the corpus directory (default: %(default)s)')
+    parser.add_argument('--seeds', default='0:1', help='range of random seeds, as first:last+1 (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: %(default)s)')
+    parser.add_argument('--out', default='harm', help='output subdirectory of data/gen/ (default: %(default)s)')
+    parser.add_argument('--direct', action='store_true', help='write MusicXML directly, without music21')
+    parser.add_argument('--midi', action='store_true', help='also write a MIDI file of each piece')
+    parser.add_argument('--log-level', default='debug', choices=['debug', 'info', 'warning', 'error', 'quiet'], help='lowest level of the printed messages (default: %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='only print warnings and errors')
+    parser.add_argument('--log-json', metavar='FILE', help='also append the log records to FILE, as JSON lines')
+    parser.add_argument('--stats', action='store_true', help='count and time the calls of each rule, and report them after each generation, or totalled over the pieces of a batch')
+    parser.add_argument('--memory', action='store_true', help='profile the memory of each VP, node, generator and rule table (slow), and report it after each generation, or combined over the pieces of a batch')
+    parser.add_argument('--export-workers', type=int, default=0, help='export in that many background workers, overlapping with generation (default: export in the generation workers)')
+    args = parser.parse_args()
+    log.configure(log.WARNING if args.quiet else log.level_from(args.log_level), args.log_json, log.level_from(args.log_level))
+    instrument.enable(args.stats)
+    memory.enable(args.memory)
+
+    if args.corpus:
+        failures = harm_batch(args.corpus, args.lyrics, batch.seed_range(args.seeds), args.workers, args.out, args.pattern, direct=args.direct, midi=args.midi, export_workers=args.export_workers)
+        sys.exit(1 if failures else 0)
+
     mel_path: str = os.path.join(os.getcwd(), "data/1991-denson/56bd.mxl")
     lyr_path: str = os.path.join(os.getcwd(), "data/lyrics/56b_Villulia.txt")
-    mel: Part = load_melody(mel_path)
+    tune: Tune = load_tune(mel_path)
     lyr: List[str] = [s for v in load_lyrics(lyr_path, STRESS_WORDS) for s in v] # flatten
 
-    sh: ur.Model = harm_sacred(mel, lyr, struc)
+    sh: ur.Model = harm_sacred(tune, lyr, struc)
 
-    sh.export('test','Villulia reharmonized', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'], False)
\ No newline at end of file
+    sh.export('test','Villulia reharmonized', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'], False, args.direct)
+    if args.midi:
+        sh.export_midi('test','Villulia reharmonized', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'])
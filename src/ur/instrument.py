@@ -0,0 +1,203 @@
+'''
+Per-rule instrumentation: counting and timing the calls of the production and evaluation functions of the rules
+of a model during `Model.generate`, reported per VP and per rule class.
+
+Rules are only wrapped while an instrumented model generates, so that instrumentation costs nothing when disabled.
+'''
+
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import log
+import music
+
+enabled: bool = False
+
+# memoized functions whose cache hits are reported
+CACHES: Dict[str, Any] = {
+    'music.midi': music.midi,
+    'music.transpose': music.transpose,
+}
+
+
+def enable(on: bool = True) -> None:
+    """
+    Instrument the next models to generate.
+    """
+    global enabled
+    enabled = on
+
+
+class Counter:
+    """
+    The calls of one function of one rule, while generating one VP.
+    """
+    def __init__(self):
+        self.calls: int = 0
+        self.time: float = 0.0
+        # candidates output by producers, resp. windows rejected by constraints
+        self.outputs: int = 0
+        self.rejected: int = 0
+
+    def add(self, other: 'Counter') -> None:
+        self.calls += other.calls
+        self.time += other.time
+        self.outputs += other.outputs
+        self.rejected += other.rejected
+
+    def to_dict(self) -> Dict[str, float]:
+        return {'calls': self.calls, 'time': round(self.time, 6), 'outputs': self.outputs, 'rejected': self.rejected}
+
+
+class Stats:
+    """
+    The counters of all rules of a model, by (VP being generated, rule class, function).
+    Each call of `valid`/`score` evaluates one window.
+    """
+
+    # functions wrapped on each kind of rule
+    FUNCTIONS: Dict[str, List[str]] = {
+        'Enumerator': ['enumerate', 'guard', 'fetch_args'],
+        'RandomizedProducer': ['produce', 'guard', 'fetch_args'],
+        'Constraint': ['valid', 'fetch_args'],
+        'Scorer': ['score', 'fetch_args'],
+    }
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, str, str], Counter] = {}
+        self.vp: str = ''
+        self.wrapped: List[Tuple[Any, str]] = []
+        self.start: float = time.perf_counter()
+        self.elapsed: float = 0.0
+        self.caches: Dict[str, Tuple[int, int]] = {name: self.cache_info(f) for (name, f) in CACHES.items()}
+
+    @staticmethod
+    def cache_info(f: Any) -> Tuple[int, int]:
+        info = f.cache_info()
+        return (info.hits, info.misses)
+
+    def counter(self, rule: Any, function: str) -> Counter:
+        key: Tuple[str, str, str] = (self.vp, type(rule).__name__, function)
+        if key not in self.counters:
+            self.counters[key] = Counter()
+        return self.counters[key]
+
+    def wrap(self, rule: Any, function: str) -> None:
+        f: Callable[..., Any] = getattr(rule, function)
+        perf_counter = time.perf_counter
+
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            t: float = perf_counter()
+            r: Any = f(*args, **kwargs)
+            t = perf_counter() - t
+            c: Counter = self.counter(rule, function)
+            c.calls += 1
+            c.time += t
+            if function == 'valid' and not r:
+                c.rejected += 1
+            elif function == 'produce':
+                c.outputs += 1
+            elif function == 'enumerate':
+                c.outputs += len(r)
+            return r
+
+        setattr(rule, function, timed)
+        self.wrapped.append((rule, function))
+
+    def attach(self, model: Any) -> None:
+        """
+        Wrap the functions of all rules of a model (shadowing the class functions by instance attributes).
+        """
+        import ur
+        rules: Dict[int, Any] = {}
+        for vp in model.vps:
+            for r in vp.producers + vp.constraints + vp.scorers:
+                rules[id(r)] = r
+        for r in rules.values():
+            for (kind, functions) in self.FUNCTIONS.items():
+                if isinstance(r, getattr(ur, kind)):
+                    for function in functions:
+                        self.wrap(r, function)
+
+    def detach(self) -> None:
+        for (rule, function) in self.wrapped:
+            delattr(rule, function)
+        self.wrapped = []
+        self.elapsed = time.perf_counter() - self.start
+        for (name, f) in CACHES.items():
+            hits, misses = self.cache_info(f)
+            self.caches[name] = (hits - self.caches[name][0], misses - self.caches[name][1])
+
+    def by_rule(self) -> Dict[Tuple[str, str], Counter]:
+        """
+        The counters summed over all VPs, by (rule class, function).
+        """
+        result: Dict[Tuple[str, str], Counter] = {}
+        for ((_, rule, function), c) in self.counters.items():
+            result.setdefault((rule, function), Counter()).add(c)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        vps: Dict[str, Dict[str, Dict[str, Dict[str, float]]]] = {}
+        for ((vp, rule, function), c) in self.counters.items():
+            vps.setdefault(vp, {}).setdefault(rule, {})[function] = c.to_dict()
+        rules: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for ((rule, function), c) in self.by_rule().items():
+            rules.setdefault(rule, {})[function] = c.to_dict()
+        return {
+            'elapsed': round(self.elapsed, 6),
+            'vps': vps,
+            'rules': rules,
+            'caches': {name: {'hits': h, 'misses': m} for (name, (h, m)) in self.caches.items()},
+        }
+
+    def table(self) -> str:
+        return table(self.to_dict())
+
+    def report(self) -> None:
+        if not log.enabled(log.INFO):
+            return
+        log.info('### Rule statistics', style='yellow')
+        log.info('%s', self.table(), event='stats', stats=self.to_dict())
+
+
+def table(stats: Dict[str, Any]) -> str:
+    """
+    The report of rule statistics given as dicts (see `Stats.to_dict`), by VP and rule, then by rule.
+    """
+    counters: List[Tuple[str, str, str, Dict[str, float]]] = [(vp, rule, function, c)
+                                                              for (vp, rules) in stats['vps'].items()
+                                                              for (rule, functions) in rules.items()
+                                                              for (function, c) in functions.items()]
+    lines: List[str] = [f'{"VP":16s} {"rule":28s} {"function":10s} {"calls":>8s} {"time":>9s} {"per call":>10s} {"outputs":>8s} {"rejected":>8s}']
+    for (vp, rule, function, c) in sorted(counters, key=lambda r: -r[3]['time']):
+        lines.append(f'{vp:16s} {rule:28s} {function:10s} {c["calls"]:8d} {c["time"]:8.3f}s {1e6 * c["time"] / c["calls"]:8.1f}us {c["outputs"]:8d} {c["rejected"]:8d}')
+    lines.append('')
+    lines.append(f'{"(all VPs)":16s} {"rule":28s} {"function":10s} {"calls":>8s} {"time":>9s} {"share":>10s}')
+    by_rule: List[Tuple[str, str, Dict[str, float]]] = [(rule, function, c)
+                                                        for (rule, functions) in stats['rules'].items()
+                                                        for (function, c) in functions.items()]
+    for (rule, function, c) in sorted(by_rule, key=lambda r: -r[2]['time']):
+        lines.append(f'{"":16s} {rule:28s} {function:10s} {c["calls"]:8d} {c["time"]:8.3f}s {100 * c["time"] / stats["elapsed"]:9.1f}%')
+    lines.append('')
+    for (name, c) in stats['caches'].items():
+        lines.append(f'cache {name}: {c["hits"]} hits, {c["misses"]} misses')
+    lines.append(f'generation: {stats["elapsed"]:.3f}s')
+    return '\n'.join(lines)
+
+
+def merge(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The rule statistics of several generations (see `Stats.to_dict`), totalled.
+    """
+    def add(total: Dict[str, Any], other: Dict[str, Any]) -> None:
+        for (k, v) in other.items():
+            if isinstance(v, dict):
+                add(total.setdefault(k, {}), v)
+            else:
+                total[k] = round(total.get(k, 0) + v, 6)
+
+    result: Dict[str, Any] = {'elapsed': 0.0, 'vps': {}, 'rules': {}, 'caches': {}}
+    for s in stats:
+        add(result, s)
+    return result
@@ -1,18 +1,26 @@
+from __future__ import annotations
 import glob
 import random
 import music
+import lyrics
+import corpus
+import musicxml
+from corpus import Tune
 from music import Note, Pitch, Duration, Syllable
-import music21 as m21
-from music21.stream import Part, Score
 from rich import print
 import argparse
-from typing import cast, Tuple, List
+from typing import cast, Dict, Optional, Tuple, List, TYPE_CHECKING
 import os
 
+# music21 is only imported when a score has to be parsed
+if TYPE_CHECKING:
+    from music21.stream import Part, Score
+
 
 def key_from_part(p: Part) -> Tuple[str, str]:
     '''Return key (in interval to C) and mode of a part
     '''
+    import music21 as m21
     ks = p.keySignature
     origin = m21.pitch.Pitch('C')
     if p.notes[0] != ks.tonic: # first note is always tonic in SH
@@ -51,8 +59,10 @@ def fill_in_from_part(mel: Part) -> List[Note]:
         
     return notes
 
-def load_melody(filename: str) -> Part:
-    c: Score = cast(Score, m21.converter.parse(filename))
+def load_melody(filename: str, c: Optional[Score] = None) -> Part:
+    import music21 as m21
+    if c is None:
+        c = cast('Score', m21.converter.parse(filename))
     mel: Part = c.parts['tenor'].flatten()
     tonic_interval, _ = key_from_part(mel)
 
@@ -61,20 +71,107 @@ def load_melody(filename: str) -> Part:
 
     return mel
 
+def grid_from_tune(tune: Tune) -> Tuple[List[Duration], List[Pitch]]:
+    """
+    Extract a rhythm and a pitch grid from a tune, as `grid_from_part` does from a part
+
+    :returns: lists of 1. durations and 2. pitches
+    """
+    rhythm: List[Duration] = []
+    pitches: List[Pitch] = []
+
+    for d, b, p in zip(tune.durations, tune.beat_strengths, tune.pitch_ids):
+        if b >= 0.5:
+            rhythm.append(Duration(music.quantize_above(d, tune.meter)))
+            pitches.append(Pitch(tune.vocabulary[p]))
+
+    return (rhythm, pitches)
+
+def fill_in_from_tune(tune: Tune) -> List[Note]:
+    """
+    Extract a sequence of Notes from a tune, as `fill_in_from_part` does from a part
+    """
+    return tune.notes()
+
+def tune_from_part(name: str, mel: Part, key: str, mode: str) -> Tune:
+    """
+    Extract the notes of a flat part, already transposed to C (resp. A), into a Tune
+    """
+    vocabulary: Dict[str, int] = {}
+    pitch_ids: List[int] = []
+    durations: List[float] = []
+    offsets: List[float] = []
+    beat_strengths: List[float] = []
+    for n in mel.notes:
+        p: str = n.pitches[0].nameWithOctave # chords (divisi): just take the first pitch
+        pitch_ids.append(vocabulary.setdefault(p, len(vocabulary)))
+        durations.append(float(n.duration.quarterLength))
+        offsets.append(float(n.offset))
+        beat_strengths.append(n.beatStrength)
+    return Tune(name, key, mode, mel.timeSignature.ratioString,
+                durations, offsets, beat_strengths, pitch_ids, list(vocabulary))
+
+def tunes_from_file(filename: str) -> Dict[str, Tune]:
+    """
+    Parse a score with music21 and extract all its parts as Tunes, transposed to C major (resp. A minor).
+    Key and mode are taken from the tenor, the tenor is transposed down an octave if notated in treble clef.
+
+    :returns: the tunes, by lower-case part name
+    """
+    import music21 as m21
+    c: Score = cast('Score', m21.converter.parse(filename))
+    name: str = os.path.basename(filename)
+    tenor: Part = load_melody(filename, c)
+    key, mode = key_from_part(tenor)
+    to_c = m21.interval.Interval(key).reverse()
+
+    tunes: Dict[str, Tune] = {}
+    for (i, p) in enumerate(c.parts):
+        part_name: str = (p.partName or f'part{i}').lower()
+        mel: Part = tenor if part_name == 'tenor' else p.flatten()
+        tunes[part_name] = tune_from_part(name, mel.transpose(to_c), key, mode)
+    return tunes
+
+def read_tunes(filename: str, parts: Optional[List[str]] = None) -> Dict[str, Tune]:
+    """
+    Extract parts of a score as Tunes: MusicXML scores are streamed (see `musicxml.read_tunes`),
+    other formats are parsed with music21.
+
+    :param parts: the lower-case names of the parts to extract (by default all parts)
+    :returns: the tunes, by lower-case part name
+    """
+    if os.path.splitext(filename)[1] in musicxml.READ_EXTENSIONS:
+        return musicxml.read_tunes(filename, parts)
+    tunes: Dict[str, Tune] = tunes_from_file(filename)
+    return tunes if parts is None else {p: tunes[p] for p in parts}
+
+def load_tune(filename: str, part: str = 'tenor') -> Tune:
+    """
+    Load a part of a score as a Tune, from the corpus store if it holds an up-to-date copy, otherwise from the score.
+    """
+    store = corpus.store_for(filename)
+    if store is not None and store.up_to_date(filename):
+        return store.tune(filename, part)
+    return read_tunes(filename, [part])[part]
+
+def match_lyrics(mel_path: str, lyrics_dir: str) -> Optional[str]:
+    """
+    Find the lyrics of a tune, e.g. `data/lyrics/56b_Villulia.txt` for `data/1991-denson/56bd.mxl`
+    """
+    stem: str = os.path.splitext(os.path.basename(mel_path))[0]
+    for s in [stem, stem.rstrip('d')]:
+        candidates = sorted(glob.glob(os.path.join(lyrics_dir, f'{glob.escape(s)}_*.txt')))
+        if candidates:
+            return candidates[0]
+    return None
+
 def load_lyrics(file: str, stress_words: List[str]) -> List[List[Syllable]]:
     """
     Load first stanza  from file as list of syllables, grouped by verse
     """
     stanza: List[List[Syllable]] = []
     for l in open(file, encoding='utf-8').readlines(): 
-        verse: List[Syllable] = []
         if l == '\n':
             break # only load first stanza
-        text: str = l.replace('-', ' -').strip() + '/'
-        for s in text.split():
-            for ww in stress_words:
-                if ww in s:
-                    s = '!' + s
-            verse += [Syllable(s)]
-        stanza.append(verse)
-    return stanza
\ No newline at end of file
+        stanza.append(lyrics.syllables(l, stress_words))
+    return stanza
@@ -0,0 +1,110 @@
+'''
+Leveled logging for the generation internals, replacing direct prints on the hot paths.
+
+Messages are formatted only when their level is enabled: pass the arguments to format instead of an f-string,
+e.g. `log.debug('%s', vp)`, and guard anything costlier with `if log.enabled(log.DEBUG):`.
+Functions of disabled levels are bound to a no-op.
+
+Records can also be appended to a file as JSON lines, with the extra keyword fields given to the call.
+'''
+
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, IO, Optional
+
+from rich import get_console, print as rich_print
+from rich.markup import escape
+
+# rich draws from the global random generator when its styles are first imported:
+# set its console up now, before any seeding, so that a seeded generation does not depend
+# on whether the process printed something before
+get_console()
+
+DEBUG: int = 10
+INFO: int = 20
+WARNING: int = 30
+ERROR: int = 40
+QUIET: int = 100
+
+NAMES: Dict[int, str] = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+
+_console_level: int = INFO
+_json_level: int = DEBUG
+_json_path: Optional[str] = None
+_json_out: Optional[IO[str]] = None
+_lowest: int = INFO
+
+
+def _emit(level: int, msg: str, args: tuple, style: Optional[str], fields: Dict[str, Any]) -> None:
+    text: str = msg % args if args else msg
+    if level >= _console_level:
+        if style:
+            rich_print(f'[{style}]{escape(text)}')
+        else:
+            sys.stdout.write(text + '\n')
+    if _json_out is not None and level >= _json_level:
+        record: Dict[str, Any] = {'time': round(time.time(), 6), 'pid': os.getpid(), 'level': NAMES[level], 'msg': text}
+        record.update(fields)
+        _json_out.write(json.dumps(record, default=str) + '\n')
+
+
+def _logger(level: int) -> Callable[..., None]:
+    def log(msg: str, *args: Any, style: Optional[str] = None, **fields: Any) -> None:
+        _emit(level, msg, args, style, fields)
+    return log
+
+
+def _off(msg: str, *args: Any, style: Optional[str] = None, **fields: Any) -> None:
+    pass
+
+
+debug: Callable[..., None] = _off
+info: Callable[..., None] = _logger(INFO)
+warning: Callable[..., None] = _logger(WARNING)
+error: Callable[..., None] = _logger(ERROR)
+
+
+def configure(level: int = INFO, json_path: Optional[str] = None, json_level: int = DEBUG) -> None:
+    """
+    Set the levels of the console and JSON outputs.
+
+    :param level: the lowest level printed on the console (`QUIET` prints nothing)
+    :param json_path: a file where records are appended as JSON lines (none by default)
+    :param json_level: the lowest level written as JSON
+    """
+    global _console_level, _json_level, _json_path, _json_out, _lowest, debug, info, warning, error
+    if _json_out is not None and json_path != _json_path:
+        _json_out.close()
+        _json_out = None
+    if json_path and _json_out is None:
+        _json_out = open(json_path, 'a', buffering=1, encoding='utf-8')
+    _console_level, _json_level, _json_path = level, json_level, json_path
+    _lowest = min(level, json_level if _json_out else QUIET)
+
+    debug = _logger(DEBUG) if DEBUG >= _lowest else _off
+    info = _logger(INFO) if INFO >= _lowest else _off
+    warning = _logger(WARNING) if WARNING >= _lowest else _off
+    error = _logger(ERROR) if ERROR >= _lowest else _off
+
+
+def quiet() -> None:
+    """
+    Silence the console, keeping the JSON output (for batch workers).
+    """
+    configure(QUIET, _json_path, _json_level)
+
+
+def enabled(level: int) -> bool:
+    return level >= _lowest
+
+
+def level_from(name: str) -> int:
+    """
+    Parse a level name (`debug`, `info`, `warning`, `error`, `quiet`).
+    """
+    for (level, n) in list(NAMES.items()) + [(QUIET, 'quiet')]:
+        if n == name.lower():
+            return level
+    raise RuntimeError(f"Unknown log level '{name}'")
@@ -0,0 +1,92 @@
+import glob
+import os
+import random
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from music import Syllable
+
+
+def syllables(line: str, stress_words: List[str] | Tuple[str, ...]) -> List[Syllable]:
+    """
+    Tokenize a verse into syllables, marking the ones containing a stress word with '!'.
+    The end of the verse is marked by a trailing '/'.
+    """
+    verse: List[Syllable] = []
+    text: str = line.replace('-', ' -').strip() + '/'
+    for s in text.split():
+        for ww in stress_words:
+            if ww in s:
+                s = '!' + s
+        verse.append(Syllable(s))
+    return verse
+
+
+class LyricsIndex:
+    """
+    The verses of a lyrics corpus, tokenized once and bucketed by syllable count.
+
+    Verses are kept sorted by length, so that all verses within a length range form a contiguous slice:
+    drawing uniformly from that slice is a draw over the buckets weighted by their sizes, in O(1).
+
+    :param directory: the directory containing the lyrics files (`*.txt`)
+    :param stress_words: the words whose syllables get a stress mark
+    """
+
+    def __init__(self, directory: str, stress_words: Tuple[str, ...]):
+        self.directory: str = directory
+        self.buckets: Dict[int, List[Tuple[Syllable, ...]]] = {}
+
+        for f in sorted(glob.glob(os.path.join(directory, '*.txt'))):
+            for l in open(f, encoding='utf-8').readlines():
+                if not l.strip():
+                    continue
+                verse = tuple(syllables(l, stress_words))
+                self.buckets.setdefault(len(verse), []).append(verse)
+
+        self.verses: List[Tuple[Syllable, ...]] = []
+        # first[n]: position in self.verses of the first verse with at least n syllables
+        self.first: List[int] = []
+        self.max_length: int = max(self.buckets.keys(), default=0)
+        for n in range(self.max_length + 1):
+            self.first.append(len(self.verses))
+            self.verses += self.buckets.get(n, [])
+        self.first.append(len(self.verses))
+
+    def __len__(self) -> int:
+        return len(self.verses)
+
+    def span(self, min_length: int = 0, max_length: Optional[int] = None) -> Tuple[int, int]:
+        """
+        The slice of `self.verses` holding the verses with `min_length` to `max_length` syllables (inclusive bounds).
+        """
+        lo: int = self.first[min(max(min_length, 0), self.max_length + 1)]
+        if max_length is None or max_length >= self.max_length:
+            hi: int = len(self.verses)
+        else:
+            hi = self.first[max(max_length + 1, 0)]
+        return (lo, max(lo, hi))
+
+    def count(self, min_length: int = 0, max_length: Optional[int] = None) -> int:
+        lo, hi = self.span(min_length, max_length)
+        return hi - lo
+
+    def choose(self, min_length: int = 0, max_length: Optional[int] = None) -> List[Syllable]:
+        """
+        Draw a random verse with `min_length` to `max_length` syllables (inclusive bounds).
+        """
+        lo, hi = self.span(min_length, max_length)
+        if lo == hi:
+            raise RuntimeError(f"No verse of {min_length} to {max_length} syllables in {self.directory}")
+        return list(self.verses[random.randrange(lo, hi)])
+
+
+@lru_cache(maxsize=None)
+def _index(directory: str, stress_words: Tuple[str, ...]) -> LyricsIndex:
+    return LyricsIndex(directory, stress_words)
+
+def index(directory: str, stress_words: List[str] | Tuple[str, ...]) -> LyricsIndex:
+    """
+    Return the lyrics index of a directory, built once per process.
+    """
+    return _index(os.path.normpath(directory), tuple(stress_words))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Compiled Markov models: binary files holding the tables of `HiddenMarkov` producers, several models per file
+(e.g. one per mode and voice), written by the corpus analysis (`intervals-horizontal.py --model`)
+and loaded lazily by the producers referencing them with `MODEL`.
+
+Files are memory-mapped: the tables are read from the mapped arrays, a row at a time, on first access.
+
+Layout (native byte order, recorded in the header):
+
+    magic `URMARKOV` | version (uint32) | header length (uint32) | JSON header | arrays
+
+The JSON header gives, for each model, its vocabulary (the names of its states and emitted items),
+and the offset (from the start of the arrays, aligned after the header) and length of its arrays,
+of vocabulary indices (int32) and probabilities (float64):
+
+- `STATES`, `FINAL`: lists of states
+- `INITIAL`: initial states, with `INITIAL.probs` when weighted
+- `TRANSITIONS`, `EMISSIONS`: sparse tables by rows, with `.rows` (the row keys), `.indptr` (the start of each row
+  in `.indices` and `.probs`, and the end of the last one), `.indices` and `.probs`
+- `NGRAMS` (since version 2): the counts of the state sequences of lengths 1 to n, as a trie stored by levels:
+  `.<d>.symbols` and `.<d>.counts` give the last state and the count of the sequences of length d, sorted by
+  prefix then by symbol, and `.<d>.children` the range of the extensions of each of them in level d + 1
+
+    python3 src/ur/markovfile.py data/models/melody.urm
+    python3 src/ur/markovfile.py data/models/chords.urm --compile rulesets.harp --filter Chords
+'''
+
+import array
+import bisect
+import functools
+import importlib
+import inspect
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+MAGIC: bytes = b'URMARKOV'
+VERSION: int = 2
+
+# magic, version, header length
+PREFIX: struct.Struct = struct.Struct(f'<{len(MAGIC)}sII')
+
+# tables of a model, as named in `HiddenMarkov`
+TABLES: List[str] = ['STATES', 'INITIAL', 'FINAL', 'TRANSITIONS', 'EMISSIONS', 'NGRAMS']
+SPARSE: List[str] = ['TRANSITIONS', 'EMISSIONS']
+
+# array item types
+INDEX: str = 'i'
+PROB: str = 'd'
+
+ALIGN: int = 8
+
+
+class Row(dict):
+    '''A row of a table: missing items have probability 0 (without being inserted, unlike `defaultdict`)
+    '''
+    def __missing__(self, key: str) -> float:
+        return 0.0
+
+
+class Table(Mapping):
+    """
+    A sparse table, decoding its rows from the mapped arrays on first access. Missing rows are empty.
+    """
+    def __init__(self, vocabulary: List[str], rows: memoryview, indptr: memoryview, indices: memoryview, probs: memoryview):
+        self.vocabulary: List[str] = vocabulary
+        self.rows: Dict[str, int] = {vocabulary[r]: i for (i, r) in enumerate(rows)}
+        self.indptr: memoryview = indptr
+        self.indices: memoryview = indices
+        self.probs: memoryview = probs
+        self.decoded: Dict[str, Row] = {}
+
+    def __getitem__(self, key: str) -> Row:
+        row: Optional[Row] = self.decoded.get(key)
+        if row is None:
+            i: Optional[int] = self.rows.get(key)
+            if i is None:
+                return Row()
+            (start, end) = (self.indptr[i], self.indptr[i + 1])
+            row = Row(zip([self.vocabulary[j] for j in self.indices[start:end]], self.probs[start:end]))
+            self.decoded[key] = row
+        return row
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def nonzeros(self) -> int:
+        return self.indptr[len(self.rows)]
+
+
+class NGrams:
+    """
+    The counts of the state sequences of lengths 1 to `order`, as an array-backed trie:
+    the extensions of a sequence are a range of the next level, sorted by symbol, found by bisection.
+    """
+    def __init__(self, vocabulary: List[str], levels: List[Tuple[memoryview, memoryview, Optional[memoryview]]]):
+        self.vocabulary: List[str] = vocabulary
+        self.index: Dict[str, int] = {x: i for (i, x) in enumerate(vocabulary)}
+        self.levels: List[Tuple[memoryview, memoryview, Optional[memoryview]]] = levels
+        self.order: int = len(levels)
+
+    def successors(self, context: Tuple[str, ...]) -> Row:
+        '''The counts of the states following context (of at most `order` - 1 states), empty if it was not seen
+        '''
+        (lo, hi) = (0, len(self.levels[0][0]))
+        for (d, state) in enumerate(context):
+            (symbols, _, children) = self.levels[d]
+            i: Optional[int] = self.index.get(state)
+            if i is None or children is None:
+                return Row()
+            j: int = bisect.bisect_left(symbols, i, lo, hi)
+            if j == hi or symbols[j] != i:
+                return Row()
+            (lo, hi) = (children[j], children[j + 1])
+        (symbols, counts, _) = self.levels[len(context)]
+        return Row(zip([self.vocabulary[j] for j in symbols[lo:hi]], counts[lo:hi]))
+
+    def __len__(self) -> int:
+        return sum(len(symbols) for (symbols, _, _) in self.levels)
+
+
+class Model:
+    """
+    The tables of one model of a file, each decoded on first access.
+    """
+    def __init__(self, artifact: 'Artifact', name: str):
+        self.artifact: Artifact = artifact
+        self.name: str = name
+        self.entry: Dict[str, Any] = artifact.header['models'][name]
+        self.vocabulary: List[str] = self.entry['vocabulary']
+        self.tables: Dict[str, Any] = {}
+
+    def __contains__(self, table: str) -> bool:
+        return table in self.entry['tables']
+
+    def __getitem__(self, table: str) -> Any:
+        '''A table of the model: a list of states (`STATES`, `FINAL`, unweighted `INITIAL`),
+        a dict of weights (weighted `INITIAL`), or a `Table`
+        '''
+        if table not in self.tables:
+            if table not in self:
+                raise KeyError(f'{self.name}: no {table} in {self.artifact.path}')
+            mapped: Any = lambda suffix, typecode: self.artifact.array(self.entry['arrays'][table + suffix], typecode)
+            if table == 'NGRAMS':
+                levels: List[Tuple[memoryview, memoryview, Optional[memoryview]]] = []
+                d: int = 1
+                while f'{table}.{d}.symbols' in self.entry['arrays']:
+                    children: Optional[memoryview] = mapped(f'.{d}.children', INDEX) if f'{table}.{d}.children' in self.entry['arrays'] else None
+                    levels.append((mapped(f'.{d}.symbols', INDEX), mapped(f'.{d}.counts', PROB), children))
+                    d += 1
+                self.tables[table] = NGrams(self.vocabulary, levels)
+            elif table in SPARSE:
+                self.tables[table] = Table(self.vocabulary, mapped('.rows', INDEX), mapped('.indptr', INDEX),
+                                           mapped('.indices', INDEX), mapped('.probs', PROB))
+            elif table + '.probs' in self.entry['arrays']:
+                self.tables[table] = dict(zip([self.vocabulary[i] for i in mapped('', INDEX)], mapped('.probs', PROB)))
+            else:
+                self.tables[table] = [self.vocabulary[i] for i in mapped('', INDEX)]
+        return self.tables[table]
+
+
+class Artifact:
+    """
+    A compiled model file, memory-mapped.
+    """
+    def __init__(self, path: str):
+        self.path: str = path
+        with open(path, 'rb') as f:
+            self.map: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, length) = PREFIX.unpack_from(self.map)
+        if magic != MAGIC:
+            raise RuntimeError(f'{path}: not a compiled Markov model')
+        self.version: int = version
+        if not 1 <= version <= VERSION:
+            raise RuntimeError(f'{path}: version {version} of the compiled Markov models, expected {VERSION} (compile it again)')
+        self.header: Dict[str, Any] = json.loads(self.map[PREFIX.size:PREFIX.size + length].decode('utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise RuntimeError(f'{path}: compiled on a {self.header["byteorder"]}-endian machine')
+        # the arrays, aligned after the header
+        start: int = PREFIX.size + length
+        self.data: memoryview = memoryview(self.map)[start + -start % ALIGN:]
+        self.models: Dict[str, Model] = {}
+
+    def array(self, location: Tuple[int, int], typecode: str) -> memoryview:
+        '''A mapped array, from its (offset, length)
+        '''
+        (offset, length) = location
+        return self.data[offset:offset + length * array.array(typecode).itemsize].cast(typecode)
+
+    def names(self) -> List[str]:
+        return list(self.header['models'])
+
+    def __getitem__(self, name: str) -> Model:
+        if name not in self.models:
+            if name not in self.header['models']:
+                raise KeyError(f'no model {name} in {self.path}')
+            self.models[name] = Model(self, name)
+        return self.models[name]
+
+
+@functools.lru_cache(maxsize=None)
+def load(path: str) -> Artifact:
+    '''The compiled model file at path, mapped once per process
+    '''
+    return Artifact(path)
+
+
+def write(path: str, models: Dict[str, Dict[str, Any]], source: str = '') -> None:
+    """
+    Write a compiled model file.
+
+    :param models: the tables of each model, by name, as in `HiddenMarkov`: `STATES`, `FINAL` (lists),
+        `INITIAL` (a list, or a dict of weights), `TRANSITIONS`, `EMISSIONS` (dicts of dicts of probabilities),
+        `NGRAMS` (counts by tuple of states, for all lengths from 1 to the order), all optional
+    :param source: where the models come from, stored in the header
+    """
+    blob: bytearray = bytearray()
+    entries: Dict[str, Any] = {}
+
+    def add(a: array.array) -> Tuple[int, int]:
+        blob.extend(bytes(-len(blob) % ALIGN))
+        location: Tuple[int, int] = (len(blob), len(a))
+        blob.extend(a.tobytes())
+        return location
+
+    for (name, tables) in models.items():
+        vocabulary: Dict[str, int] = {}
+        index: Any = lambda x: vocabulary.setdefault(str(x), len(vocabulary))
+        arrays: Dict[str, Tuple[int, int]] = {}
+        for table in TABLES:
+            t: Any = tables.get(table)
+            if t is None:
+                continue
+            if table == 'NGRAMS':
+                # the sequences of each length, sorted by prefix then by last symbol, as vocabulary indices
+                grams: List[Tuple[int, ...]] = sorted(tuple(index(x) for x in g) for g in t)
+                counts: Dict[Tuple[int, ...], float] = {tuple(index(x) for x in g): c for (g, c) in t.items()}
+                order: int = max(len(g) for g in grams)
+                if any(g[:-1] not in counts for g in grams if len(g) > 1):
+                    raise RuntimeError(f'{name}: the n-grams need the counts of all their prefixes')
+                levels: List[List[Tuple[int, ...]]] = [[g for g in grams if len(g) == d] for d in range(1, order + 1)]
+                for (d, level) in enumerate(levels, 1):
+                    arrays[f'{table}.{d}.symbols'] = add(array.array(INDEX, [g[-1] for g in level]))
+                    arrays[f'{table}.{d}.counts'] = add(array.array(PROB, [counts[g] for g in level]))
+                    if d < order:
+                        # start of the extensions of each sequence in the next level (sorted the same way)
+                        starts: List[int] = [bisect.bisect_left(levels[d], g) for g in level] + [len(levels[d])]
+                        arrays[f'{table}.{d}.children'] = add(array.array(INDEX, starts))
+            elif table in SPARSE:
+                indptr: List[int] = [0]
+                for row in t.values():
+                    indptr.append(indptr[-1] + len(row))
+                arrays[table + '.rows'] = add(array.array(INDEX, [index(r) for r in t]))
+                arrays[table + '.indptr'] = add(array.array(INDEX, indptr))
+                arrays[table + '.indices'] = add(array.array(INDEX, [index(x) for row in t.values() for x in row]))
+                arrays[table + '.probs'] = add(array.array(PROB, [p for row in t.values() for p in row.values()]))
+            elif isinstance(t, dict):
+                arrays[table] = add(array.array(INDEX, [index(x) for x in t]))
+                arrays[table + '.probs'] = add(array.array(PROB, t.values()))
+            else:
+                arrays[table] = add(array.array(INDEX, [index(x) for x in t]))
+        entries[name] = {
+            'tables': [table for table in TABLES if tables.get(table) is not None],
+            'vocabulary': list(vocabulary),
+            'arrays': arrays,
+        }
+
+    header: bytes = json.dumps({'byteorder': sys.byteorder, 'source': source, 'models': entries}).encode('utf-8')
+    start: int = PREFIX.size + len(header)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        f.write(bytes(-start % ALIGN))
+        f.write(blob)
+
+
+def compile_tables(module_name: str, pattern: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    The tables defined in the code of the `HiddenMarkov` classes of a module (e.g. `rulesets.harp`), by class name.
+
+    :param pattern: only compile the classes whose name contains it
+    """
+    import ur
+    module = importlib.import_module(module_name)
+    models: Dict[str, Dict[str, Any]] = {}
+    for (name, cls) in inspect.getmembers(module, inspect.isclass):
+        if cls.__module__ != module.__name__ or not issubclass(cls, ur.HiddenMarkov) or (pattern and pattern not in name):
+            continue
+        tables: Dict[str, Any] = {table: getattr(cls, table) for table in TABLES if hasattr(cls, table)}
+        if 'TRANSITIONS' in tables:
+            models[name] = tables
+    return models
+
+
+def describe(path: str) -> None:
+    a: Artifact = load(path)
+    print(f'{path}: version {a.version}, {os.path.getsize(path)} bytes' + (f', from {a.header["source"]}' if a.header['source'] else ''))
+    for name in a.names():
+        model: Model = a[name]
+        sizes: List[str] = []
+        for table in TABLES:
+            if table in model:
+                t: Any = model[table]
+                if isinstance(t, NGrams):
+                    sizes.append(f'{table} order {t.order}/{len(t)}')
+                else:
+                    sizes.append(f'{table} {len(t)}' + (f'/{t.nonzeros()}' if isinstance(t, Table) else ''))
+        print(f'  {name:24s} {len(model.vocabulary):4d} items  ' + ', '.join(sizes))
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compiled Markov models: describe a file, or compile the tables of a ruleset into it')
+    parser.add_argument('path', help='compiled model file (e.g. data/models/melody.urm)')
+    parser.add_argument('--compile', metavar='MODULE', help='compile the tables of the HiddenMarkov classes of this module (e.g. rulesets.harp) into the file')
+    parser.add_argument('--filter', help='only compile the classes whose name contains this')
+    args = parser.parse_args()
+
+    if args.compile:
+        write(args.path, compile_tables(args.compile, args.filter), args.compile)
+    describe(args.path)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Memory profiling of the generation, based on tracemalloc: an opt-in report, after each `Model.generate`, of
+
+- the memory retained (and the peak) while generating each VP, with the main allocation sites
+- the memory held by each VP: its content, its refinement tree, and the candidates kept by the generators of its nodes
+- the memory of the tables of each rule, and the keys inserted in them during the generation
+  (`defaultdict` tables grow on lookup)
+
+and a leak check across the consecutive models of a process: the memory still traced when each model starts,
+compared with the start of the second model (after the caches are warm).
+
+Tracing slows down the generation: only enable it to profile.
+
+    python3 src/ur/memory.py --models 5
+'''
+
+import gc
+import os
+import sys
+import tracemalloc
+from types import FunctionType, MethodType, ModuleType
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import log
+
+enabled: bool = False
+
+# frames kept by tracemalloc
+FRAMES: int = 1
+
+# allocation sites reported per VP
+SITES: int = 3
+
+# attributes of rules that are not tables
+RULE_LINKS: Set[str] = {'vps', 'vp_out', 'model', 'fixedness', 'weight'}
+
+# memory traced at the start of each model of this process, and the snapshot at the start of the second model
+_starts: List[int] = []
+_reference: Optional[tracemalloc.Snapshot] = None
+
+
+def enable(on: bool = True) -> None:
+    """
+    Profile the memory of the next models to generate (starting tracemalloc).
+    """
+    global enabled
+    enabled = on
+    if on and not tracemalloc.is_tracing():
+        tracemalloc.start(FRAMES)
+
+
+def snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def sizeof(obj: Any, seen: Set[int]) -> int:
+    """
+    The size of an object and of all objects it references, in bytes,
+    not going into the models, VPs, tree nodes and rules it links to, nor into objects already in `seen`.
+    """
+    import trees
+    import ur
+    stop: tuple = (ur.Model, trees.ViewPoint, trees.Node, ur.Rule, ur.Generator, type, ModuleType, FunctionType, MethodType)
+    total: int = 0
+    stack: List[Any] = [obj]
+    while stack:
+        o: Any = stack.pop()
+        if id(o) in seen or isinstance(o, stop):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+    return total
+
+
+def node_size(n: Any, seen: Set[int]) -> int:
+    '''The size of a tree node itself: object (with its slots), indexes, list of children
+    '''
+    total: int = sys.getsizeof(n)
+    for i in (n.start, n.end):
+        if id(i) not in seen:
+            seen.add(id(i))
+            total += sys.getsizeof(i)
+    return total + sys.getsizeof(n.children)
+
+
+def keys(table: Any) -> int:
+    '''The number of keys of a (nested) dict table
+    '''
+    if isinstance(table, dict):
+        return len(table) + sum(keys(v) for v in table.values())
+    return 0
+
+
+def tables(rule: Any) -> Dict[str, Any]:
+    """
+    The tables of a rule: its upper-case dict and list attributes (e.g. `TRANSITIONS`), and its other instance attributes.
+    """
+    result: Dict[str, Any] = {}
+    for name in dir(rule):
+        if name.isupper() and isinstance(getattr(rule, name, None), (dict, list)):
+            result[name] = getattr(rule, name)
+    for (name, value) in vars(rule).items():
+        if name not in RULE_LINKS and name not in result and not isinstance(value, (int, float, str, bool, type(None))):
+            result[name] = value
+    return result
+
+
+def rules(model: Any) -> Dict[int, Tuple[str, Any]]:
+    '''The rules of a model, with the VP they belong to
+    '''
+    result: Dict[int, Tuple[str, Any]] = {}
+    for vp in model.vps:
+        for r in vp.producers + vp.constraints + vp.scorers:
+            if id(r) not in result:
+                result[id(r)] = (vp.name, r)
+    return result
+
+
+def site(stat: tracemalloc.StatisticDiff) -> str:
+    frame = stat.traceback[0]
+    return f'{os.path.basename(frame.filename)}:{frame.lineno}'
+
+
+class Profile:
+    """
+    The memory profile of the generation of one model.
+    """
+
+    def __init__(self, model: Any):
+        global _reference
+        gc.collect()
+        self.start: int = tracemalloc.get_traced_memory()[0]
+        _starts.append(self.start)
+        self.models: int = len(_starts)
+        # (bytes, main sites) retained since the start of the second model
+        self.leak: Optional[Tuple[int, List[Tuple[str, int]]]] = None
+        if self.models == 2:
+            _reference = snapshot()
+        elif self.models > 2 and _reference is not None:
+            diff: List[tracemalloc.StatisticDiff] = snapshot().compare_to(_reference, 'lineno')
+            self.leak = (sum(d.size_diff for d in diff), [(site(d), d.size_diff) for d in diff[:SITES] if d.size_diff > 0])
+
+        # by VP: retained and peak bytes while generating, main allocation sites
+        self.generated: Dict[str, Tuple[int, int]] = {}
+        self.sites: Dict[str, List[Tuple[str, int]]] = {}
+        # by VP: bytes of content, tree nodes, generators
+        self.held: Dict[str, Tuple[int, int, int, int]] = {}
+        # by rule: (rule class, VP, bytes, keys, inserted keys)
+        self.tables: List[Tuple[str, str, int, int, int]] = []
+
+        self.keys: Dict[int, int] = {i: sum(keys(t) for t in tables(r).values()) for (i, (_, r)) in rules(model).items()}
+        self.before: Optional[tracemalloc.Snapshot] = None
+
+    def before_vp(self) -> None:
+        # the snapshot after the previous VP, if any, is the one before this VP
+        if self.before is None:
+            self.before = snapshot()
+        self.current: int = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def after_vp(self, vp: Any) -> None:
+        peak: int = tracemalloc.get_traced_memory()[1]
+        assert self.before is not None
+        after: tracemalloc.Snapshot = snapshot()
+        diff: List[tracemalloc.StatisticDiff] = after.compare_to(self.before, 'lineno')
+        self.generated[vp.name] = (sum(d.size_diff for d in diff), peak - self.current)
+        self.sites[vp.name] = [(site(d), d.size_diff) for d in diff[:SITES] if d.size_diff > 0]
+        self.before = after
+
+    def finish(self, model: Any) -> None:
+        """
+        Attribute the memory held by the model.
+        """
+        self.before = None
+        seen: Set[int] = set()
+        for vp in model.vps:
+            content: int = sizeof(vp.out, seen)
+            nodes: List[Any] = [vp.root] + list(vp.root.descendants)
+            tree: int = sum(node_size(n, seen) for n in nodes) + sizeof(vp.nodes, seen)
+            generators: List[Any] = [n.generator for n in nodes if n.generator is not None]
+            gens: int = sum(sys.getsizeof(g) + sizeof(vars(g), seen) for g in generators)
+            self.held[vp.name] = (content, tree, gens, len(nodes))
+
+        for (i, (vp_name, r)) in rules(model).items():
+            ts: Dict[str, Any] = tables(r)
+            k: int = sum(keys(t) for t in ts.values())
+            self.tables.append((type(r).__name__, vp_name, sum(sizeof(t, seen) for t in ts.values()), k, k - self.keys[i]))
+
+    def table(self) -> str:
+        return table(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'pid': os.getpid(),
+            'model': self.models,
+            'start': self.start,
+            'vps': {vp: {'retained': self.generated.get(vp, (0, 0))[0], 'peak': self.generated.get(vp, (0, 0))[1],
+                         'content': content, 'tree': tree, 'nodes': nodes, 'generators': gens,
+                         'sites': dict(self.sites.get(vp, []))}
+                    for (vp, (content, tree, gens, nodes)) in self.held.items()},
+            'rules': [{'rule': rule, 'vp': vp, 'tables': size, 'keys': k, 'inserted': inserted}
+                      for (rule, vp, size, k, inserted) in self.tables],
+            'leak': None if self.leak is None else {'growth': self.leak[0], 'sites': dict(self.leak[1])},
+        }
+
+    def report(self) -> None:
+        if not log.enabled(log.INFO):
+            return
+        log.info('### Memory', style='yellow')
+        log.info('%s', self.table(), event='memory', memory=self.to_dict())
+
+
+def table(profile: Dict[str, Any]) -> str:
+    """
+    The report of a memory profile given as a dict (see `Profile.to_dict`).
+    """
+    lines: List[str] = [f'{"VP":16s} {"retained":>9s} {"peak":>9s} {"content":>9s} {"tree":>9s} {"nodes":>6s} {"gens":>9s}']
+    for (vp, v) in profile['vps'].items():
+        lines.append(f'{vp:16s} {v["retained"] / 1024:7.1f}KB {v["peak"] / 1024:7.1f}KB {v["content"] / 1024:7.1f}KB {v["tree"] / 1024:7.1f}KB {v["nodes"]:6d} {v["generators"] / 1024:7.1f}KB')
+    lines.append('')
+    for (vp, v) in profile['vps'].items():
+        if v['sites']:
+            lines.append(f'{vp:16s} ' + ', '.join(f'{s} {size / 1024:+.1f}KB' for (s, size) in v['sites'].items()))
+    lines.append('')
+    lines.append(f'{"rule":28s} {"VP":16s} {"tables":>9s} {"keys":>7s} {"inserted":>8s}')
+    for r in sorted(profile['rules'], key=lambda r: -r['tables']):
+        lines.append(f'{r["rule"]:28s} {r["vp"]:16s} {r["tables"] / 1024:7.1f}KB {r["keys"]:7d} {r["inserted"]:8d}')
+    lines.append('')
+    leak: Optional[Dict[str, Any]] = profile['leak']
+    models: int = profile['model']
+    if leak is None:
+        lines.append(f'leak check: model {models} of this process (needs 3 models)')
+    else:
+        lines.append(f'leak check: model {models}, {leak["growth"] / 1024:+.1f}KB since the start of model 2 ({leak["growth"] / 1024 / (models - 2):+.1f}KB per model)')
+        for (s, size) in leak['sites'].items():
+            lines.append(f'  {s} {size / 1024:+.1f}KB')
+    return '\n'.join(lines)
+
+
+def merge(profiles: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The memory profiles of several generations (see `Profile.to_dict`), possibly from several processes, combined:
+    the largest size of each VP and rule table (with the allocation sites of the largest retained memory of each VP),
+    and the leak check of the process growing the most per model, as of its last model.
+    """
+    vps: Dict[str, Dict[str, Any]] = {}
+    rules: Dict[Tuple[int, str, str], Dict[str, Any]] = {}
+    last: Dict[int, Dict[str, Any]] = {}
+    for p in profiles:
+        for (vp, v) in p['vps'].items():
+            merged: Dict[str, Any] = vps.setdefault(vp, dict(v))
+            if v['retained'] > merged['retained']:
+                merged['sites'] = v['sites']
+            for (k, size) in v.items():
+                if k != 'sites':
+                    merged[k] = max(merged[k], size)
+        for (i, r) in enumerate(p['rules']):
+            merged = rules.setdefault((i, r['rule'], r['vp']), dict(r))
+            for k in ['tables', 'keys', 'inserted']:
+                merged[k] = max(merged[k], r[k])
+        if p['model'] >= last.get(p['pid'], {'model': 0})['model']:
+            last[p['pid']] = p
+    worst: Dict[str, Any] = max(last.values(), key=lambda p: (p['leak'] is not None,
+                                                             p['leak']['growth'] / (p['model'] - 2) if p['leak'] else p['model']))
+    return {
+        'pid': worst['pid'],
+        'model': worst['model'],
+        'start': worst['start'],
+        'vps': vps,
+        'rules': list(rules.values()),
+        'leak': worst['leak'],
+    }
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description='Memory profile of consecutive gen_sacred models in one process')
+    parser.add_argument('--models', type=int, default=5, help='number of models to generate (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first model (default: %(default)s)')
+    args = parser.parse_args()
+
+    # the module as imported by the models, not as __main__
+    import memory
+    import sacred
+    memory.enable()
+    log.configure(log.INFO)
+    for seed in range(args.seed, args.seed + args.models):
+        random.seed(seed)
+        log.configure(log.QUIET)
+        sh = sacred.gen_sacred()
+        log.configure(log.INFO)
+        log.info('## Model %d (seed %d)', seed - args.seed + 1, seed, style='yellow')
+        sh.memory.report()
+        del sh
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Microbenchmarks of single rules, without running a model.
+
+All producers, constraints and scorers defined in the rulesets are discovered, instantiated,
+and attached to a small model with one VP per content class. Their arguments are synthesized from `ARGS`
+(sequences of sample contents, as long as the window allows) and from the `NEEDS_*` flags
+(empty contexts, a target length/duration, the start of a leaf node, its node arguments).
+Then `produce`/`enumerate`/`valid`/`score` is called in isolation, reporting the time per call and
+the memory allocated per call (the peak of the traced memory during one call, as Python does not count allocations).
+
+    python3 src/ur/microbench.py
+    python3 src/ur/microbench.py --rulesets harp --filter Scorer --length 16
+'''
+
+import argparse
+import importlib
+import inspect
+import json
+import os
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from rich import print
+
+import log
+import music as m
+import ur
+from trees import StructureNode
+
+RULESETS: List[str] = ['harp', 'sh']
+
+# production/evaluation function of each kind of rule
+FUNCTIONS: Dict[Type[ur.Rule], str] = {
+    ur.Enumerator: 'enumerate',
+    ur.RandomizedProducer: 'produce',
+    ur.Constraint: 'valid',
+    ur.Scorer: 'score',
+}
+
+# sample contents, repeated to the length of the arguments
+SAMPLES: Dict[type, List[Any]] = {
+    m.Pitch: [m.Pitch(p) for p in ['C4', 'D4', 'E4', 'G4', 'E4', 'D4', 'B3', 'C4']],
+    m.Chord: [m.Chord(c) for c in ['I', 'IV', 'V', 'vi', 'ii', 'I', 'V', 'I']],
+    m.Duration: [m.Duration(d) for d in ['4', '8', '8', '4.', '8', '2', '4', '4']],
+    m.Syllable: [m.Syllable(s) for s in ['My', '>>breth-', '-ren', 'all,', 'on', 'you', 'I', 'call,']],
+}
+SAMPLES[m.Note] = [m.Note(d, p) for (d, p) in zip(SAMPLES[m.Duration], SAMPLES[m.Pitch])]
+
+# VP of each content class in the benchmark model
+VPS: Dict[type, str] = {m.Pitch: 'pitch', m.Chord: 'chords', m.Duration: 'rhy', m.Syllable: 'lyr', m.Note: 'notes'}
+
+# arguments of the rule constructors, by name
+PARAMETERS: Dict[str, Any] = {
+    'key': 'P1',
+    'mode': 'major',
+    'meter': '4/4',
+    'voice': 'S',
+    'min_length': 5,
+}
+
+
+def discover(rulesets: List[str]) -> List[Tuple[str, type]]:
+    """
+    The rule classes defined in the rulesets, as (ruleset, class), whose production/evaluation function is implemented
+    (by themselves or by a base class other than the generic `ur` ones).
+    """
+    result: List[Tuple[str, type]] = []
+    for name in rulesets:
+        module = importlib.import_module(f'rulesets.{name}')
+        for (_, cls) in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            for (kind, function) in FUNCTIONS.items():
+                if issubclass(cls, kind) and getattr(cls, function) is not getattr(kind, function):
+                    result.append((name, cls))
+    return result
+
+
+def content_class(cls: type) -> Optional[type]:
+    '''The content class of the output of a producer, from its generic bases (e.g. `HiddenMarkov[m.Chord]`)
+    '''
+    for c in cls.__mro__:
+        for base in getattr(c, '__orig_bases__', []):
+            for a in getattr(base, '__args__', []):
+                if isinstance(a, type) and issubclass(a, m.Content):
+                    return a
+    return None
+
+
+def samples(cls: type, n: int, shift: int = 0) -> List[Any]:
+    s: List[Any] = SAMPLES[cls]
+    return [s[(i + shift) % len(s)] for i in range(n)]
+
+
+def size(interval: ur.Interval, length: int) -> int:
+    '''The argument length used for a window interval
+    '''
+    n: int = max(length, interval.min, 1)
+    if interval.max is not None:
+        n = min(n, interval.max)
+    return n
+
+
+class Case:
+    """
+    One rule, attached to the benchmark model, with its synthesized arguments.
+    """
+    def __init__(self, ruleset: str, cls: type, length: int):
+        self.ruleset: str = ruleset
+        self.name: str = cls.__name__
+        self.function: str = next(f for (kind, f) in FUNCTIONS.items() if issubclass(cls, kind))
+
+        parameters = inspect.signature(cls.__init__).parameters
+        self.rule: ur.Rule = cls(**{p: PARAMETERS[p] for p in parameters
+                                    if p in PARAMETERS and parameters[p].default is inspect.Parameter.empty})
+
+        model: ur.Model = ur.Model(PARAMETERS['key'], PARAMETERS['mode'], PARAMETERS['meter'])
+        for (content, vp) in VPS.items():
+            model.add_vp(vp, content)
+        model.setup()
+        model.set_structure(StructureNode(0.0, float(length), 'ALL', [StructureNode(0.0, float(length), 'A')]))
+
+        in_vps: List[str] = [VPS[t] for (t, _) in self.rule.ARGS]
+        if isinstance(self.rule, ur.Producer):
+            out: type = content_class(cls) or m.Note
+            model.add_producer(self.rule, VPS[out], *in_vps)
+            node: ur.RefinementNode = model[VPS[out]].nodes['A']
+        else:
+            model.add_evaluator(self.rule, *in_vps)
+            node = model[in_vps[0]].nodes['A']
+
+        self.args: List[Any] = [samples(t, size(interval, length), i) for (i, (t, interval)) in enumerate(self.rule.ARGS)]
+        for vp in model:
+            vp.nodes['A'].set_to(samples(vp.content_cls, length), 1.0, False)
+        if self.rule.NEEDS_START:
+            self.args.append(ur.Index(0.0, min(1, length - 1), node))
+        if isinstance(self.rule, ur.Producer):
+            if self.rule.NEEDS_CONTEXT:
+                self.args += [[], []]
+            if self.rule.NEEDS_LEN:
+                n: int = size(self.rule.OUT_COUNT, length)
+                self.args.append(ur.Interval(n, n))
+            if self.rule.NEEDS_DURATION:
+                self.args.append(float(length))
+        if self.rule.NEEDS_NODE_ARGS:
+            self.args += self.rule.get_node_args(node)
+
+        self.call: Callable[..., Any] = getattr(self.rule, self.function)
+
+    def time(self, duration: float, repeat: int = 3) -> float:
+        """
+        The best time per call in ns, over `repeat` runs of at least `duration` seconds.
+        """
+        call, args = self.call, self.args
+        number: int = 1
+        while True:
+            t: int = time.perf_counter_ns()
+            for _ in range(number):
+                call(*args)
+            t = time.perf_counter_ns() - t
+            if t >= duration * 1e9:
+                break
+            number *= 2
+        best: float = t / number
+        for _ in range(repeat - 1):
+            t = time.perf_counter_ns()
+            for _ in range(number):
+                call(*args)
+            best = min(best, (time.perf_counter_ns() - t) / number)
+        return best
+
+    def allocated(self, calls: int = 20) -> float:
+        """
+        The mean peak of the memory allocated during one call, in bytes.
+        """
+        tracemalloc.start()
+        total: int = 0
+        for _ in range(calls):
+            current: int = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self.call(*self.args)
+            total += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        return total / calls
+
+
+def run(rulesets: List[str], length: int, duration: float, pattern: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """
+    Benchmark all discovered rules.
+
+    :param pattern: only benchmark the rules whose class name contains it
+    :returns: the results, and the rules that could not be benchmarked, as (name, error)
+    """
+    results: List[Dict[str, Any]] = []
+    failures: List[Tuple[str, str]] = []
+    for (ruleset, cls) in discover(rulesets):
+        if pattern and pattern not in cls.__name__:
+            continue
+        random.seed(0)
+        try:
+            case: Case = Case(ruleset, cls, length)
+            case.call(*case.args)
+        except Exception as e:
+            failures.append((f'{ruleset}.{cls.__name__}', f'{type(e).__name__}: {e}'))
+            continue
+        results.append({
+            'ruleset': ruleset,
+            'rule': case.name,
+            'function': case.function,
+            'ns_per_call': case.time(duration),
+            'bytes_per_call': case.allocated(),
+        })
+    return (results, failures)
+
+
+def report(results: List[Dict[str, Any]], failures: List[Tuple[str, str]]) -> None:
+    print()
+    print(f'[yellow]{"rule":36s} {"function":10s} {"ns/call":>12s} {"B/call":>10s}')
+    for r in sorted(results, key=lambda r: -r['ns_per_call']):
+        print(f'{r["ruleset"] + "." + r["rule"]:36s} {r["function"]:10s} {r["ns_per_call"]:12.0f} {r["bytes_per_call"]:10.0f}')
+    if failures:
+        print()
+        print('[yellow]not benchmarked (abstract rules, or arguments that could not be synthesized)')
+    for (name, error) in failures:
+        print(f'{name:36s} {error}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Ur rule microbenchmarks')
+    parser.add_argument('--rulesets', default=','.join(RULESETS), help='rulesets to benchmark (default: %(default)s)')
+    parser.add_argument('--filter', help='only benchmark the rules whose class name contains this')
+    parser.add_argument('--length', type=int, default=8, help='length of the sequences given to the rules, when not fixed by ARGS (default: %(default)s)')
+    parser.add_argument('--time', type=float, default=0.05, help='minimal duration of each timing run, in seconds (default: %(default)s)')
+    parser.add_argument('--out', help='JSON results file (none by default)')
+    args = parser.parse_args()
+
+    log.quiet()
+    results, failures = run(args.rulesets.split(','), args.length, args.time, args.filter)
+    report(results, failures)
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump({'args': vars(args), 'results': results, 'failures': failures}, f, indent=2)
+        print(f'[green]==> {args.out}')
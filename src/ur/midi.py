@@ -0,0 +1,238 @@
+'''
+A Standard MIDI File writer, producing multi-track `.mid` files from VP contents without building music21 objects.
+The first track holds the title, tempo, meter, key signature and the annotations (as markers),
+then comes one track per part, with its lyrics.
+
+And a reader, decoding the notes of each track of a `.mid` file into arrays, without music21 either.
+'''
+
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import music
+from music import Note
+
+TICKS: int = 480          # per quarter
+VELOCITY: int = 80
+
+NOTE_OFF: int = 0x80
+NOTE_ON: int = 0x90
+
+META_TEXT: int = 0x01
+META_TRACK_NAME: int = 0x03
+META_LYRIC: int = 0x05
+META_MARKER: int = 0x06
+META_END_OF_TRACK: int = 0x2F
+META_TEMPO: int = 0x51
+META_TIME_SIGNATURE: int = 0x58
+META_KEY_SIGNATURE: int = 0x59
+
+# (tick, order at same tick, message): note offs come before lyrics and note ons
+Event = Tuple[int, int, bytes]
+
+
+def var_len(n: int) -> bytes:
+    '''Encode a variable-length quantity
+    '''
+    out: List[int] = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append(0x80 | (n & 0x7F))
+        n >>= 7
+    return bytes(reversed(out))
+
+
+def meta(type: int, data: bytes) -> bytes:
+    return bytes([0xFF, type]) + var_len(len(data)) + data
+
+
+def text(type: int, t: str) -> bytes:
+    return meta(type, t.encode('utf-8'))
+
+
+def track(events: List[Event]) -> bytes:
+    '''Encode a track chunk from absolute-time events
+    '''
+    data: bytearray = bytearray()
+    now: int = 0
+    for (tick, _, message) in sorted(events, key=lambda e: (e[0], e[1])):
+        data += var_len(tick - now) + message
+        now = tick
+    data += var_len(0) + meta(META_END_OF_TRACK, b'')
+    return b'MTrk' + struct.pack('>I', len(data)) + data
+
+
+def conductor(title: str, key: str, mode: str, meter: str, tempo: int, markers: List[Tuple[int, str]]) -> bytes:
+    beats, beat_type = meter.split('/')
+    compound: bool = beat_type == '8'
+    quarter_tempo: float = tempo * 1.5 if compound else tempo
+    events: List[Event] = [
+        (0, 0, text(META_TRACK_NAME, title)),
+        (0, 0, meta(META_TEMPO, round(60_000_000 / quarter_tempo).to_bytes(3, 'big'))),
+        # MIDI clocks per beat: 24 per quarter, 36 per dotted quarter
+        (0, 0, meta(META_TIME_SIGNATURE, bytes([int(beats), int(beat_type).bit_length() - 1, 36 if compound else 24, 8]))),
+        (0, 0, meta(META_KEY_SIGNATURE, struct.pack('>bB', music.key_fifths(key), 1 if mode == 'minor' else 0))),
+    ]
+    events += [(tick, 1, text(META_MARKER, t)) for (tick, t) in markers]
+    return track(events)
+
+
+def part(name: str, channel: int, mel: List[Note], lyr: List[str], key: str) -> Tuple[bytes, List[int]]:
+    '''Encode a part as a track
+
+    :returns: the track, and the onset (in ticks) of each note
+    '''
+    events: List[Event] = [(0, 0, text(META_TRACK_NAME, name))]
+    onsets: List[int] = []
+    pos: float = 0.0
+    for (n, l) in zip(mel, lyr):
+        start: int = round(pos * TICKS)
+        pos += n.quarter_length()
+        end: int = round(pos * TICKS)
+        onsets.append(start)
+        if n.pitch.is_undefined():
+            continue
+        if l and not l == '~':
+            t: str = ''.join(c for c in l if c not in '!>/')
+            if t:
+                events.append((start, 1, text(META_LYRIC, t)))
+        pitch: int = music.midi(music.transpose(n.pitch, key))
+        events.append((start, 2, bytes([NOTE_ON | channel, pitch, VELOCITY])))
+        events.append((end, 0, bytes([NOTE_OFF | channel, pitch, 0])))
+    return (track(events), onsets)
+
+
+def export(f: str, title: str, melodies: List[Tuple[str, List[Note], List[str]]], annots: List[Tuple[str, List[str]]], key: str, mode: str, meter: str, voices: List[str], tempo: int = 80) -> None:
+    '''Write a score as a Standard MIDI File (format 1)
+
+    :param f: the `.mid` file to write
+    :param annots: annotations, aligned with the notes of the last part, written as markers
+    :param voices: the part names
+    '''
+    tracks: List[bytes] = []
+    onsets: Optional[List[int]] = None
+    for (channel, (name, (_, mel, lyr))) in enumerate(zip(voices, melodies)):
+        t, onsets = part(name, channel, mel, lyr, key)
+        tracks.append(t)
+
+    markers: List[Tuple[int, str]] = []
+    for (_, annot) in annots:
+        markers += [(tick, a) for (tick, a) in zip(onsets or [], annot) if a != '~']
+
+    with open(f, 'wb') as out:
+        out.write(b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks) + 1, TICKS))
+        out.write(conductor(title, key, mode, meter, tempo, markers))
+        for t in tracks:
+            out.write(t)
+
+
+# Reader
+
+META: int = 0xFF
+SYSEX: int = 0xF0
+SYSEX_ESCAPE: int = 0xF7
+
+# data bytes of the channel messages, by status (high nibble)
+DATA_BYTES: Dict[int, int] = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+
+class Track:
+    '''The notes of a track, as arrays in the order of their note ons, and its meta events
+
+    :param name: the track name, if any
+    :param onsets, durations: in quarters
+    :param pitches: MIDI note numbers
+    :param meta: the meta events, as (tick, type, data)
+    '''
+    def __init__(self, name: Optional[str], onsets: List[float], durations: List[float], pitches: List[int],
+                 meta: List[Tuple[int, int, bytes]]):
+        self.name: Optional[str] = name
+        self.onsets: List[float] = onsets
+        self.durations: List[float] = durations
+        self.pitches: List[int] = pitches
+        self.meta: List[Tuple[int, int, bytes]] = meta
+
+    def __len__(self) -> int:
+        return len(self.onsets)
+
+
+def read_var_len(data: bytes, i: int) -> Tuple[int, int]:
+    '''Decode a variable-length quantity at i
+
+    :returns: the value, and the index after it
+    '''
+    n: int = 0
+    while True:
+        b: int = data[i]
+        i += 1
+        n = (n << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return (n, i)
+
+
+def read_track(data: bytes, ticks: int) -> Track:
+    '''Decode a track chunk: notes are paired as music21 does, each note on with the next note off
+    of its pitch and channel (several note ons may share a note off)
+    '''
+    # (tick, status, pitch, velocity) of the note events
+    events: List[Tuple[int, int, int, int]] = []
+    meta_events: List[Tuple[int, int, bytes]] = []
+    tick: int = 0
+    status: int = 0
+    i: int = 0
+    while i < len(data):
+        delta, i = read_var_len(data, i)
+        tick += delta
+        if data[i] & 0x80:
+            status = data[i]
+            i += 1
+        if status == META:
+            type: int = data[i]
+            length, i = read_var_len(data, i + 1)
+            meta_events.append((tick, type, data[i:i + length]))
+            i += length
+        elif status in (SYSEX, SYSEX_ESCAPE):
+            length, i = read_var_len(data, i)
+            i += length
+        else:
+            kind: int = status & 0xF0
+            if kind in (NOTE_ON, NOTE_OFF):
+                events.append((tick, status, data[i], data[i + 1]))
+            i += DATA_BYTES.get(kind, 0)
+
+    notes: List[Tuple[int, int, int]] = []
+    note_offs: Dict[Tuple[int, int], int] = {}
+    for (t, s, pitch, velocity) in reversed(events):
+        if s & 0xF0 == NOTE_OFF or velocity == 0:
+            note_offs[(pitch, s & 0x0F)] = t
+        elif (pitch, s & 0x0F) in note_offs:
+            notes.append((t, note_offs[(pitch, s & 0x0F)], pitch))
+    # back to the order of the note ons
+    notes.reverse()
+
+    names: List[bytes] = [d for (_, type, d) in meta_events if type == META_TRACK_NAME]
+    return Track(names[0].decode('utf-8', 'replace') if names else None,
+                 [start / ticks for (start, _, _) in notes],
+                 [(end - start) / ticks for (start, end, _) in notes],
+                 [pitch for (_, _, pitch) in notes],
+                 meta_events)
+
+
+def read(f: str) -> List[Track]:
+    '''Read all tracks of a Standard MIDI File (formats 0 and 1, in ticks per quarter)
+    '''
+    with open(f, 'rb') as file:
+        data: bytes = file.read()
+    if data[:4] != b'MThd':
+        raise RuntimeError(f'{f}: not a Standard MIDI File')
+    header_length, _, count, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise RuntimeError(f'{f}: SMPTE time division is not supported')
+    tracks: List[Track] = []
+    i: int = 8 + header_length
+    while len(tracks) < count and i + 8 <= len(data):
+        chunk, length = struct.unpack('>4sI', data[i:i + 8])
+        if chunk == b'MTrk':
+            tracks.append(read_track(data[i + 8:i + 8 + length], division))
+        i += 8 + length
+    return tracks
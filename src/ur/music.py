@@ -1,6 +1,5 @@
 
-import music21
-
+from functools import lru_cache
 from typing import NewType, Protocol, Tuple, Optional, Self
 from abc import ABC, abstractmethod
 
@@ -97,9 +96,123 @@ class Note(Temporal):
         return new
 
 
+# Local pitch spelling and interval arithmetic, following music21 names ('B-3', 'F#4', 'P-4', 'm3', ...)
+
+STEPS = 'CDEFGAB'
+STEP_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+# position of the natural steps on the circle of fifths, w.r.t. C
+STEP_FIFTHS = {'F': -1, 'C': 0, 'G': 1, 'D': 2, 'A': 3, 'E': 4, 'B': 5}
+# semitones of the major/perfect simple intervals, by diatonic steps
+INTERVAL_SEMITONES = [0, 2, 4, 5, 7, 9, 11]
+PERFECT = [0, 3, 4]
+
+def parse_pitch(name: str) -> Tuple[str, int, int]:
+    '''Return step, alteration (in semitones) and octave of a pitch name
+    '''
+    step: str = name[0].upper()
+    i: int = 1
+    alter: int = 0
+    while i < len(name) and name[i] in '#-':
+        alter += 1 if name[i] == '#' else -1
+        i += 1
+    return (step, alter, int(name[i:]) if i < len(name) else 4)
+
+def pitch_name(step: str, alter: int, octave: int) -> str:
+    return step + ('#' * alter if alter > 0 else '-' * -alter) + str(octave)
+
+@lru_cache(maxsize=None)
+def midi(name: str) -> int:
+    step, alter, octave = parse_pitch(name)
+    return 12 * (octave + 1) + STEP_SEMITONES[step] + alter
+
+# pitch names of the MIDI pitch classes, spelled as music21 does
+MIDI_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+def midi_name(n: int) -> str:
+    return MIDI_NAMES[n % 12] + str(n // 12 - 1)
+
+def parse_interval(name: str) -> Tuple[int, int]:
+    '''Return the (signed) diatonic steps and semitones of an interval name such as 'P-4' or 'm3'
+    '''
+    i: int = 0
+    while name[i] in 'PMmAd':
+        i += 1
+    quality: str = name[:i]
+    number: int = int(name[i:])
+    direction: int = -1 if number < 0 else 1
+    steps: int = abs(number) - 1
+    semitones: int = 12 * (steps // 7) + INTERVAL_SEMITONES[steps % 7]
+    if quality == 'm':
+        semitones -= 1
+    elif quality[0] == 'A':
+        semitones += len(quality)
+    elif quality[0] == 'd':
+        semitones -= len(quality) if steps % 7 in PERFECT else len(quality) + 1
+    return (direction * steps, direction * semitones)
+
+@lru_cache(maxsize=None)
+def transpose(name: str, interval: str) -> str:
+    '''Transpose a pitch name by an interval name, keeping a correct spelling
+    '''
+    steps, semitones = parse_interval(interval)
+    step, alter, octave = parse_pitch(name)
+    index: int = STEPS.index(step) + steps
+    new_step: str = STEPS[index % 7]
+    new_octave: int = octave + index // 7
+    new_alter: int = midi(name) + semitones - (12 * (new_octave + 1) + STEP_SEMITONES[new_step])
+    return pitch_name(new_step, new_alter, new_octave)
+
+def interval_name(start: str, end: str) -> str:
+    '''Directed simple name of the interval between two pitch names (e.g. 'm-3' from A4 to F#4), as music21 names it
+    '''
+    step1, _, octave1 = parse_pitch(start)
+    step2, _, octave2 = parse_pitch(end)
+    steps: int = STEPS.index(step2) + 7 * octave2 - STEPS.index(step1) - 7 * octave1
+    semitones: int = midi(end) - midi(start)
+    direction: str = '-' if steps % 7 and steps < 0 else ''
+    if steps < 0:
+        steps, semitones = -steps, -semitones
+    # the quality of the compound interval, its number reduced to a simple one
+    semitones -= 12 * (steps // 7)
+    steps %= 7
+    delta: int = semitones - INTERVAL_SEMITONES[steps]
+    if delta == 0:
+        quality: str = 'P' if steps in PERFECT else 'M'
+    elif delta > 0:
+        quality = 'A' * delta
+    elif steps in PERFECT:
+        quality = 'd' * -delta
+    else:
+        quality = 'm' if delta == -1 else 'd' * (-delta - 1)
+    return f'{quality}{direction}{steps + 1}'
+
+def reverse_interval(interval: str) -> str:
+    '''The interval name in the other direction (e.g. 'm3' for 'm-3', 'd1' for 'A1')
+    '''
+    if '-' in interval:
+        return interval.replace('-', '')
+    i: int = 0
+    while interval[i] in 'PMmAd':
+        i += 1
+    if interval[i:] == '1':
+        return interval.translate(str.maketrans('Ad', 'dA'))
+    return f'{interval[:i]}-{interval[i:]}'
+
+def fifths_name(fifths: int) -> str:
+    '''Name (without octave) of the pitch at a number of fifths from C, e.g. 'F#' for 6
+    '''
+    return pitch_name('FCGDAEB'[(fifths + 1) % 7], (fifths + 1) // 7, 0)[:-1]
+
+def key_fifths(interval: str) -> int:
+    '''Number of sharps (or minus number of flats) of C major transposed by an interval
+    '''
+    step, alter, _ = parse_pitch(transpose('C4', interval))
+    return STEP_FIFTHS[step] + 7 * alter
+
+
 def quarters_per_bar(ts_str: str) -> float:
-    ts: music21.meter.TimeSignature = music21.meter.TimeSignature(ts_str)
-    return ts.beatDuration.quarterLength * ts.beatCount
+    beats, beat_type = ts_str.split('/')
+    return int(beats) * 4 / int(beat_type)
 
 def quantize_above(duration: float, meter: str) -> float:
     '''Snap duration to above or equal multiple of meter unit'''
@@ -130,26 +243,24 @@ def beat(meter: str) -> float:
 def in_range(pitch: str, ambitus: Tuple[Pitch, Pitch], key: Optional[str] = None) -> bool:
     '''return true iff note is in ambitus (with inclusive bounds)
     '''
-    n = music21.pitch.Pitch(pitch)
-    if key:
-        n = n.transpose(key)
-    return (n.midi >= music21.pitch.Pitch(ambitus[0]).midi) and (n.midi <= music21.pitch.Pitch(ambitus[1]).midi)
+    n: int = midi(transpose(pitch, key)) if key else midi(pitch)
+    return (n >= midi(ambitus[0])) and (n <= midi(ambitus[1]))
     
 
 def ambitus(mel):
     '''return ambitus as pitch difference
     '''
-    mnotes = [music21.pitch.Pitch(n) for n in mel]
-    return(max(mnotes).midi - min(mnotes).midi)
+    mnotes = [midi(n) for n in mel]
+    return(max(mnotes) - min(mnotes))
 
 def pitch_mean(mel):
-    minotes = [music21.pitch.Pitch(n).midi for n in mel]
+    minotes = [midi(n) for n in mel]
     return(sum(minotes) / len(minotes))
 
 
 def interval(n1, n2):
     ''' Interval in number of chromatic steps'''
-    return music21.pitch.Pitch(n2).midi - music21.pitch.Pitch(n1).midi
+    return midi(n2) - midi(n1)
 
 DURATION = {
   '1.': 6,
@@ -0,0 +1,544 @@
+'''
+A direct MusicXML writer, producing compressed `.mxl` files from VP contents without building music21 objects.
+Measures, ties, beams and key transposition are computed here.
+
+And a streaming reader, extracting parts of a MusicXML score into Tunes with incremental XML parsing,
+without building music21 objects either.
+'''
+
+import contextlib
+import datetime
+import io
+import math
+import os
+import zipfile
+from fractions import Fraction
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import music
+from corpus import Tune
+from music import Note
+
+# representable durations (in quarters), as (type, dots), from the longest
+NOTE_TYPES: List[Tuple[Fraction, str, int]] = [
+    (Fraction(6), 'whole', 1),
+    (Fraction(4), 'whole', 0),
+    (Fraction(3), 'half', 1),
+    (Fraction(2), 'half', 0),
+    (Fraction(3, 2), 'quarter', 1),
+    (Fraction(1), 'quarter', 0),
+    (Fraction(3, 4), 'eighth', 1),
+    (Fraction(1, 2), 'eighth', 0),
+    (Fraction(3, 8), '16th', 1),
+    (Fraction(1, 4), '16th', 0),
+    (Fraction(1, 8), '32nd', 0),
+]
+
+BEAMS = {'eighth': 1, '16th': 2, '32nd': 3}
+
+CLEFS = {
+    'T': '<clef><sign>G</sign><line>2</line><clef-octave-change>-1</clef-octave-change></clef>',
+    'B': '<clef><sign>F</sign><line>4</line></clef>',
+}
+CLEF_DEFAULT = '<clef><sign>G</sign><line>2</line></clef>'
+
+
+def syllabic(text: str) -> Tuple[str, str]:
+    '''Split hyphenation marks from a lyric, as music21 does
+    '''
+    if text.startswith('-') and text.endswith('-'):
+        return ('middle', text[1:-1])
+    if text.startswith('-'):
+        return ('end', text[1:])
+    if text.endswith('-'):
+        return ('begin', text[:-1])
+    return ('single', text)
+
+
+def note_values(duration: Fraction) -> List[Tuple[Fraction, Optional[str], int]]:
+    '''Decompose a duration into tied notated values
+    '''
+    values: List[Tuple[Fraction, Optional[str], int]] = []
+    while duration > 0:
+        for (d, t, dots) in NOTE_TYPES:
+            if d <= duration:
+                values.append((d, t, dots))
+                duration -= d
+                break
+        else:
+            # not notatable with plain values (e.g. tuplets): keep the duration, without type
+            values.append((duration, None, 0))
+            break
+    return values
+
+
+class Event:
+    '''A notated note or rest, inside a measure
+    '''
+    def __init__(self, pitch: Optional[str], duration: Fraction, type: Optional[str], dots: int, offset: Fraction):
+        self.pitch: Optional[str] = pitch
+        self.duration: Fraction = duration
+        self.type: Optional[str] = type
+        self.dots: int = dots
+        self.offset: Fraction = offset
+        self.tie_start: bool = False
+        self.tie_stop: bool = False
+        self.lyrics: List[Tuple[int, str]] = []
+        self.beams: List[Tuple[int, str]] = []
+
+
+def measures(notes: List[Tuple[Optional[str], Fraction, List[Tuple[int, str]]]], bar: Fraction, beat: Fraction) -> List[List[Event]]:
+    '''Split notes into measures of `bar` quarters, with ties, and beam them by groups of `beat` quarters
+
+    :param notes: (pitch or None for rests, duration, lyrics as (number, text))
+    '''
+    result: List[List[Event]] = [[]]
+    pos: Fraction = Fraction(0)
+    for (pitch, duration, lyrics) in notes:
+        pieces: List[Event] = []
+        remaining: Fraction = duration
+        while remaining > 0:
+            if pos == bar:
+                result.append([])
+                pos = Fraction(0)
+            chunk: Fraction = min(remaining, bar - pos)
+            for (d, t, dots) in note_values(chunk):
+                e: Event = Event(pitch, d, t, dots, pos)
+                pieces.append(e)
+                result[-1].append(e)
+                pos += d
+            remaining -= chunk
+        pieces[0].lyrics = lyrics
+        if pitch is not None:
+            for (e1, e2) in zip(pieces, pieces[1:]):
+                e1.tie_start = True
+                e2.tie_stop = True
+
+    # complete the last measure with rests
+    if 0 < pos < bar:
+        for (d, t, dots) in note_values(bar - pos):
+            result[-1].append(Event(None, d, t, dots, pos))
+            pos += d
+
+    for m in result:
+        beam(m, beat)
+    return result
+
+
+def beam(measure: List[Event], beat: Fraction) -> None:
+    '''Beam consecutive eighths (and shorter) within each beat
+    '''
+    groups: List[List[Event]] = []
+    last_group: int = -1
+    for e in measure:
+        g: int = math.floor(e.offset / beat)
+        if e.pitch is None or e.type not in BEAMS or (e.offset + e.duration) > (g + 1) * beat:
+            last_group = -1
+            continue
+        if g == last_group:
+            groups[-1].append(e)
+        else:
+            groups.append([e])
+            last_group = g
+
+    for group in groups:
+        if len(group) < 2:
+            continue
+        for level in range(1, 4):
+            for (i, e) in enumerate(group):
+                if BEAMS[e.type] < level:
+                    continue
+                prev: bool = i > 0 and BEAMS[group[i - 1].type] >= level
+                next: bool = i < len(group) - 1 and BEAMS[group[i + 1].type] >= level
+                if prev and next:
+                    e.beams.append((level, 'continue'))
+                elif next:
+                    e.beams.append((level, 'begin'))
+                elif prev:
+                    e.beams.append((level, 'end'))
+                else:
+                    e.beams.append((level, 'backward hook' if i > 0 else 'forward hook'))
+
+
+def write_event(out: IO[str], e: Event, divisions: int) -> None:
+    out.write('<note>')
+    if e.pitch is None:
+        out.write('<rest/>')
+    else:
+        step, alter, octave = music.parse_pitch(e.pitch)
+        out.write(f'<pitch><step>{step}</step>')
+        if alter:
+            out.write(f'<alter>{alter}</alter>')
+        out.write(f'<octave>{octave}</octave></pitch>')
+    out.write(f'<duration>{int(e.duration * divisions)}</duration>')
+    if e.tie_stop:
+        out.write('<tie type="stop"/>')
+    if e.tie_start:
+        out.write('<tie type="start"/>')
+    if e.type:
+        out.write(f'<type>{e.type}</type>' + '<dot/>' * e.dots)
+    for (level, value) in e.beams:
+        out.write(f'<beam number="{level}">{value}</beam>')
+    if e.tie_start or e.tie_stop:
+        out.write('<notations>')
+        if e.tie_stop:
+            out.write('<tied type="stop"/>')
+        if e.tie_start:
+            out.write('<tied type="start"/>')
+        out.write('</notations>')
+    for (number, text) in e.lyrics:
+        syl, t = syllabic(text)
+        out.write(f'<lyric number="{number}"><syllabic>{syl}</syllabic><text>{escape(t)}</text></lyric>')
+    out.write('</note>\n')
+
+
+def write_score(out: IO[str], title: str, parts: List[Tuple[str, List[List[Event]]]], key: str, meter: str, divisions: int, tempo: int) -> None:
+    beats, beat_type = meter.split('/')
+    compound: bool = beat_type == '8'
+
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">\n')
+    out.write('<score-partwise version="4.0">\n')
+    out.write(f'<work><work-title>{escape(title)}</work-title></work><movement-title>{escape(title)}</movement-title>\n')
+    out.write('<identification><creator type="composer">'
+              + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+              + '</creator><encoding><software>Ur</software></encoding></identification>\n')
+    out.write('<part-list>\n')
+    for (i, (name, _)) in enumerate(parts, 1):
+        out.write(f'<score-part id="P{i}"><part-name>{name}</part-name><part-abbreviation>{name}</part-abbreviation></score-part>\n')
+    out.write('</part-list>\n')
+
+    for (i, (name, part_measures)) in enumerate(parts, 1):
+        out.write(f'<part id="P{i}">\n')
+        for (j, measure) in enumerate(part_measures, 1):
+            out.write(f'<measure number="{j}">\n')
+            if j == 1:
+                out.write(f'<attributes><divisions>{divisions}</divisions>'
+                          f'<key><fifths>{music.key_fifths(key)}</fifths></key>'
+                          f'<time><beats>{beats}</beats><beat-type>{beat_type}</beat-type></time>'
+                          f'{CLEFS.get(name, CLEF_DEFAULT)}</attributes>\n')
+                if i == 1:
+                    quarter_tempo: float = tempo * 1.5 if compound else tempo
+                    out.write('<direction placement="above"><direction-type><metronome>'
+                              '<beat-unit>quarter</beat-unit>' + ('<beat-unit-dot/>' if compound else '')
+                              + f'<per-minute>{tempo}</per-minute></metronome></direction-type>'
+                              f'<sound tempo="{quarter_tempo:g}"/></direction>\n')
+            for e in measure:
+                write_event(out, e, divisions)
+            style: str = 'light-heavy' if j == len(part_measures) else 'regular'
+            out.write(f'<barline location="right"><bar-style>{style}</bar-style></barline>\n')
+            out.write('</measure>\n')
+        out.write('</part>\n')
+    out.write('</score-partwise>\n')
+
+
+def export(f: str, title: str, melodies: List[Tuple[str, List[Note], List[str]]], annots: List[Tuple[str, List[str]]], key: str, meter: str, voices: List[str], tempo: int = 80) -> None:
+    '''Write a score as compressed MusicXML (same arguments as `export.export`)
+
+    :param f: the `.mxl` file to write
+    :param voices: the part names
+    '''
+    beats, beat_type = meter.split('/')
+    bar: Fraction = Fraction(int(beats) * 4, int(beat_type))
+    beat: Fraction = Fraction(3, 2) if beat_type == '8' else Fraction(1)
+
+    parts: List[Tuple[str, List[List[Event]]]] = []
+    durations: List[Fraction] = [bar]
+    for (i, (name, (_, mel, lyr))) in enumerate(zip(voices, melodies)):
+        notes: List[Tuple[Optional[str], Fraction, List[Tuple[int, str]]]] = []
+        last: bool = i == min(len(voices), len(melodies)) - 1
+        for (j, (n, l)) in enumerate(zip(mel, lyr)):
+            lyrics: List[Tuple[int, str]] = []
+            if l and not l == '~':
+                text: str = ''.join(c for c in l if c not in '!>/')
+                if text:
+                    lyrics.append((1, text))
+            if last:
+                # annotations go below the lowest part
+                for (k, (_, annot)) in enumerate(annots, 2):
+                    if annot[j] != '~':
+                        lyrics.append((k, annot[j]))
+            pitch: Optional[str] = None if n.pitch.is_undefined() else music.transpose(n.pitch, key)
+            d: Fraction = Fraction(n.quarter_length()).limit_denominator(96)
+            durations.append(d)
+            notes.append((pitch, d, lyrics))
+        parts.append((name, measures(notes, bar, beat)))
+
+    divisions: int = 1
+    for d in durations:
+        divisions = divisions * d.denominator // math.gcd(divisions, d.denominator)
+
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('META-INF/container.xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>\n<container><rootfiles>'
+                   '<rootfile full-path="score.musicxml" media-type="application/vnd.recordare.musicxml+xml"/>'
+                   '</rootfiles></container>\n')
+        with z.open('score.musicxml', 'w') as raw:
+            out = io.TextIOWrapper(raw, encoding='utf-8', write_through=False)
+            write_score(out, title, parts, key, meter, divisions, tempo)
+            out.flush()
+            out.detach()
+
+
+# Streaming reader
+
+# extensions of the scores read by `read_tunes`
+READ_EXTENSIONS: Tuple[str, ...] = ('.mxl', '.musicxml', '.xml')
+
+# divisions of the bar at the three levels of the accent hierarchy (music21 default accent weights), by meter numerator;
+# the bars of other meters are divided into their beats, then halved twice
+ACCENT_DIVISIONS: Dict[int, Tuple[int, int, int]] = {
+    1: (2, 2, 2),
+    2: (2, 2, 2),
+    4: (2, 2, 2),
+    8: (2, 2, 2),
+    6: (2, 3, 2),
+    9: (3, 3, 2),
+    12: (2, 2, 3),
+}
+
+# weight of the onsets outside the accent hierarchy
+OFFBEAT: float = 0.0625
+
+
+def beat_strength(position: Fraction, numerator: int, bar: Fraction) -> float:
+    '''Metrical weight of an onset at `position` quarters in a bar, as music21's `beatStrength`:
+    1.0 on the downbeat, halved at each level of the accent hierarchy
+    '''
+    top, middle, bottom = ACCENT_DIVISIONS.get(numerator, (numerator, 2, 2))
+    slot: Fraction = position * top * middle * bottom / bar
+    if slot.denominator != 1:
+        return OFFBEAT
+    if slot == 0:
+        return 1.0
+    if slot.numerator % (middle * bottom) == 0:
+        return 0.5
+    if slot.numerator % bottom == 0:
+        return 0.25
+    return 0.125
+
+
+def relative_key(fifths: int, mode: str) -> Tuple[str, str]:
+    '''Key (as interval from A) and mode of a key signature, as `load.key_from_part` finds them:
+    the first note of the tenor is compared with the tonic as a note, which never matches,
+    so the relative key is always taken
+    '''
+    if mode == 'minor':
+        return (music.interval_name('A4', music.fifths_name(fifths) + '4'), 'major')
+    return (music.interval_name('A4', music.fifths_name(fifths + 3) + '4'), 'minor')
+
+
+def signature(key: str, mode: str) -> Tuple[int, str]:
+    '''The key signature (fifths, mode) that `relative_key` reads as key and mode
+    '''
+    if mode == 'minor':
+        return (music.key_fifths(key), 'major')
+    return (music.key_fifths(key) + 3, 'minor')
+
+
+class PartReader:
+    '''The notes of one part, read measure by measure from the MusicXML elements,
+    with the onsets and beat strengths music21 gives them in a flat part
+    '''
+    def __init__(self, name: str):
+        self.name: str = name
+        self.divisions: int = 1
+        # the first key signature (fifths, mode), clef (sign, line, octave change) and time signature
+        self.key: Optional[Tuple[int, str]] = None
+        self.clef: Optional[Tuple[str, str, int]] = None
+        self.meter: Optional[str] = None
+        # the current time signature, and its onset
+        self.numerator: int = 4
+        self.bar: Fraction = Fraction(4)
+        self.meter_onset: Fraction = Fraction(0)
+        # onset of the current measure
+        self.offset: Fraction = Fraction(0)
+        # (onset, not a grace note, order, pitch, duration, beat strength)
+        self.notes: List[Tuple[Fraction, bool, int, str, Fraction, float]] = []
+        self.start_measure()
+
+    def start_measure(self) -> None:
+        self.position: Fraction = Fraction(0)
+        self.extent: Fraction = Fraction(0)
+        self.pitched: int = 0
+        self.rests: int = 0
+        # the first rest of the measure, if it may last the whole measure: position, duration, whether it is marked so
+        self.measure_rest: Optional[Tuple[Fraction, Fraction, bool]] = None
+
+    def attributes(self, e: ElementTree.Element) -> None:
+        divisions: Optional[str] = e.findtext('divisions')
+        if divisions:
+            self.divisions = int(divisions)
+        key: Optional[ElementTree.Element] = e.find('key')
+        if key is not None and self.key is None and key.findtext('fifths'):
+            self.key = (int(key.findtext('fifths', '0')), key.findtext('mode', 'major'))
+        clef: Optional[ElementTree.Element] = e.find('clef')
+        if clef is not None and self.clef is None:
+            self.clef = (clef.findtext('sign', ''), clef.findtext('line', ''), int(clef.findtext('clef-octave-change', '0')))
+        time: Optional[ElementTree.Element] = e.find('time')
+        if time is not None and time.findtext('beats'):
+            beats: str = time.findtext('beats', '4')
+            beat_type: str = time.findtext('beat-type', '4')
+            self.meter = self.meter or f'{beats}/{beat_type}'
+            self.numerator = int(beats)
+            self.bar = Fraction(4 * int(beats), int(beat_type))
+            self.meter_onset = self.offset + self.position
+
+    def note(self, e: ElementTree.Element) -> None:
+        pitch: Optional[ElementTree.Element] = e.find('pitch')
+        if pitch is not None:
+            self.pitched += 1
+        if e.find('chord') is not None:
+            # divisi: just take the first pitch
+            return
+        grace: bool = e.find('grace') is not None
+        duration: Fraction = Fraction(0) if grace else Fraction(int(e.findtext('duration', '0')), self.divisions)
+        if pitch is not None:
+            name: str = music.pitch_name(pitch.findtext('step', 'C'), round(float(pitch.findtext('alter', '0'))),
+                                         int(pitch.findtext('octave', '4')))
+            self.notes.append((self.offset + self.position, not grace, len(self.notes), name, duration,
+                               self.beat_strength(self.offset + self.position)))
+        else:
+            rest: Optional[ElementTree.Element] = e.find('rest')
+            if rest is not None:
+                self.rests += 1
+                # whole rests (or rests marked as measure rests) stand for the whole measure, whatever their duration
+                marked: bool = rest.get('measure') == 'yes' and e.findtext('type', 'whole') in ('whole', 'breve')
+                whole: bool = (e.findtext('type') in ('whole', 'breve') and e.find('dot') is None
+                               and e.find('time-modification') is None)
+                if self.rests == 1 and (marked or whole):
+                    self.measure_rest = (self.position, duration, marked)
+        self.move(duration)
+
+    def beat_strength(self, onset: Fraction) -> float:
+        # notes of a flat part are not found in their measure: their position in the bar is taken from the time signature
+        if onset + self.meter_onset < self.bar:
+            return beat_strength(onset, self.numerator, self.bar)
+        return beat_strength((onset - self.meter_onset) % self.bar, self.numerator, self.bar)
+
+    def move(self, duration: Fraction) -> None:
+        self.position += duration
+        self.extent = max(self.extent, self.position)
+
+    def end_measure(self) -> None:
+        '''Move to the next measure, as the music21 MusicXML importer does
+        '''
+        if self.measure_rest is not None and self.rests == 1 and self.pitched == 0:
+            position, duration, marked = self.measure_rest
+            if marked or duration != self.bar:
+                self.extent = position + self.bar
+        shift: Fraction = self.extent
+        if self.extent > self.bar:
+            overfull: Fraction = self.extent - self.bar
+            if not (overfull > Fraction(1, 2) or (overfull * 16).denominator == 1 or (overfull * 12).denominator == 1):
+                shift = self.bar
+        elif self.extent == 0 and not self.rests and not self.pitched:
+            # empty measure: a measure rest
+            shift = self.bar
+        self.offset += shift
+        self.start_measure()
+
+    def tune(self, score: str, key: str, mode: str, intervals: List[str]) -> Tune:
+        '''The notes of the part, in music21 order, transposed by the intervals
+        '''
+        if self.meter is None:
+            raise RuntimeError(f'{score}: no time signature in {self.name}')
+        vocabulary: Dict[str, int] = {}
+        pitch_ids: List[int] = []
+        durations: List[float] = []
+        offsets: List[float] = []
+        beat_strengths: List[float] = []
+        for (onset, _, _, pitch, duration, strength) in sorted(self.notes):
+            for i in intervals:
+                pitch = music.transpose(pitch, i)
+            pitch_ids.append(vocabulary.setdefault(pitch, len(vocabulary)))
+            durations.append(float(duration))
+            offsets.append(float(onset))
+            beat_strengths.append(strength)
+        return Tune(score, key, mode, self.meter, durations, offsets, beat_strengths, pitch_ids, list(vocabulary))
+
+
+@contextlib.contextmanager
+def open_score(filename: str) -> Iterator[IO[bytes]]:
+    '''The MusicXML document of a score, inside its archive if compressed
+    '''
+    if not filename.endswith('.mxl'):
+        with open(filename, 'rb') as f:
+            yield f
+        return
+    with zipfile.ZipFile(filename) as z:
+        try:
+            rootfile: Optional[ElementTree.Element] = ElementTree.fromstring(z.read('META-INF/container.xml')).find('.//rootfile')
+            member: str = rootfile.get('full-path', '') if rootfile is not None else ''
+        except KeyError:
+            member = ''
+        if not member:
+            member = next(n for n in z.namelist() if not n.startswith('META-INF/'))
+        with z.open(member) as f:
+            yield f
+
+
+def read_tunes(filename: str, parts: Optional[List[str]] = None) -> Dict[str, Tune]:
+    """
+    Stream a MusicXML score and extract parts as Tunes, without music21: the same tunes as `load.tunes_from_file`,
+    transposed to C major (resp. A minor), with the key and mode of the tenor (C major / A minor without key signature).
+
+    Only the requested parts (and the tenor, giving the key) are read: the other parts are skipped,
+    and the parsing stops once the requested parts are read.
+
+    :param parts: the lower-case names of the parts to extract (by default all parts)
+    :returns: the tunes, by lower-case part name
+    """
+    score: str = os.path.basename(filename)
+    wanted: Optional[Set[str]] = None if parts is None else set(parts) | {'tenor'}
+    names: Dict[str, str] = {}
+    readers: Dict[str, PartReader] = {}
+    reader: Optional[PartReader] = None
+    with open_score(filename) as f:
+        for (event, e) in ElementTree.iterparse(f, ('start', 'end')):
+            if event == 'start':
+                if e.tag == 'part':
+                    name: str = names.get(e.get('id', ''), f'part{len(readers)}')
+                    reader = PartReader(name) if wanted is None or name in wanted else None
+                    if reader is not None:
+                        readers[name] = reader
+            elif e.tag == 'score-part':
+                names[e.get('id', '')] = (e.findtext('part-name') or f'part{len(names)}').lower()
+            elif e.tag == 'measure':
+                if reader is not None:
+                    reader.end_measure()
+                e.clear()
+            elif reader is None:
+                continue
+            elif e.tag == 'note':
+                reader.note(e)
+            elif e.tag == 'backup':
+                reader.position -= Fraction(int(e.findtext('duration', '0')), reader.divisions)
+            elif e.tag == 'forward':
+                reader.move(Fraction(int(e.findtext('duration', '0')), reader.divisions))
+            elif e.tag == 'attributes':
+                reader.attributes(e)
+            elif e.tag == 'part':
+                reader = None
+                if wanted is not None and wanted <= readers.keys():
+                    break
+
+    tenor: Optional[PartReader] = readers.get('tenor')
+    if tenor is None:
+        raise RuntimeError(f'{score}: no tenor part')
+    # no key signature: C major / A minor, as an empty one
+    key, mode = relative_key(*(tenor.key or (0, 'major')))
+    to_c: str = music.reverse_interval(key)
+
+    tunes: Dict[str, Tune] = {}
+    for (name, r) in readers.items():
+        if parts is None or name in parts:
+            # the tenor is sung an octave below the treble clef
+            octave: List[str] = ['P-8'] if name == 'tenor' and r.clef == ('G', '2', 0) else []
+            tunes[name] = r.tune(score, key, mode, octave + [to_c])
+    for p in parts or []:
+        if p not in tunes:
+            raise RuntimeError(f'{score}: no part {p}')
+    return tunes
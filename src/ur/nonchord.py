@@ -1,5 +1,6 @@
 
 import random
+import log
 
 # Some tools for (diatonic) nonchord neighbor/passing/projecting notes
 # Could be rewritten with music21 GenericIntervals and scales
@@ -11,7 +12,7 @@ for octave in [2, 3, 4, 5]:
 
 def note_index(n):
     if n not in NOTES:
-        print('!', n)
+        log.warning('! %s', n)
         return None
     return NOTES.index(n)
 
@@ -28,37 +28,65 @@
 
 import glob
 import random
+import sys
+import time
 import music
 from music import Note, Pitch, Duration, Chord, Syllable
-import music21 as m21
-from music21.stream import Part, Score
 from rich import print
 import argparse
-from typing import cast, Tuple, List
+from typing import cast, Any, Dict, Optional, Tuple, List
 import os
 
 import ur
+import export
+import instrument
+import memory
+import log
+import batch
 from trees import *
 from rulesets.harp import *
 from load import *
 
-def gen_sacred() -> ur.Model:
-    print('[yellow]### Init')
+METERS: List[str] = ['6/4', '4/4', '6/8']
+STRUCTURES: List[StructureNode] = [struc1, struc2, struc3, struc4]
 
-    key = random.choice(Key.CHOICES)
-    mode = random.choice(['minor', 'major'])
+def gen_sacred(key: Optional[str] = None, mode: Optional[str] = None, meter: Optional[str] = None, struc: Optional[StructureNode] = None) -> ur.Model:
+    """
+    Generate a piece from scratch.
+    Key, mode, meter and structure are drawn at random, unless given.
+    """
+    log.info('### Init', style='yellow')
 
-    print(f'Key: [blue]{key}')
-    print(f'Mode: [blue]{mode}')
+    key = key or random.choice(Key.CHOICES)
+    mode = mode or random.choice(['minor', 'major'])
 
-    meter = random.choice(['6/4', '4/4', '6/8'])
+    log.info('Key: %s', key, key=key)
+    log.info('Mode: %s', mode, mode=mode)
 
-    print(f'Meter: [blue]{meter}')
+    meter = meter or random.choice(METERS)
 
-    struc: StructureNode = random.choice([struc1, struc2, struc3, struc4])
+    log.info('Meter: %s', meter, meter=meter)
 
-    print(f'Structure: \n[blue]{struc}')
+    struc = struc or random.choice(STRUCTURES)
 
+    log.info('Structure: \n%s', struc, event='structure')
+
+    sh: ur.Model = model_sacred(key, mode, meter, struc)
+
+    # ------------------------------------------------------------
+    # generation
+
+    log.info('### Generating', style='yellow')
+
+    sh.generate()
+
+    return sh
+
+
+def model_sacred(key: str, mode: str, meter: str, struc: StructureNode) -> ur.Model:
+    """
+    Build the model of `gen_sacred` on a structure, ready to generate.
+    """
     sh: ur.Model = ur.Model(key, mode, meter)
 
     if mode == 'major':
@@ -140,20 +168,74 @@ def gen_sacred() -> ur.Model:
 
     sh.add_evaluator(ScorerRhythmLyrics(), 'rhy', 'lyr')
     sh.add_evaluator(scorer_rhythm_met(), 'rhy')
-    
-    print()
 
-    # ------------------------------------------------------------
-    # generation
+    return sh
 
-    print('[yellow]### Generating ')
 
-    sh.generate()
+def gen_job(seed: int, out: str, svg: bool = False, direct: bool = False, midi: bool = False, deferred: bool = False) -> Tuple[Dict[str, float], Dict[str, Dict[str, Any]]] | Tuple[Dict[str, float], Dict[str, Dict[str, Any]], export.Piece]:
+    """
+    Generate one piece from a seed and export it to `data/gen/<out>/gen-<seed>.mxl` (and `.mid`).
+    The piece only depends on the seed, not on what the process generated before.
 
-    return sh
+    :param deferred: do not export, but return the snapshot to export
+    :returns: the duration of each stage, in seconds, the reports of the model (see `batch.reports`),
+              and the snapshot to export, if deferred
+    """
+    random.seed(seed)
+    stages: Dict[str, float] = {}
+
+    t: float = time.perf_counter()
+    sh: ur.Model = gen_sacred()
+    stages['generate'] = time.perf_counter() - t
+
+    piece: export.Piece = sh.snapshot(f'{out}/gen-{seed}', f'SH meets HH ({seed})', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'], svg, direct, midi)
+    if deferred:
+        return (stages, batch.reports(sh), piece)
+    stages.update(export.write(piece))
+    return (stages, batch.reports(sh))
+
+
+def gen_batch(seeds: range, workers: int, out: str = 'gen', quiet: bool = True, direct: bool = False, midi: bool = False, export_workers: int = 0) -> List[Tuple[str, str]]:
+    """
+    Generate one piece per seed in a pool of worker processes.
+    Results are written to `data/gen/<out>/` as soon as they are ready, and statistics are reported at the end.
+
+    :param export_workers: if not 0, export in that many background workers, overlapping with generation
+    :returns: the failed jobs, as (name, error)
+    """
+    deferred: bool = export_workers > 0
+    jobs: List[Tuple[str, tuple]] = [(f'gen-{seed}', (seed, out, False, direct, midi, deferred)) for seed in seeds]
+    print(f'[yellow]### Generating {len(jobs)} pieces with {workers} workers')
+    if not deferred:
+        return batch.run(gen_job, jobs, workers, quiet, music21=not direct)
+    with batch.ExportQueue(export_workers, processes=not direct, quiet=quiet, music21=not direct) as exports:
+        return batch.run(gen_job, jobs, workers, quiet, exports, music21=False)
 
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description='Sacred Harp meets Holly Herndon')
+    parser.add_argument('--seeds', help='generate one piece per seed of this range, given as first:last+1 (default: one random piece)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: %(default)s)')
+    parser.add_argument('--out', default='gen', help='output subdirectory of data/gen/ (default: %(default)s)')
+    parser.add_argument('--direct', action='store_true', help='write MusicXML directly, without music21')
+    parser.add_argument('--midi', action='store_true', help='also write a MIDI file of each piece')
+    parser.add_argument('--log-level', default='debug', choices=['debug', 'info', 'warning', 'error', 'quiet'], help='lowest level of the printed messages (default: %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='only print warnings and errors')
+    parser.add_argument('--log-json', metavar='FILE', help='also append the log records to FILE, as JSON lines')
+    parser.add_argument('--stats', action='store_true', help='count and time the calls of each rule, and report them after each generation, or totalled over the pieces of a batch')
+    parser.add_argument('--memory', action='store_true', help='profile the memory of each VP, node, generator and rule table (slow), and report it after each generation, or combined over the pieces of a batch')
+    parser.add_argument('--export-workers', type=int, default=0, help='export in that many background workers, overlapping with generation (default: export in the generation workers)')
+    args = parser.parse_args()
+    log.configure(log.WARNING if args.quiet else log.level_from(args.log_level), args.log_json, log.level_from(args.log_level))
+    instrument.enable(args.stats)
+    memory.enable(args.memory)
+
+    if args.seeds:
+        failures = gen_batch(batch.seed_range(args.seeds), args.workers, args.out, direct=args.direct, midi=args.midi, export_workers=args.export_workers)
+        sys.exit(1 if failures else 0)
+
     sh: ur.Model = gen_sacred()
-    sh.export('gen', 'SH meets HH', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'], False)
\ No newline at end of file
+    sh.export('gen', 'SH meets HH', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'], False, args.direct)
+    if args.midi:
+        sh.export_midi('gen', 'SH meets HH', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'])
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Scaling benchmark of the refinement trees, on synthetic structures of increasing size.
+
+Structures are generated with a given depth and fan-out, with a share of rest nodes (`~`)
+and of copy nodes (`'`, copying an earlier leaf). For each size, in a fresh process, the `gen_sacred` model is run
+on the structure, timing the tree operations separately:
+
+- `init`: `initialize_structure` of all VPs (and the memory taken by the refinement trees)
+- `windows`: iterating over all windows of 4 elements (`WindowIterator`) of the lead VP and of a fill-in VP
+- `subrange`: `get_subrange` on each of these windows
+- `set_to`: setting again each leaf of the lead VP to its content
+- `generate`: the full generation
+
+The growth exponent between two sizes (1 is linear in the number of leaves, 2 quadratic) points to the
+operations that do not scale.
+
+    python3 src/ur/scaling.py
+    python3 src/ur/scaling.py --sizes 1x8,2x8,3x8 --no-generate
+'''
+
+import argparse
+import concurrent.futures
+import copy
+import json
+import math
+import os
+import random
+import resource
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from rich import print
+
+import batch
+import bench
+import log
+import ur
+from trees import StructureNode
+
+OPERATIONS: List[str] = ['init', 'windows', 'subrange', 'set_to', 'generate']
+
+WINDOW: int = 4
+
+
+def synthetic_structure(depth: int, fanout: int, rests: float = 0.1, copies: float = 0.1, seed: int = 0) -> StructureNode:
+    """
+    A random structure of `fanout ** depth` leaves, of one unit each.
+    Inner nodes are named after their path (`N0.2`), leaves `L0.2.1`, rests `~<n>`,
+    and copies `L0.2.1'`, each copying a distinct earlier leaf. The first leaf is always a plain one.
+
+    :param rests: the share of rest leaves
+    :param copies: the share of copy leaves
+    """
+    rng: random.Random = random.Random(seed)
+    plain: List[str] = []
+    count: int = 0
+
+    def node(path: str, level: int, start: float) -> StructureNode:
+        nonlocal count
+        if level == depth:
+            count += 1
+            r: float = rng.random()
+            if plain and r < rests:
+                name: str = f'~{count}'
+            elif plain and r < rests + copies:
+                name = plain.pop(rng.randrange(len(plain))) + "'"
+            else:
+                name = f'L{path}'
+                plain.append(name)
+            return StructureNode(start, start + 1.0, name)
+        width: int = fanout ** (depth - level - 1)
+        children: List[StructureNode] = [node(f'{path}.{i}' if path else str(i), level + 1, float(i * width))
+                                         for i in range(fanout)]
+        return StructureNode(start, start + float(fanout * width), f'N{path}' if path else 'ALL', children)
+
+    return node('', 0, 0.0)
+
+
+def growth(t1: float, t2: float, n1: int, n2: int) -> Optional[float]:
+    '''The exponent k of t ~ n^k between two sizes
+    '''
+    if t1 <= 0 or t2 <= 0 or n1 == n2:
+        return None
+    return math.log(t2 / t1) / math.log(n2 / n1)
+
+
+def measure(depth: int, fanout: int, rests: float, copies: float, seed: int, generate: bool) -> Dict[str, Any]:
+    """
+    Time the tree operations on one synthetic structure, in the current (fresh) process.
+    """
+    import sacred
+    log.quiet()
+    struc: StructureNode = synthetic_structure(depth, fanout, rests, copies, seed)
+    random.seed(seed)
+    sh: ur.Model = sacred.model_sacred('P1', 'major', '4/4', copy.deepcopy(struc))
+    times: Dict[str, float] = {}
+
+    # initializing again, from empty VPs
+    for vp in sh.vps:
+        vp.out = []
+    tracemalloc.start()
+    t: float = time.perf_counter()
+    sh.set_structure(copy.deepcopy(struc))
+    times['init'] = time.perf_counter() - t
+    tree_kb: float = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+
+    if generate:
+        t = time.perf_counter()
+        sh.generate()
+        times['generate'] = time.perf_counter() - t
+
+    # before the windows: get_subrange splits the structure leaves
+    lead: Any = sh['rhy']
+    leaves: List[Any] = [n for n in lead.root.leaves if n.structure]
+    assert leaves, 'no structure leaf to set'
+    contents: List[list] = [lead[n.start:n.end] for n in leaves]
+    t = time.perf_counter()
+    for (n, content) in zip(leaves, contents):
+        n.set_to(content, n.fixedness)
+    times['set_to'] = time.perf_counter() - t
+
+    vps: List[Any] = [sh['rhy'], sh['fillInS']]
+    windows: List[Tuple[Any, List[Tuple[Any, Any]]]] = []
+    t = time.perf_counter()
+    for vp in vps:
+        windows.append((vp, [(s.child_index(vp.root), e.child_index(vp.root)) for (s, e) in ur.WindowIterator(WINDOW, vp.root)]))
+    times['windows'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for (vp, ws) in windows:
+        for (s, e) in ws:
+            vp.root.get_subrange(s, e)
+    times['subrange'] = time.perf_counter() - t
+
+    return {
+        'depth': depth,
+        'fanout': fanout,
+        'leaves': fanout ** depth,
+        'elements': len(lead.out),
+        'times': times,
+        'tree_kb': tree_kb,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def parse_sizes(sizes: str) -> List[Tuple[int, int]]:
+    '''Parse sizes given as `<depth>x<fanout>,...`
+    '''
+    result: List[Tuple[int, int]] = []
+    for size in sizes.split(','):
+        depth, fanout = size.split('x')
+        result.append((int(depth), int(fanout)))
+    return result
+
+
+def report(results: List[Dict[str, Any]]) -> None:
+    ops: List[str] = [op for op in OPERATIONS if any(op in r['times'] for r in results)]
+    print()
+    print(f'[yellow]{"size":5s} {"leaves":>6s} {"elts":>5s} ' + ' '.join(f'{op:>8s}' for op in ops) + f' {"trees":>7s} {"RSS":>5s}')
+    for r in results:
+        print(f'{str(r["depth"]) + "x" + str(r["fanout"]):5s} {r["leaves"]:6d} {r["elements"]:5d} '
+              + ' '.join(f'{1000 * r["times"][op]:8.2f}' if op in r['times'] else f'{"-":>8s}' for op in ops)
+              + f' {r["tree_kb"]:5.0f}KB {r["peak_rss_mb"]:3.0f}MB')
+    print('(times in ms)')
+
+    # growth between consecutive sizes, by number of leaves
+    by_leaves: List[Dict[str, Any]] = sorted(results, key=lambda r: r['leaves'])
+    print()
+    print(f'[yellow]{"growth (leaves)":17s} ' + ' '.join(f'{op:>8s}' for op in ops + ['trees']))
+    for (r1, r2) in zip(by_leaves, by_leaves[1:]):
+        if r1['leaves'] == r2['leaves']:
+            continue
+        ks: List[Optional[float]] = [growth(r1['times'][op], r2['times'][op], r1['leaves'], r2['leaves'])
+                                     if op in r1['times'] and op in r2['times'] else None for op in ops]
+        ks.append(growth(r1['tree_kb'], r2['tree_kb'], r1['leaves'], r2['leaves']))
+        print(f'{str(r1["leaves"]) + " -> " + str(r2["leaves"]):17s} '
+              + ' '.join(f'{"-":>8s}' if k is None else f'{"n^" + format(k, ".2f"):>8s}' for k in ks))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Ur tree scaling benchmark')
+    parser.add_argument('--sizes', default='1x4,1x8,2x4,1x16,2x6,1x32', help='structures, as <depth>x<fan-out>,... (default: %(default)s)')
+    parser.add_argument('--rests', type=float, default=0.1, help='share of rest leaves (default: %(default)s)')
+    parser.add_argument('--copies', type=float, default=0.1, help="share of copy leaves (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help='seed of the structures and of the generation (default: %(default)s)')
+    parser.add_argument('--no-generate', action='store_true', help='skip the full generation (tree operations on one element per leaf)')
+    parser.add_argument('--out', help='JSON results file (none by default)')
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for (depth, fanout) in parse_sizes(args.sizes):
+        print(f'[yellow]### {depth}x{fanout}: {fanout ** depth} leaves')
+        # a fresh process per size: isolated module state and peak RSS
+        with concurrent.futures.ProcessPoolExecutor(1, initializer=batch.init_worker, initargs=(True,)) as pool:
+            results.append(pool.submit(measure, depth, fanout, args.rests, args.copies, args.seed, not args.no_generate).result())
+
+    report(results)
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump({'meta': bench.metadata(), 'args': vars(args), 'results': results}, f, indent=2)
+        print(f'[green]==> {args.out}')
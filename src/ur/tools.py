@@ -1,7 +1,7 @@
 
 
 import random
-import bisect, itertools
+import bisect, itertools, math
 
 
 def dict_to_list2(d):
@@ -76,4 +76,13 @@ def ellipsis_str(l, start=5, end=0, lines=False, f=str, indent=''):
 
 def pretty_dict(d):
     for k in self.data.keys():
-        s += str(k) + ': [%s]' % ' '.join(map(str, self.data))        
\ No newline at end of file
+        s += str(k) + ': [%s]' % ' '.join(map(str, self.data))        
+
+# ---------------------------------------------------------------------------------
+
+def percentile(l, q):
+    '''Nearest-rank q-th percentile (0 <= q <= 100) of a non-empty list
+    '''
+    s = sorted(l)
+    i = max(0, min(len(s) - 1, math.ceil(q / 100 * len(s)) - 1))
+    return s[i]
@@ -1,13 +1,14 @@
 
 from __future__ import annotations
-from anytree import NodeMixin, RenderTree, PreOrderIter
+from anytree import RenderTree
 from anytree.exporter import DotExporter
-from typing import Self, Generic, TypeVar, Optional, Callable, Dict, List, NewType, Protocol, SupportsIndex, Tuple, Union, overload, Type
+from typing import Self, Generic, TypeVar, Optional, Callable, Dict, Iterable, Iterator, List, NewType, Protocol, SupportsIndex, Tuple, Union, overload, Type
 import copy
 import music
 from functools import reduce
 import operator
 import ur
+import log
 from abc import ABC, abstractmethod
 
 # Content type
@@ -27,6 +28,8 @@ class Numeric(Protocol):
 
 
 class Index:
+    __slots__ = ('quarter', 'pos', 'node')
+
     def __init__(self, quarter: float, pos: int, node: RefinementNode):
         self.quarter: float = quarter
         self.pos: int = pos
@@ -64,36 +67,14 @@ class Index:
         return self.__class__(self.quarter - other.quarter, self.pos - other.pos, self.node)
 
     def maps_to(self, pos: int, level: int) -> bool:
+        ''' Whether self is at offset pos (from the end if negative, -1 being the last element)
+        of the node containing it at the given level (or of the deepest node above it) '''
         assert level >= 0
-        level_ctr: int = self.node.depth
-        ptr: RefinementNode = self.node
-        if level_ctr <= level:
-            acc: int = self.node.start.pos
-            while level_ctr < level:
-                for c in ptr.children:
-                    if c.end.pos + acc > self.pos:
-                        ptr = c
-                        acc += c.start.pos
-                        break
-                level_ctr += 1
-            if pos >= 0:
-                return acc + pos == self.pos
-            else:
-                return acc + ptr.get_elt_count() + pos == self.pos
-        else:
-            acc = 0
-            while True:
-                ptr = ptr.parent
-                level_ctr -= 1
-                if level_ctr == level:
-                    break
-                acc +=  ptr.start.pos
-            if pos >= 0:
-                return acc + self.pos == pos
-            else:
-                return acc + self.pos == ptr.get_elt_count() + pos
-
+        return self.node.vp.positions().maps_to(self.relative_p(), pos, level)
 
+    def position(self, level: int) -> Tuple[int, int, str]:
+        ''' (offset from start, offset from end, label) of self in the node containing it at the given level '''
+        return self.node.vp.positions().at(self.relative_p(), level)
 
     def relative_p(self, label: str = 'ALL') -> int:
         if self.node.name == label:
@@ -125,14 +106,156 @@ class Index:
                               self.pos - self.node.start.pos,
                               child)
 
-class Node(NodeMixin, Generic[I]):
+class Positions:
+    """
+    The structural position of each element of a VP: at each level of its refinement tree,
+    the offsets of the element from the start and from the end (-1 for the last element) of the node containing it,
+    and the label of that node. Below the leaves, the deepest node containing the element is used.
 
-    def __init__(self, start: I, end: I, name: str, children: List[Self] = []):
+    Built in one pass over the tree, so that position guards are lookups instead of tree walks.
+    """
+
+    def __init__(self, root: RefinementNode):
+        count: int = root.get_elt_count()
+        self.levels: int = 1 + max(n.depth for n in root.preorder())
+        self.from_start: List[List[int]] = [[0] * count for _ in range(self.levels)]
+        self.from_end: List[List[int]] = [[0] * count for _ in range(self.levels)]
+        self.labels: List[List[str]] = [[''] * count for _ in range(self.levels)]
+        self.fill(root, 0, 0)
+
+    def fill(self, node: RefinementNode, offset: int, level: int) -> None:
+        count: int = node.get_elt_count()
+        for l in range(level, self.levels):
+            self.from_start[l][offset:offset + count] = range(count)
+            self.from_end[l][offset:offset + count] = range(-count, 0)
+            self.labels[l][offset:offset + count] = [node.name] * count
+        for c in node.children:
+            self.fill(c, offset + c.start.pos, level + 1)
+
+    def at(self, i: int, level: int) -> Tuple[int, int, str]:
+        ''' (offset from start, offset from end, label) of the element at position i '''
+        level = min(level, self.levels - 1)
+        return (self.from_start[level][i], self.from_end[level][i], self.labels[level][i])
+
+    def maps_to(self, i: int, pos: int, level: int) -> bool:
+        level = min(level, self.levels - 1)
+        return (self.from_start if pos >= 0 else self.from_end)[level][i] == pos
+
+
+class Node(Generic[I]):
+    """
+    A node of an ordered tree, with slots instead of an instance dict and a cached depth.
+    It has the read interface of anytree nodes (`parent`, `children`, `depth`, `root`, `path`, `ancestors`,
+    `descendants`, `leaves`, `siblings`, `is_root`, `is_leaf`), so that anytree's `RenderTree` and `DotExporter` work on it.
+    """
+    __slots__ = ('start', 'end', 'name', '_parent', '_children', 'depth')
+
+    def __init__(self, start: I, end: I, name: str, children: Iterable[Self] = ()):
         self.start: I = start
         self.end: I = end
         self.name: str = name
-        # ORDERED list of children
-        self.children: List[Self] = children
+        self._parent: Optional[Self] = None
+        self._children: List[Self] = []
+        self.depth: int = 0
+        self.children = children
+
+    @property
+    def parent(self) -> Optional[Self]:
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent: Optional[Self]) -> None:
+        self.detach()
+        if parent is not None:
+            parent._children.append(self)
+        self.attach(parent)
+
+    @property
+    def children(self) -> List[Self]:
+        ''' ORDERED list of children: not to be modified in place (set it, or use insert_child) '''
+        return self._children
+
+    @children.setter
+    def children(self, children: Iterable[Self]) -> None:
+        children = list(children)
+        for c in self._children:
+            c.attach(None)
+        self._children = []
+        for c in children:
+            c.detach()
+        self._children = children
+        for c in children:
+            c.attach(self)
+
+    def insert_child(self, i: int, child: Self) -> None:
+        child.detach()
+        self._children.insert(i, child)
+        child.attach(self)
+
+    def detach(self) -> None:
+        ''' Remove self from the children of its parent (keeping its parent link, to be set by attach) '''
+        if self._parent is not None:
+            self._parent._children.remove(self)
+
+    def attach(self, parent: Optional[Self]) -> None:
+        ''' Link self to its parent, and update the depths of its subtree '''
+        self._parent = parent
+        delta: int = (0 if parent is None else parent.depth + 1) - self.depth
+        if delta:
+            for n in self.preorder():
+                n.depth += delta
+
+    @property
+    def is_root(self) -> bool:
+        return self._parent is None
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self._children
+
+    @property
+    def root(self) -> Self:
+        n: Self = self
+        while n._parent is not None:
+            n = n._parent
+        return n
+
+    @property
+    def path(self) -> Tuple[Self, ...]:
+        ''' the nodes from the root down to self '''
+        path: List[Self] = []
+        n: Optional[Self] = self
+        while n is not None:
+            path.append(n)
+            n = n._parent
+        return tuple(reversed(path))
+
+    @property
+    def ancestors(self) -> Tuple[Self, ...]:
+        return self.path[:-1]
+
+    @property
+    def descendants(self) -> Tuple[Self, ...]:
+        return tuple(self.preorder())[1:]
+
+    @property
+    def leaves(self) -> Tuple[Self, ...]:
+        ''' the leaves of the subtree of self, in pre-order '''
+        return tuple(n for n in self.preorder() if not n._children)
+
+    @property
+    def siblings(self) -> Tuple[Self, ...]:
+        if self._parent is None:
+            return ()
+        return tuple(c for c in self._parent._children if c is not self)
+
+    def preorder(self) -> Iterator[Self]:
+        ''' self and all its descendants, in pre-order '''
+        stack: List[Self] = [self]
+        while stack:
+            n: Self = stack.pop()
+            yield n
+            stack.extend(reversed(n._children))
 
     def export_to_dot(self, filename: str) -> None:
         with open(filename, 'w') as file:
@@ -142,7 +265,9 @@ class StructureNode(Node[float]):
     """
     A node of a Structure Tree.
     """
-    def __init__(self, start: float, end: float, name: str, children: List[Self] = []):
+    __slots__ = ()
+
+    def __init__(self, start: float, end: float, name: str, children: Iterable[Self] = ()):
         super().__init__(start, end, name, children)
 
     def __str__(self) -> str:
@@ -156,8 +281,9 @@ class RefinementNode(Node[Index]):
     """
     A node of a (non-structure) Refinement Tree.
     """
+    __slots__ = ('copy_of', 'generatable', 'generator', 'fixedness', 'structure', 'vp')
 
-    def __init__(self, start: Tuple[float, int] | Index, end: Tuple[float, int] | Index, name: str, vp: ViewPoint, children: List[Self] = [], structure: bool = False):
+    def __init__(self, start: Tuple[float, int] | Index, end: Tuple[float, int] | Index, name: str, vp: ViewPoint, children: Iterable[Self] = (), structure: bool = False):
         if isinstance(start, tuple):
             my_start: Index = Index(*start, self)
         else:
@@ -215,6 +341,7 @@ class RefinementNode(Node[Index]):
             self.parent.update_fixedness()
 
     def increase_size(self, delta: int) -> None:
+        self.vp.position_index = None
         self.end.pos = self.end.pos + delta
         if self.parent is not None:
             ind: int = self.parent.children.index(self)
@@ -257,6 +384,13 @@ class RefinementNode(Node[Index]):
             vp.nodes[self.name].set_to([vp.undefined()] * len(content), 0.0, False)
 
 
+    def set_to_copy(self, fixedness: float) -> None:
+        ''' Set the content to the one of the copied node (copy_of, coming before in the VP).
+        The elements are shared with it, not duplicated: as they are never modified in place,
+        the copy only diverges from its source when its content is set again. '''
+        assert self.copy_of is not None
+        self.set_to(self.vp.out[self.copy_of.start.relative_p():self.copy_of.end.relative_p()], fixedness)
+
     def set_generator(self, prod: ur.Producer) -> ur.Generator:
         new_gen: ur.Generator = ur.Generator(self, prod, self.vp.model.batch_size)
         self.generator = new_gen
@@ -268,7 +402,7 @@ class RefinementNode(Node[Index]):
         for p in self.vp.producers:
             # Dispatch by node: just call p on all descendants
             if p.DISPATCH_BY_NODE:
-                for n in [self] + list(self.descendants):
+                for n in self.preorder():
                     if p.guard(n):
                         generators.append(n.set_generator(p))
                 return generators
@@ -308,7 +442,7 @@ class RefinementNode(Node[Index]):
         if self.fixedness > 0.0:
             return
         if self.copy_of is not None:
-            self.set_to(self.vp[self.copy_of.start:self.copy_of.end], 1.0)
+            self.set_to_copy(1.0)
         if not self.generatable:
             for c in self.children:
                 c.generate()
@@ -354,8 +488,8 @@ class RefinementNode(Node[Index]):
 
         if result == []: # [start, end) is outside any child: create new one
             new_node = RefinementNode(start, end, "", self.vp)
-            #new_node.parent = self
-            self.children = list(self.children[:ctr]) + [new_node] + list(self.children[ctr:])
+            self.insert_child(ctr, new_node)
+            self.vp.position_index = None
             result = [new_node]
         return result
 
@@ -377,6 +511,8 @@ class ViewPoint(Generic[C]):
         self.fixed_count_in: Optional[ViewPoint] = None
         self.default_prod: ur.Producer
         self.gapless: bool = gapless
+        # structural positions of the elements, dropped when the refinement tree changes
+        self.position_index: Optional[Positions] = None
 
     def init(self) -> None:
         self.producers.sort(key = lambda p: p.fixedness, reverse = True)
@@ -432,6 +568,11 @@ class ViewPoint(Generic[C]):
         out += "\n\n" + str(self.root) + "\n\n"
         return out
 
+    def positions(self) -> Positions:
+        if self.position_index is None:
+            self.position_index = Positions(self.root)
+        return self.position_index
+
     def fixed_count(self) -> bool:
         return self.fixed_count_in is not None and self.fixed_count_in.generated
 
@@ -441,8 +582,9 @@ class ViewPoint(Generic[C]):
     def initialize_structure(self) -> None:
         self.nodes: Dict[str, RefinementNode] = {}
         self.root: RefinementNode = self.copy_struc_node(self.model.structure)
+        self.position_index = None
         i: int = 0
-        for n in PreOrderIter(self.root):
+        for n in self.root.preorder():
             self.nodes[n.name] = n
             # handling rests
             if n.name[0] == '~':
@@ -478,13 +620,13 @@ class ViewPoint(Generic[C]):
         self.generated = True
 
         # update structure node durations from model structure
-        for node in PreOrderIter(self.model.structure):
+        for node in self.model.structure.preorder():
             peer_node = self.nodes[node.name]
             peer_node.start.quarter = node.start
             peer_node.end.quarter = node.end
         
         self.root.generate()
-        print(self)
+        log.debug('%s', self, event='generated', vp=self.name)
 
     def export_text(self, lead: ViewPoint) -> List[str]:
         assert isinstance(lead, ViewPointLead)
@@ -514,7 +656,7 @@ class ViewPointLead(ViewPoint[T]):
         # lead VP needs to be set first
         self.generated = True
         new_content: List[T] = []
-        for n in PreOrderIter(self.root):
+        for n in self.root.preorder():
 
             # only set content of leafs
             if n.children:
@@ -529,12 +671,12 @@ class ViewPointLead(ViewPoint[T]):
                     break
             if n.copy_of and self.use_copy:
                 # assume other n.copy_of is already set (-> only backward copy edges)
-                n.set_to(self[n.copy_of.start:n.copy_of.end], fixedness)
+                n.set_to_copy(fixedness)
             else:
                 n.set_to(new_content, fixedness)
             new_content = []
 
-        print(self)
+        log.debug('%s', self, event='initialized', vp=self.name)
 
     def get_leader(self) -> ViewPointLead:
         return self
@@ -542,7 +684,7 @@ class ViewPointLead(ViewPoint[T]):
     def generate(self) -> None:
         super().generate()
         # after generation, write new node durations into the model's structure tree
-        for node in PreOrderIter(self.model.structure):
+        for node in self.model.structure.preorder():
             peer_node = self.nodes[node.name]
             node.start = peer_node.start.quarter
             node.end = peer_node.end.quarter
@@ -557,7 +699,7 @@ class ViewPointFollow(ViewPoint[C]):
         # assume that fixed_count_in VP is set first
         assert self.fixed_count_in is not None and self.fixed_count_in.generated
         self.generated = True
-        for n in PreOrderIter(self.root):
+        for n in self.root.preorder():
 
             # only set content of leafs
             if n.children:
@@ -565,7 +707,7 @@ class ViewPointFollow(ViewPoint[C]):
             new_content: List[C] = l[:n.get_elt_count()]
             l = l[n.get_elt_count():]
             if n.copy_of and self.use_copy:
-                n.set_to(self[n.copy_of.start:n.copy_of.end], fixedness)
+                n.set_to_copy(fixedness)
             else:
                 n.set_to(new_content, fixedness)
 
@@ -28,11 +28,15 @@ from __future__ import annotations
 from typing import Any, List, Generic, Type
 from tools import *
 from collections import defaultdict
-from rich import print
+import time
 import music as m
 import flourish
 import nonchord
 import export
+import instrument
+import log
+import markovfile
+import memory
 import tools
 
 from trees import *
@@ -469,6 +473,21 @@ class HiddenMarkov(RandomizedProducer[C]):
     TRANSITIONS: Dict[str, Dict[str, float]]
     EMISSIONS: Dict[str, Dict[str, float]]
 
+    # compiled tables (see markovfile.py), as (path, model name): the tables that the class does not define
+    # are loaded from there on first use
+    MODEL: Optional[Tuple[str, str]] = None
+
+    def __getattr__(self, name: str) -> Any:
+        if name in markovfile.TABLES and self.MODEL is not None:
+            (path, model) = self.MODEL
+            try:
+                table: Any = markovfile.load(path)[model][name]
+            except KeyError:
+                raise AttributeError(f"'{type(self).__name__}' has no {name}, neither in its class nor in {path}")
+            setattr(self, name, table)
+            return table
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
     def state_legal(self, state: Optional[str]) -> bool:
         '''Return whether state is legal
         '''
@@ -522,13 +541,70 @@ class HiddenMarkov(RandomizedProducer[C]):
 
 class Markov(HiddenMarkov[C]):
     """
-    A base class for (order 1) Markov producers.
+    A base class for Markov producers, of order 1 (`TRANSITIONS`) or higher.
+
+    Producers of order n draw each state from the counts of the sequences of n states (`NGRAMS`, see markovfile.py)
+    following the last n - 1 states, generated or in the pre context, backing off to shorter contexts
+    when the context was not seen in the corpus, or has no legal successor.
     """
-    
+
+    ORDER: int = 1
+
     def __init__(self):
         self.EMISSIONS = {
             x: defaultdict(float, {x: 1.00}) for x in self.STATES
         }
+        # successor weights by context, for the order n
+        self.successor_cache: Dict[Tuple[str, ...], Dict[str, float]] = {}
+
+    def transition_legal(self, state: str) -> bool:
+        '''Return whether transitions may lead to state
+        '''
+        return True
+
+    def successors(self, context: Tuple[str, ...]) -> Dict[str, float]:
+        '''The weights of the legal states following context, with backoff
+        '''
+        weights: Optional[Dict[str, float]] = self.successor_cache.get(context)
+        if weights is None:
+            for k in range(len(context) + 1):
+                weights = {s: c for (s, c) in self.NGRAMS.successors(context[k:]).items() if self.transition_legal(s)}
+                if weights:
+                    break
+            else:
+                raise RuntimeError(f'{type(self).__name__}: no legal state, even without context')
+            self.successor_cache[context] = weights
+        return weights
+
+    def history(self, pre_context: List[C]) -> List[str]:
+        '''The last states of the pre context, up to the first undefined one
+        '''
+        states: List[str] = []
+        for c in reversed(pre_context[-(self.ORDER - 1):]):
+            if c.is_undefined():
+                break
+            states.insert(0, str(c))
+        return states
+
+    def produce(self, pre_context: List[C], post_context: List[C], len_to_gen: Interval) -> List[C]:
+        if self.ORDER == 1:
+            return super().produce(pre_context, post_context, len_to_gen)
+
+        states: List[str] = []
+        while len(states) not in len_to_gen:
+            # otherwise the final states constraint has led to a too long sequence
+            context: List[str] = self.history(pre_context)
+            states = []
+            while not states or len(states) < len_to_gen.min or not self.state_final(states[-1]):
+                state: Optional[str] = None
+                if not context and not states:
+                    state = pwchoice(self.INITIAL)
+                while not self.state_legal(state):
+                    state = pwchoice(self.successors(tuple((context + states)[-(self.ORDER - 1):])))
+                assert state
+                states.append(state)
+
+        return [self.vp_out.content_cls(s) for s in states]
 
  
 class PitchMarkov(Markov[m.Pitch]):
@@ -554,20 +630,28 @@ class PitchMarkov(Markov[m.Pitch]):
             return False
         return m.in_range(pitch, self.AMBITUS, self.key)
 
+    def transition_legal(self, pitch: str) -> bool:
+        return m.in_range(pitch, self.AMBITUS, self.key) and '#' not in pitch and '-' not in pitch
+
     def set_key(self, key: str) -> None:
         ''' Adapt transitions and states to key
         '''
         self.key = key
-
-        for n1 in list(self.TRANSITIONS):
-            for n2 in list(self.TRANSITIONS[n1]):
-                if not m.in_range(n2, self.AMBITUS, self.key) or '#' in n2 or '-' in n2:
-                    del self.TRANSITIONS[n1][n2]
-                    if len(self.TRANSITIONS[n1]) == 0:
-                        del self.TRANSITIONS[n1]
-        for n in list(self.INITIAL):
-            if not m.in_range(n, self.AMBITUS_INITIAL, self.key):
-                self.INITIAL.remove(n)
+        self.successor_cache = {}
+
+        # prune copies, so that class (or compiled) tables stay intact for the next instances
+        # (the n-grams of higher orders are pruned when sampled)
+        if self.ORDER == 1:
+            transitions: defaultdict[str, defaultdict[str, float]] = defaultdict(lambda: defaultdict(float))
+            for (n1, successors) in self.TRANSITIONS.items():
+                kept = defaultdict(float, {n2: p for (n2, p) in successors.items() if self.transition_legal(n2)})
+                if kept:
+                    transitions[n1] = kept
+            self.TRANSITIONS = transitions
+        if isinstance(self.INITIAL, dict):
+            self.INITIAL = {n: p for (n, p) in self.INITIAL.items() if m.in_range(n, self.AMBITUS_INITIAL, self.key)}
+        else:
+            self.INITIAL = [n for n in self.INITIAL if m.in_range(n, self.AMBITUS_INITIAL, self.key)]
 
 
 ### Model
@@ -702,12 +786,46 @@ class Model:
     def generate(self) -> None:
         """
         Execute the model.
+        The generation time of each VP is kept in `self.timings`.
+        When instrumentation is enabled (`instrument.enable`), the calls of all rules are counted and timed,
+        and reported at the end (kept in `self.stats`).
+        When memory profiling is enabled (`memory.enable`), the memory of each VP, node, generator and rule table
+        is reported at the end (kept in `self.memory`).
         """
-        for vp in self.vps:
-            print(f'[yellow]### generate VP \'{vp.name}\'')
-            vp.generate()
-
-    def export(self, filename: str, title: str, lyr_vp: str, melody_vp_names: List[str], annot_vp_names: List[str], svg: bool = False) -> None:
+        stats: Optional[instrument.Stats] = None
+        if instrument.enabled:
+            stats = instrument.Stats()
+            stats.attach(self)
+        profile: Optional[memory.Profile] = None
+        if memory.enabled:
+            profile = memory.Profile(self)
+        # generation time of each VP, in seconds
+        self.timings: Dict[str, float] = {}
+        try:
+            for vp in self.vps:
+                log.info("### generate VP '%s'", vp.name, style='yellow', event='generate', vp=vp.name)
+                if stats:
+                    stats.vp = vp.name
+                if profile:
+                    profile.before_vp()
+                t: float = time.perf_counter()
+                vp.generate()
+                self.timings[vp.name] = time.perf_counter() - t
+                if profile:
+                    profile.after_vp(vp)
+        finally:
+            if stats:
+                stats.detach()
+                self.stats: instrument.Stats = stats
+            if profile:
+                profile.finish(self)
+                self.memory: memory.Profile = profile
+        if stats:
+            stats.report()
+        if profile:
+            profile.report()
+
+    def export(self, filename: str, title: str, lyr_vp: str, melody_vp_names: List[str], annot_vp_names: List[str], svg: bool = False, direct: bool = False) -> None:
         """
         Export the current model state as a piece in `musicxml` format.
 
@@ -717,11 +835,47 @@ class Model:
         :param melody_vp_names: The names of the VPs containing the individual parts, ordered as they shall appear in the score.
         :param annot_vp_names: The names of the VPs containing additional annotations to be displayed below the lowest part.
         :param svg: Additionally save piece as svg via Verovio?
+        :param direct: Write the `musicxml` file directly, without building music21 objects?
+        """
+        log.info('## Exporting', style='yellow', event='export', filename=filename)
+        melodies, annots = self.export_contents(lyr_vp, melody_vp_names, annot_vp_names)
+        export.export(filename, title, melodies, annots, self.key, self.meter, svg, direct)
+
+    def export_midi(self, filename: str, title: str, lyr_vp: str, melody_vp_names: List[str], annot_vp_names: List[str]) -> None:
+        """
+        Export the current model state as a multi-track Standard MIDI File, without music21.
+        Lyrics are written as lyric events of each part, annotations as markers.
+
+        :param filename: The name of the output file.
+        :param title: The title of the piece.
+        :param lyr_vp: The name of the VP containing lyrics (common to all parts).
+        :param melody_vp_names: The names of the VPs containing the individual parts, one track each.
+        :param annot_vp_names: The names of the VPs containing additional annotations, aligned with the last part.
+        """
+        log.info('## Exporting', style='yellow', event='export', filename=filename)
+        melodies, annots = self.export_contents(lyr_vp, melody_vp_names, annot_vp_names)
+        export.export_midi(filename, title, melodies, annots, self.key, self.mode, self.meter)
+
+    def snapshot(self, filename: str, title: str, lyr_vp: str, melody_vp_names: List[str], annot_vp_names: List[str], svg: bool = False, direct: bool = False, midi: bool = False) -> export.Piece:
+        """
+        Take an immutable snapshot of the current model state, to be exported later, possibly in another thread or process (see `export.write`).
+        Arguments are those of `export` and `export_midi`.
+
+        :param midi: Also write a MIDI file?
+        """
+        melodies, annots = self.export_contents(lyr_vp, melody_vp_names, annot_vp_names)
+        return export.Piece(filename, title,
+                            tuple((vp, tuple(mel), tuple(lyr)) for vp, mel, lyr in melodies),
+                            tuple((vp, tuple(annot)) for vp, annot in annots),
+                            self.key, self.mode, self.meter, svg, direct, midi)
+
+    def export_contents(self, lyr_vp: str, melody_vp_names: List[str], annot_vp_names: List[str]) -> Tuple[List[Tuple[str, List[m.Note], List[str]]], List[Tuple[str, List[str]]]]:
+        """
+        Gather the parts (with their lyrics) and the annotations to export.
         """
-        print('[yellow]## Exporting')
         melodies = [(vp,
                      self[vp][:],
                      self[lyr_vp].export_text(self[vp])) for vp in melody_vp_names]
         annots   = [(vp, \
                      self[vp].export_text(self[melody_vp_names[-1]])) for vp in annot_vp_names]
-        export.export(filename, title, melodies, annots, self.key, self.meter, svg)
\ No newline at end of file
+        return (melodies, annots)
\ No newline at end of file
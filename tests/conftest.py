@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the Ur modules import each other as top-level modules, and read their data relative to the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'ur'))
+os.chdir(ROOT)
@@ -0,0 +1,26 @@
+'''
+Every score of the corpora is indexed, MusicXML and MIDI alike, with the key and mode of its signature and tenor.
+'''
+
+import pytest
+
+import catalog
+
+
+@pytest.fixture(scope='module')
+def built(tmp_path_factory):
+    return catalog.build(path=str(tmp_path_factory.mktemp('catalog') / 'catalog.json'))
+
+
+def test_build_indexes_every_score(built):
+    assert built.failures == {}
+    harp = built.query(corpus='data/the-scared-harp')
+    assert len(harp) == 30
+    assert all(e.key is not None and e.parts for e in harp)
+
+
+def test_major_tune_queries_as_major(built):
+    paths = [e.path for e in built.query(mode='major', tonic='A')]
+    assert 'data/1991-denson/100.mxl' in paths
+    assert 'data/1991-denson/100.mxl' not in [e.path for e in built.query(mode='minor')]
+    assert built.query(mode='minor') and built.query(mode='major')
@@ -0,0 +1,39 @@
+'''
+The direct MusicXML writer gives the same score as the music21 export.
+'''
+
+import random
+
+import pytest
+from music21 import converter
+
+import export
+import sacred
+
+
+def contents(f):
+    '''the parts of a score, as (offset, duration, pitch, tie, lyric) of their notes and rests
+    '''
+    score = converter.parse(f)
+    return [[(float(n.offset), float(n.quarterLength),
+              n.pitch.nameWithOctave if n.isNote else None,
+              n.tie.type if n.tie is not None else None,
+              n.lyric)
+             for n in p.flatten().notesAndRests] for p in score.parts]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_direct_export_matches_music21(seed, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'DIR_OUT', str(tmp_path))
+    random.seed(seed)
+    piece = sacred.gen_sacred().snapshot(f'gen-{seed}', f'gen {seed}', 'lyr', ['fillInS', 'fillInA', 'fillInT', 'fillInB'], ['chords'])
+    melodies = [(name, list(mel), list(lyr)) for (name, mel, lyr) in piece.melodies]
+    annots = [(name, list(annot)) for (name, annot) in piece.annots]
+    for direct in (False, True):
+        export.export(f'{"direct" if direct else "music21"}-{seed}', piece.title, melodies, annots, piece.key, piece.meter, False, direct)
+
+    music21_parts = contents(tmp_path / f'music21-{seed}.mxl')
+    direct_parts = contents(tmp_path / f'direct-{seed}.mxl')
+    assert len(direct_parts) == len(music21_parts)
+    for (d, m) in zip(direct_parts, music21_parts):
+        assert d == m
@@ -0,0 +1,44 @@
+'''
+The rule statistics and memory profiles of the jobs of a batch are combined into one report.
+'''
+
+import instrument
+import memory
+
+
+def stats(calls: int, time: float) -> dict:
+    s = instrument.Stats()
+    s.vp = 'rhy'
+    c = s.counter(object(), 'valid')
+    c.calls, c.time, c.rejected = calls, time, 1
+    s.detach()
+    s.elapsed = 2 * time
+    return s.to_dict()
+
+
+def test_stats_are_totalled():
+    total = instrument.merge([stats(3, 0.5), stats(5, 1.0)])
+    assert total['vps']['rhy']['object']['valid'] == {'calls': 8, 'time': 1.5, 'outputs': 0, 'rejected': 2}
+    assert total['rules']['object']['valid']['calls'] == 8
+    assert total['elapsed'] == 3.0
+    assert 'generation: 3.000s' in instrument.table(total)
+
+
+def profile(pid: int, model: int, retained: int, growth: int) -> dict:
+    return {
+        'pid': pid, 'model': model, 'start': 0,
+        'vps': {'rhy': {'retained': retained, 'peak': retained, 'content': 1, 'tree': 1, 'nodes': 1, 'generators': 1,
+                        'sites': {f'site{retained}': retained}}},
+        'rules': [{'rule': 'Scorer', 'vp': 'rhy', 'tables': retained, 'keys': 1, 'inserted': 0}],
+        'leak': None if model < 3 else {'growth': growth, 'sites': {}},
+    }
+
+
+def test_memory_profiles_keep_the_largest():
+    merged = memory.merge([profile(1, 3, 100, 10), profile(2, 3, 300, 50), profile(1, 4, 200, 20)])
+    assert merged['vps']['rhy']['retained'] == 300
+    assert merged['vps']['rhy']['sites'] == {'site300': 300}
+    assert merged['rules'][0]['tables'] == 300
+    # the last model of each process, the one growing the most per model
+    assert (merged['pid'], merged['model'], merged['leak']['growth']) == (2, 3, 50)
+    assert 'leak check: model 3' in memory.table(merged)
@@ -0,0 +1,30 @@
+'''
+A seeded generation only depends on its seed, not on what the worker process did before.
+'''
+
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+# the digest of the snapshot of the last of the given seeds, generated in one fresh process
+JOB = '''
+import hashlib, sys
+import sacred
+for seed in sys.argv[1:]:
+    _, _, piece = sacred.gen_job(int(seed), 'test', deferred=True)
+melodies = [(name, [str(n) for n in notes], lyrics) for (name, notes, lyrics) in piece.melodies]
+print(hashlib.sha1(repr((melodies, piece.annots, piece.key, piece.mode, piece.meter)).encode()).hexdigest())
+'''
+
+
+def snapshot_digest(*seeds: int) -> str:
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src', 'ur'))
+    out = subprocess.run([sys.executable, '-c', JOB, *map(str, seeds)], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return out.split()[-1]
+
+
+def test_seed_fresh_and_after_another_job():
+    assert snapshot_digest(7) == snapshot_digest(3, 7)
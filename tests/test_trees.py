@@ -0,0 +1,37 @@
+'''
+The slotted tree nodes answer the anytree accessors as anytree nodes do.
+'''
+
+import anytree
+
+import ur  # noqa: F401 (trees is imported through ur)
+import trees
+
+ACCESSORS = ['depth', 'is_root', 'is_leaf', 'root', 'path', 'ancestors', 'descendants', 'leaves', 'siblings']
+
+
+def build(cls, shape, name='r'):
+    return cls(name, children=[build(cls, s, f'{name}{i}') for (i, s) in enumerate(shape)])
+
+
+class Named(trees.Node):
+    __slots__ = ()
+
+    def __init__(self, name, children=()):
+        super().__init__(0, 0, name, children)
+
+
+def test_accessors_match_anytree():
+    shape = [[[], [[], []]], [], [[[]]]]
+    ours = list(build(Named, shape).preorder())
+    theirs = list(anytree.PreOrderIter(build(anytree.Node, shape)))
+    assert [n.name for n in ours] == [n.name for n in theirs]
+    for (a, b) in zip(ours, theirs):
+        for accessor in ACCESSORS:
+            x, y = getattr(a, accessor), getattr(b, accessor)
+            if isinstance(x, tuple):
+                assert [n.name for n in x] == [n.name for n in y], (a.name, accessor)
+            elif isinstance(x, trees.Node):
+                assert x.name == y.name, (a.name, accessor)
+            else:
+                assert x == y, (a.name, accessor)